@@ -0,0 +1,300 @@
+import multiprocessing
+import time
+from typing import Any, Mapping, Optional
+
+import gym
+import numpy as np
+import torch as th
+from absl import logging
+from stable_baselines3.common.utils import configure_logger
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from shm_arrays import SharedArrays
+from vec_env import PortAllocator
+
+
+class _SpacesEnv(gym.Env):
+    """Declares the spaces of `CarlaEnv` to a learner that never steps an env itself."""
+
+    def __init__(self, observation_space, action_space):
+        self.observation_space = observation_space
+        self.action_space = action_space
+
+    def reset(self):
+        return self.observation_space.sample()
+
+    def step(self, action):
+        raise NotImplementedError("the actor-learner learner only trains from its replay buffer")
+
+
+def _zero_schedule(_):
+    return 0.0
+
+
+class TransitionRing(object):
+    """Single-producer single-consumer ring of transitions in shared memory.
+
+    A collector `put`s one transition at a time and blocks while the ring is
+    full; the learner reads the oldest unread ones with `peek` and `advance`.
+    `written` and `read` are monotonic counters in shared memory, a slot is
+    published by bumping `written` after its arrays are filled.
+    """
+
+    def __init__(self, capacity: int, obs_shape, obs_dtype, action_dim: int, _shared=None):
+        self.capacity = capacity
+        self.shared = _shared or SharedArrays({
+            'obs': ((capacity, *obs_shape), obs_dtype),
+            'next_obs': ((capacity, *obs_shape), obs_dtype),
+            'action': ((capacity, action_dim), np.float32),
+            'reward': ((capacity,), np.float32),
+            'done': ((capacity,), np.float32),
+            'timeout': ((capacity,), np.bool_), #done by truncation (info['TimeLimit.truncated']), not a terminal state
+            'counters': ((2,), np.int64), #written, read
+        })
+        self.counters = self.shared['counters']
+
+    @property
+    def spec(self):
+        return self.capacity, self.shared.spec
+
+    @classmethod
+    def attach(cls, spec) -> "TransitionRing":
+        capacity, shared_spec = spec
+        return cls(capacity, None, None, None, _shared=SharedArrays.attach(shared_spec))
+
+    def available(self) -> int:
+        return int(self.counters[0] - self.counters[1])
+
+    def put(self, obs, next_obs, action, reward, done, timeout=False, stop_event=None) -> bool:
+        """Writes a transition, waiting for a free slot. Returns False if `stop_event` got set meanwhile."""
+        while self.available() >= self.capacity:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            time.sleep(0.001)
+        slot = self.counters[0] % self.capacity
+        self.shared['obs'][slot] = obs
+        self.shared['next_obs'][slot] = next_obs
+        self.shared['action'][slot] = action
+        self.shared['reward'][slot] = reward
+        self.shared['done'][slot] = done
+        self.shared['timeout'][slot] = timeout
+        self.counters[0] += 1
+        return True
+
+    def peek(self):
+        """Returns the arrays of the oldest unread transition, valid until `advance`."""
+        slot = self.counters[1] % self.capacity
+        return (self.shared['obs'][slot], self.shared['next_obs'][slot], self.shared['action'][slot],
+                self.shared['reward'][slot], self.shared['done'][slot], self.shared['timeout'][slot])
+
+    def advance(self) -> None:
+        self.counters[1] += 1
+
+    def close(self) -> None:
+        self.shared.close()
+
+
+def _collect(index: int, env_kwargs: Mapping[str, Any], host: str, port: int, tm_port: int, seed: Optional[int],
+             policy_spec, ring_spec, weights_spec, weights_lock, weights_version, stop_event, action_noise):
+    # Collector process: steps its own CarlaEnv with the latest published actor weights. Module level so that
+    # it can be started with the spawn method.
+    from carla_env import CarlaEnv
+
+    ring = TransitionRing.attach(ring_spec)
+    weights = SharedArrays.attach(weights_spec)
+    policy_class, policy_kwargs, observation_space, action_space = policy_spec
+    th.set_num_threads(1)
+    policy = policy_class(observation_space, action_space, _zero_schedule, **policy_kwargs)
+    policy.set_training_mode(False)
+    actor_parameters = list(policy.actor.parameters())
+    loaded_version = 0
+
+    env = CarlaEnv(**env_kwargs, host=host, port=port, tm_port=tm_port)
+    if seed is not None:
+        env.seed(seed)
+        env.action_space.seed(seed)
+    try:
+        obs = env.reset()
+        while not stop_event.is_set():
+            version = weights_version.value
+            if version != loaded_version:
+                with weights_lock:
+                    th.nn.utils.vector_to_parameters(th.from_numpy(weights['actor'].copy()), actor_parameters)
+                loaded_version = version
+
+            if loaded_version == 0: #warmup, no policy published yet
+                scaled_action = policy.scale_action(env.action_space.sample())
+            else:
+                action, _ = policy.predict(obs, deterministic=False)
+                scaled_action = policy.scale_action(action)
+                if action_noise is not None:
+                    scaled_action = np.clip(scaled_action + action_noise(), -1.0, 1.0)
+
+            next_obs, reward, done, info = env.step(policy.unscale_action(scaled_action))
+            if not ring.put(obs, next_obs, scaled_action, reward, done, info.get('TimeLimit.truncated', False),
+                            stop_event):
+                break
+            obs = env.reset() if done else next_obs
+    finally:
+        env.close()
+        ring.close()
+        weights.close()
+        logging.info("Collector {} stopped".format(index))
+
+
+class ActorLearner(object):
+    """Trains an SB3 off-policy model from `CarlaEnv` collectors running in their own processes.
+
+    Collector `i` drives `CarlaEnv` on the server at `base_port + 3 i` with a
+    CPU copy of the actor, refreshed every `sync_interval` gradient steps,
+    and streams transitions through a `TransitionRing` in shared memory.
+    The learner moves them into `model.replay_buffer`, collector `i` filling
+    env column `i` so that every column stays one contiguous trajectory (as
+    index-derived next observations require), and trains continuously,
+    independently of `world.tick()`.
+
+    Env steps/sec and gradient steps/sec are logged separately under
+    `actor_learner/`.
+    """
+
+    def __init__(self, model_fn, num_collectors: int, env_kwargs: Mapping[str, Any], observation_space,
+                 action_space, host: str = "localhost", base_port: int = 2000, base_tm_port: int = 8000,
+                 seed: Optional[int] = None, action_noise=None, ring_capacity: int = 256,
+                 sync_interval: int = 100, max_updates_per_step: Optional[float] = 1.0,
+                 start_method: str = "spawn"):
+        """Constructs the learner and starts the collectors.
+
+        Args:
+            model_fn: Builds the model from a placeholder `VecEnv`, e.g. `lambda env: SAC(CnnPolicy, env)`.
+            num_collectors: The number of collector processes (and `CARLA` servers).
+            env_kwargs: Keyword arguments forwarded to every `CarlaEnv`.
+            observation_space: The observation space of `CarlaEnv`.
+            action_space: The action space of `CarlaEnv`.
+            host: The host the `CARLA` servers run on.
+            base_port: The RPC port of the first server.
+            base_tm_port: The first Traffic Manager port to try.
+            seed: The base random seed, collector `i` is seeded with `seed + i`.
+            action_noise: Exploration noise added to the scaled actions of the collectors.
+            ring_capacity: The number of transitions buffered per collector.
+            sync_interval: The number of gradient steps between two actor weight publications.
+            max_updates_per_step: Caps gradient steps per collected env step, None lets the learner run free.
+            start_method: The `multiprocessing` start method of the collectors.
+        """
+        self.num_collectors = num_collectors
+        self.sync_interval = sync_interval
+        self.max_updates_per_step = max_updates_per_step
+        self.env_steps = 0
+        self.gradient_steps = 0
+
+        placeholder = DummyVecEnv([lambda: _SpacesEnv(observation_space, action_space)] * num_collectors)
+        self.model = model_fn(placeholder)
+        # The model sees channel-first images when SB3 wraps the env in VecTransposeImage
+        self.transpose = self.model.observation_space.shape != observation_space.shape
+
+        actor_vector = th.nn.utils.parameters_to_vector(self.model.actor.parameters())
+        self.weights = SharedArrays({'actor': ((actor_vector.numel(),), np.float32)})
+        context = multiprocessing.get_context(start_method)
+        self.weights_lock = context.Lock()
+        self.weights_version = context.Value('q', 0, lock=False)
+        self.stop_event = context.Event()
+
+        policy_spec = (self.model.policy_class, self.model.policy_kwargs, self.model.observation_space,
+                       self.model.action_space)
+        self.rings, self.processes = [], []
+        ports = PortAllocator(base_port=base_port, base_tm_port=base_tm_port).allocate_many(num_collectors)
+        for i, (port, tm_port) in enumerate(ports):
+            ring = TransitionRing(ring_capacity, observation_space.shape, observation_space.dtype,
+                                  int(np.prod(action_space.shape)))
+            process = context.Process(
+                target=_collect, daemon=True,
+                args=(i, dict(env_kwargs), host, port, tm_port, None if seed is None else seed + i, policy_spec,
+                      ring.spec, self.weights.spec, self.weights_lock, self.weights_version, self.stop_event,
+                      action_noise))
+            process.start()
+            logging.info("Collector {} uses CARLA server {}:{} with Traffic Manager port {}".format(
+                i, host, port, tm_port))
+            self.rings.append(ring)
+            self.processes.append(process)
+
+    def publish_weights(self) -> None:
+        """Copies the current actor weights to the collectors."""
+        vector = th.nn.utils.parameters_to_vector(self.model.actor.parameters()).detach().cpu().numpy()
+        with self.weights_lock:
+            self.weights['actor'][:] = vector
+        self.weights_version.value += 1
+
+    def _drain(self) -> int:
+        # Moves complete rows (one transition per collector) into the replay buffer, returns the env steps added
+        rows = min(ring.available() for ring in self.rings)
+        for _ in range(rows):
+            obs, next_obs, action, reward, done, timeout = map(np.stack, zip(*(ring.peek() for ring in self.rings)))
+            if self.transpose:
+                obs, next_obs = obs.transpose(0, 3, 1, 2), next_obs.transpose(0, 3, 1, 2)
+            # The truncation flags are what the buffer reads from the infos, so truncated episodes still bootstrap
+            infos = [{'TimeLimit.truncated': bool(truncated)} for truncated in timeout]
+            self.model.replay_buffer.add(obs, next_obs, action, reward, done, infos)
+            for ring in self.rings:
+                ring.advance()
+        return rows * self.num_collectors
+
+    def learn(self, total_timesteps: int, batch_size: int = 256, gradient_steps_per_iteration: int = 8,
+              log_interval: float = 30.0, tensorboard_log: Optional[str] = None, tb_log_name: str = "SAC"):
+        """Trains until the collectors delivered `total_timesteps` env steps and returns the model."""
+        model = self.model
+        model.set_logger(configure_logger(model.verbose, tensorboard_log, tb_log_name))
+        start = last_log = time.perf_counter()
+        logged_env_steps, logged_gradient_steps = 0, 0
+
+        while self.env_steps < total_timesteps:
+            for i, process in enumerate(self.processes):
+                if not process.is_alive():
+                    raise RuntimeError("Collector {} died with exit code {}".format(i, process.exitcode))
+
+            self.env_steps += self._drain()
+            model.num_timesteps = self.env_steps
+            model._current_progress_remaining = 1.0 - self.env_steps / total_timesteps
+
+            allowed = gradient_steps_per_iteration
+            if self.env_steps < model.learning_starts:
+                allowed = 0
+            elif self.max_updates_per_step is not None:
+                budget = self.max_updates_per_step * (self.env_steps - model.learning_starts) - self.gradient_steps
+                allowed = int(min(allowed, budget))
+            if allowed > 0:
+                model.train(gradient_steps=allowed, batch_size=batch_size)
+                previous, self.gradient_steps = self.gradient_steps, self.gradient_steps + allowed
+                if previous // self.sync_interval != self.gradient_steps // self.sync_interval \
+                        or self.weights_version.value == 0:
+                    self.publish_weights()
+            else:
+                time.sleep(0.001) #waiting for transitions
+
+            now = time.perf_counter()
+            if now - last_log >= log_interval:
+                model.logger.record("actor_learner/env_steps_per_sec",
+                                    (self.env_steps - logged_env_steps) / (now - last_log))
+                model.logger.record("actor_learner/gradient_steps_per_sec",
+                                    (self.gradient_steps - logged_gradient_steps) / (now - last_log))
+                model.logger.record("actor_learner/gradient_steps", self.gradient_steps)
+                model.logger.dump(step=self.env_steps)
+                last_log, logged_env_steps, logged_gradient_steps = now, self.env_steps, self.gradient_steps
+
+        elapsed = time.perf_counter() - start
+        logging.info("Actor-learner: {:.1f} env steps/sec, {:.1f} gradient steps/sec".format(
+            self.env_steps / elapsed, self.gradient_steps / elapsed))
+        return model
+
+    def stop(self) -> None:
+        """Stops the collectors, e.g. before evaluating on the server of collector 0; the model stays usable."""
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+    def close(self) -> None:
+        """Stops the collectors and frees the shared memory."""
+        self.stop()
+        for ring in self.rings:
+            ring.close()
+        self.weights.close()
@@ -0,0 +1,157 @@
+"""Benchmark of compressed replay storage: bytes per frame and minibatch decode latency.
+
+Fills a `replay_buffers.CompressedReplayBuffer` per codec with synthetic
+street scenes, channel-first as SB3 stores them: 3-channel one-hot semantic
+masks (`observations.SemanticEncoder` with the default channels) and RGB
+frames with sensor noise, the road, horizon and vehicles moving from frame
+to frame. Reports the compression ratio against the raw `uint8` frames,
+the encode cost per frame, the decode latency of a 256-transition
+minibatch (obs and next obs, 512 frames) with 1 and `--threads` threads,
+and how long `sample` blocks the learner with prefetching when every
+gradient step keeps the CPU busy for `--train-ms`. The `MemmapReplayBuffer` row is the
+uncompressed reference.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from gym import spaces
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observations import SemanticEncoder
+from replay_buffers import CompressedReplayBuffer, MemmapReplayBuffer
+
+# Tags of the synthetic scenes, as in CARLA: Building, Fence, RoadLine, Road, SideWalk, Vehicles
+BUILDING, FENCE, ROAD_LINE, ROAD, SIDEWALK, VEHICLE = 1, 2, 6, 7, 8, 10
+COLORS = np.zeros((256, 3), dtype=np.float32)
+COLORS[[BUILDING, FENCE, ROAD_LINE, ROAD, SIDEWALK, VEHICLE]] = [
+    (135, 206, 235), (100, 40, 40), (255, 255, 255), (70, 70, 70), (110, 90, 60), (20, 30, 140)]
+
+
+def scene_tags(height, width, rng):
+    horizon = int(height * rng.uniform(0.35, 0.45))
+    rows = np.arange(height)[:, None]
+    cols = np.arange(width)[None, :]
+    center = width / 2 + rng.uniform(-0.15, 0.15) * width * (height - rows) / height
+    road = (rows >= horizon) & (np.abs(cols - center) <= (rows - horizon + 1) * 1.2)
+    tags = np.full((height, width), BUILDING, dtype=np.uint8)
+    tags[horizon:] = SIDEWALK
+    tags[road] = ROAD
+    tags[road & (np.abs(cols - center) <= 1)] = ROAD_LINE
+    tags[horizon:horizon + max(1, height // 20)] = FENCE
+    for _ in range(rng.integers(0, 4)):
+        row = rng.integers(horizon, height - 4)
+        size = 2 + (row - horizon) // 3
+        col = int(np.clip(rng.normal(width / 2, width / 6), 0, width - size))
+        tags[max(row - size, horizon):row, col:col + size] = VEHICLE
+    return tags
+
+
+def frames(kind, num_frames, height, width, rng):
+    encoder = SemanticEncoder(height, width)
+    out = np.empty((num_frames, 3, height, width), dtype=np.uint8)
+    for i in range(num_frames):
+        tags = scene_tags(height, width, rng)
+        if kind == "semantic":
+            frame = encoder.encode_tags(tags)
+        else:
+            frame = np.clip(COLORS[tags] + rng.normal(0, 4, (height, width, 3)), 0, 255).astype(np.uint8)
+        out[i] = frame.transpose(2, 0, 1)
+    return out
+
+
+def fill(buffer, scenes, num_transitions):
+    action, reward = np.zeros((1, 1), dtype=np.float32), np.zeros(1, dtype=np.float32)
+    start = time.perf_counter()
+    for t in range(num_transitions):
+        done = np.array([t % 500 == 499])
+        buffer.add(scenes[t % len(scenes)][None], scenes[(t + 1) % len(scenes)][None], action, reward, done, [{}])
+    return (time.perf_counter() - start) / num_transitions
+
+
+def decode_latency(buffer, batch_size, repeats):
+    # Synchronous decode of fresh minibatches, as without prefetching
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        buffer._gather(buffer._sample_indices(batch_size), np.zeros(batch_size, dtype=np.int64))
+        latencies.append(time.perf_counter() - start)
+    return np.median(latencies)
+
+
+def train_step(seconds, weights):
+    # Busy stand-in for a gradient step: it holds the CPU like the learner does, where a sleep would leave the
+    # cores to the decoding threads and under-report the contention
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        weights = np.tanh(weights @ weights.T)
+
+
+def stall(buffer, batch_size, repeats, train_seconds):
+    # Time the learner waits in sample() when a gradient step follows every minibatch
+    weights = np.random.default_rng(0).standard_normal((64, 64))
+    buffer.sample(batch_size)
+    waits = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        buffer.sample(batch_size)
+        waits.append(time.perf_counter() - start)
+        train_step(train_seconds, weights)
+    return np.median(waits)
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    height, width = args.height, args.width
+    obs_space = spaces.Box(0, 255, (3, height, width), dtype=np.uint8)
+    action_space = spaces.Box(-1.0, 1.0, (1,), dtype=np.float32)
+
+    print("{:>9} {:>6} {:>7} {:>10} {:>12} {:>12} {:>12}".format(
+        "frames", "codec", "ratio", "encode us", "decode 1t ms", "decode {}t ms".format(args.threads),
+        "stall ms"))
+    for kind in ("semantic", "rgb"):
+        scenes = frames(kind, 64, height, width, rng)
+        for codec in ("raw", "zlib", "png", "jpeg"):
+            if codec == "jpeg" and kind == "semantic":
+                continue #lossy codecs corrupt label masks
+            if codec == "raw":
+                buffers = [MemmapReplayBuffer(args.capacity, obs_space, action_space, device="cpu")]
+            else:
+                buffers = [CompressedReplayBuffer(args.capacity, obs_space, action_space, device="cpu", codec=codec,
+                                                  quality=args.jpeg_quality, num_threads=num_threads)
+                           for num_threads in (1, args.threads)]
+            try:
+                encode = fill(buffers[0], scenes, args.capacity + 1)
+                latencies = [decode_latency(buffers[0], args.batch_size, args.repeats)]
+                if codec != "raw":
+                    fill(buffers[1], scenes, args.capacity + 1)
+                    latencies.append(decode_latency(buffers[1], args.batch_size, args.repeats))
+                    waited = stall(buffers[1], args.batch_size, args.repeats, args.train_ms / 1000.0)
+                else:
+                    latencies.append(latencies[0])
+                    waited = latencies[0]
+                ratio = getattr(buffers[0], "compression_ratio", 1.0)
+            finally:
+                for buffer in buffers:
+                    buffer.close()
+            print("{:>9} {:>6} {:>7.1f} {:>10.0f} {:>12.1f} {:>12.1f} {:>12.2f}".format(
+                kind, codec, ratio, encode * 1e6, latencies[0] * 1e3, latencies[1] * 1e3, waited * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--width', type=int, default=160, help='width of the frames')
+    parser.add_argument('--height', type=int, default=120, help='height of the frames')
+    parser.add_argument('--capacity', type=int, default=2000, help='number of transitions per buffer')
+    parser.add_argument('--batch-size', type=int, default=256, help='number of transitions per minibatch')
+    parser.add_argument('--threads', type=int, default=4, help='number of decoding threads')
+    parser.add_argument('--train-ms', type=float, default=20.0, help='duration of a simulated gradient step')
+    parser.add_argument('--jpeg-quality', type=int, default=90, help='JPEG quality')
+    parser.add_argument('--repeats', type=int, default=20, help='minibatches per latency measurement')
+    args = parser.parse_args()
+
+    main(args)
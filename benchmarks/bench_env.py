@@ -0,0 +1,84 @@
+"""Benchmark of `CarlaEnv` overhead on top of an offline simulator.
+
+Installs `fake_carla` as the `carla` module, so no CarlaUE4 server is
+needed, and measures the steps/sec and reset latency of `CarlaEnv` itself
+for every combination of sensor, `repeat_action` and actor pooling. The
+fake server does little work per tick, so the numbers are dominated by the
+Python side of the environment. `--rpc-latency` adds an artificial cost per
+RPC-like call to see how call counts translate into wall time.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_carla
+
+fake_carla.install()
+
+from carla_env import CarlaEnv
+
+
+def run(env, num_resets, steps_per_reset, rng):
+    resets, step_times, steps = [], 0.0, 0
+    for _ in range(num_resets):
+        start = time.perf_counter()
+        env.reset()
+        resets.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(steps_per_reset):
+            _, _, done, _ = env.step(rng.uniform(-1.0, 1.0, size=env.action_space.shape))
+            steps += 1
+            if done:
+                break
+        step_times += time.perf_counter() - start
+    return np.array(resets), steps, steps / step_times
+
+
+def main(args):
+    fake_carla.configure(rpc_latency=args.rpc_latency)
+    rng = np.random.default_rng(0)
+    print("{:>9} {:>7} {:>8} {:>11} {:>13} {:>13} {:>11}".format(
+        "sensor", "repeat", "mode", "steps/sec", "reset p50 [s]", "reset p95 [s]", "calls/step"))
+    for sensor, repeat_action, reuse_actors in itertools.product(args.sensors, args.repeat_actions, (False, True)):
+        server = fake_carla.get_server(args.host, args.port)
+        env = CarlaEnv(args.map, args.fps, args.width, args.height, repeat_action=repeat_action,
+                       start_transform_type='random', sensors=[sensor], action_type=args.action_type,
+                       enable_preview=False, enable_spectator=False, steps_per_episode=args.steps,
+                       host=args.host, port=args.port, reuse_actors=reuse_actors, num_traffic=args.traffic)
+        try:
+            env.reset() # the first reset always spawns
+            calls = sum(server.calls.values())
+            resets, steps, rate = run(env, args.resets, args.steps, rng)
+            calls = sum(server.calls.values()) - calls
+        finally:
+            env.close()
+        print("{:>9} {:>7d} {:>8} {:>11.1f} {:>13.3f} {:>13.3f} {:>11.1f}".format(
+            sensor, repeat_action, "pooled" if reuse_actors else "respawn", rate,
+            np.percentile(resets, 50), np.percentile(resets, 95), calls / steps))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', type=str, default='localhost', help='host of the simulated server')
+    parser.add_argument('--port', type=int, default=2000, help='RPC port of the simulated server')
+    parser.add_argument('--map', type=str, default='Town02', help='name of carla map')
+    parser.add_argument('--fps', type=int, default=20, help='fps of carla env')
+    parser.add_argument('--width', type=int, default=160, help='width of camera observations')
+    parser.add_argument('--height', type=int, default=120, help='height of camera observations')
+    parser.add_argument('--sensors', type=str, nargs='+', default=['rgb', 'semantic'], help='sensors to benchmark')
+    parser.add_argument('--repeat-actions', type=int, nargs='+', default=[1, 4], help='repeat_action values')
+    parser.add_argument('--action-type', type=str, default='lateral_purepursuit', help='action type of the env')
+    parser.add_argument('--traffic', type=int, default=30, help='number of NPC vehicles')
+    parser.add_argument('--resets', type=int, default=3, help='number of measured resets per configuration')
+    parser.add_argument('--steps', type=int, default=200, help='maximum number of steps per episode')
+    parser.add_argument('--rpc-latency', type=float, default=0.0, help='artificial latency per RPC call [s]')
+    args = parser.parse_args()
+
+    main(args)
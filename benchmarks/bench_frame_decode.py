@@ -0,0 +1,83 @@
+"""Micro-benchmark of the camera frame decode used by `CarlaEnv`.
+
+Compares the legacy `np.array(raw_data)` + reshape + slice path with
+`observations.FrameDecoder` and reports frames/sec and bytes allocated per
+step for several camera resolutions. The legacy path returns a
+non-contiguous view, so it is also measured with the contiguous copy its
+consumer (the `VecEnv` observation buffer) ends up paying for.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observations import FrameDecoder
+
+
+class FakeImage(object):
+    """Mimics the `raw_data` buffer of a `carla.Image`."""
+
+    def __init__(self, height, width):
+        self.raw_data = memoryview(np.random.randint(0, 256, size=height * width * 4, dtype=np.uint8).tobytes())
+
+
+def legacy_decode(image, height, width):
+    image = np.array(image.raw_data)
+    image = image.reshape((height, width, -1))
+    return image[:, :, :3]
+
+
+def legacy_decode_contiguous(image, height, width):
+    return np.ascontiguousarray(legacy_decode(image, height, width))
+
+
+def measure(decode, image, num_steps):
+    decode(image) # warm up
+
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        decode(image)
+    fps = num_steps / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    allocated = 0
+    num_alloc_steps = min(num_steps, 100)
+    for _ in range(num_alloc_steps):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        obs = decode(image)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - before
+        del obs
+    tracemalloc.stop()
+    return fps, allocated / num_alloc_steps
+
+
+def main(sizes, num_steps):
+    print("{:>10} {:>12} {:>14} {:>18}".format("size", "decoder", "frames/sec", "bytes/step"))
+    for width, height in sizes:
+        image = FakeImage(height, width)
+        decoder = FrameDecoder(height, width)
+        assert np.array_equal(decoder.decode(image), legacy_decode(image, height, width))
+        decoders = (
+            ("legacy", lambda im: legacy_decode(im, height, width)),
+            ("legacy+copy", lambda im: legacy_decode_contiguous(im, height, width)),
+            ("frombuffer", decoder.decode),
+        )
+        for name, decode in decoders:
+            fps, allocated = measure(decode, image, num_steps)
+            print("{:>10} {:>12} {:>14.0f} {:>18.0f}".format("{}x{}".format(width, height), name, fps, allocated))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--steps', type=int, default=2000, help='number of decoded frames per measurement')
+    args = parser.parse_args()
+
+    main(sizes=[(84, 84), (160, 120), (400, 300)], num_steps=args.steps)
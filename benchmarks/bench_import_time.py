@@ -0,0 +1,75 @@
+"""Benchmark of the import time of the training modules, from `python -X importtime`.
+
+Imports each module in a fresh interpreter with `-X importtime` and reports
+its cumulative import time and the slowest top-level packages it pulls in.
+`--fake` installs `fake_carla` as the `carla` module first, for machines
+without the CARLA PythonAPI (it and what it imports are left out of the report).
+
+Exits with status 1 when a module imports one of the `--forbid` packages
+(the rendering stack, which only `graphics` and the dashboard need) or takes
+longer than `--budget-ms`, so it can guard against import-time regressions.
+"""
+
+import argparse
+import collections
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module, fake):
+    """Returns the `-X importtime` (self, cumulative) microseconds of every module imported by `module`."""
+    code = "import fake_carla; fake_carla.install(); import {}".format(module) if fake else "import " + module
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True,
+                            text=True)
+    if result.returncode != 0:
+        raise RuntimeError("importing {} failed:\n{}".format(module, result.stderr))
+    times = collections.OrderedDict()
+    for line in result.stderr.splitlines():
+        if fake and line.endswith("| fake_carla"): #fake_carla and its dependencies come first, leave them out
+            times.clear()
+            continue
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main(args):
+    failed = False
+    for module in args.modules:
+        times = import_times(module, args.fake)
+        total_ms = times[module][1] / 1000.0
+        # Self times summed per top-level package, i.e. what each dependency costs whoever imports it first
+        packages = collections.Counter()
+        for name, (self_us, _) in times.items():
+            packages[name.split(".")[0]] += self_us
+        print("{}: {:.1f} ms, {} modules".format(module, total_ms, len(times)))
+        for package, self_us in packages.most_common(args.top):
+            print("  {:>24} {:>10.1f} ms".format(package, self_us / 1000.0))
+
+        forbidden = sorted(set(args.forbid) & set(name.split(".")[0] for name in times))
+        if forbidden:
+            print("  FAIL: imports {}".format(", ".join(forbidden)))
+            failed = True
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            print("  FAIL: over the {:.0f} ms budget".format(args.budget_ms))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('modules', nargs='*', default=['carla_env'], help='modules to import')
+    parser.add_argument('--fake', action='store_true', help='use the offline fake_carla module as carla')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest packages reported per module')
+    parser.add_argument('--forbid', type=str, nargs='*',
+                        default=['pygame', 'matplotlib', 'imageio', 'skimage', 'tqdm'],
+                        help='packages the modules must not import')
+    parser.add_argument('--budget-ms', type=float, default=None, help='maximum cumulative import time per module')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,70 @@
+"""Benchmark of `lane_geometry.LaneGeometry` lookups against `carla.Map.get_waypoint`.
+
+Builds (or loads from `--cache-dir`) the lane geometry of the map of a
+running server, or of `fake_carla` with `--fake`, then times nearest-lane
+and lane-offset queries at random points around the lanes, one at a time
+and batched, next to the `get_waypoint` call they replace.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def per_call(function, points):
+    start = time.perf_counter()
+    for x, y in points:
+        function(x, y)
+    return (time.perf_counter() - start) / len(points)
+
+
+def main(args):
+    if args.fake:
+        import fake_carla
+        fake_carla.install()
+    import carla
+    from lane_geometry import LaneGeometry
+
+    carla_map = carla.Client(args.host, args.port).get_world().get_map()
+    start = time.perf_counter()
+    geometry = LaneGeometry.load_or_build(carla_map, cache_dir=args.cache_dir)
+    print("load_or_build: {:.3f} s, {} samples, {}x{} cells".format(
+        time.perf_counter() - start, len(geometry), *geometry.grid.shape))
+
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(geometry), size=args.queries)
+    xs = geometry.x[picks] + rng.uniform(-3.0, 3.0, size=args.queries)
+    ys = geometry.y[picks] + rng.uniform(-3.0, 3.0, size=args.queries)
+    points = list(zip(xs.tolist(), ys.tolist()))
+
+    print("{:>24} {:>12}".format("query", "us/query"))
+    print("{:>24} {:>12.3f}".format("nearest", per_call(geometry.nearest, points) * 1e6))
+    print("{:>24} {:>12.3f}".format("lane_offset", per_call(geometry.lane_offset, points) * 1e6))
+    start = time.perf_counter()
+    geometry.nearest_many(xs, ys)
+    print("{:>24} {:>12.3f}".format("nearest_many", (time.perf_counter() - start) / args.queries * 1e6))
+    start = time.perf_counter()
+    geometry.lane_offset_many(xs, ys)
+    print("{:>24} {:>12.3f}".format("lane_offset_many", (time.perf_counter() - start) / args.queries * 1e6))
+    waypoint_points = points[:args.waypoint_queries]
+    print("{:>24} {:>12.3f}".format("Map.get_waypoint", per_call(
+        lambda x, y: carla_map.get_waypoint(carla.Location(x=x, y=y)), waypoint_points) * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', type=str, default='localhost', help='host of the CARLA server')
+    parser.add_argument('--port', type=int, default=2000, help='RPC port of the CARLA server')
+    parser.add_argument('--fake', action='store_true', help='use the offline fake_carla server')
+    parser.add_argument('--cache-dir', type=str, default=os.path.join("cache", "lane_geometry"),
+                        help='directory of the cached lane geometry')
+    parser.add_argument('--queries', type=int, default=100000, help='number of timed queries')
+    parser.add_argument('--waypoint-queries', type=int, default=2000, help='number of timed get_waypoint calls')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,83 @@
+"""Benchmark of pure-pursuit steering computations per second.
+
+Compares the former per-vehicle Python-list controller (one call per
+vehicle) with one batched pass of the `pure_pursuit` functions over
+`(N vehicles x M waypoints)` arrays, for 1, 30 and 300 vehicles.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pure_pursuit
+
+
+def legacy_steer(x, y, yaw, vf, waypoint_list, L=2.875, Kdd=4.0):
+    dx = [abs(x - wp[0]) for wp in waypoint_list]
+    dy = [abs(y - wp[1]) for wp in waypoint_list]
+    dist = np.hypot(dx, dy)
+    idx = np.argmin(dist) + 4
+    if idx >= len(waypoint_list):
+        idx = len(waypoint_list) - 1
+    tx, ty = waypoint_list[idx]
+    ld = Kdd * np.clip(vf, 0.1, 2.5)
+    alpha = math.atan2(ty - y, tx - x) - yaw
+    return np.clip(math.atan2(2 * L * np.sin(alpha), ld), -1.0, 1.0)
+
+
+def batched_steer(positions, yaws, speeds, waypoints):
+    _, targets, _ = pure_pursuit.target_waypoint_index(positions, waypoints)
+    return pure_pursuit.steering_angle(positions, yaws, targets, pure_pursuit.lookahead_distance(speeds))
+
+
+def make_scenario(num_vehicles, num_waypoints, rng):
+    # Gently curving paths with vehicles placed near their start.
+    s = np.arange(num_waypoints) * 2.0
+    heading = rng.uniform(-np.pi, np.pi, size=(num_vehicles, 1)) + 0.002 * s
+    waypoints = np.stack([np.cumsum(2.0 * np.cos(heading), axis=1), np.cumsum(2.0 * np.sin(heading), axis=1)], axis=-1)
+    positions = waypoints[:, 10] + rng.normal(scale=0.5, size=(num_vehicles, 2))
+    yaws = heading[:, 10]
+    speeds = rng.uniform(0.0, 5.0, size=num_vehicles)
+    return positions, yaws, speeds, waypoints
+
+
+def main(vehicle_counts, num_waypoints, duration):
+    rng = np.random.default_rng(0)
+    print("{:>9} {:>10} {:>18}".format("vehicles", "mode", "steerings/sec"))
+    for num_vehicles in vehicle_counts:
+        positions, yaws, speeds, waypoints = make_scenario(num_vehicles, num_waypoints, rng)
+        waypoint_lists = [[tuple(wp) for wp in path] for path in waypoints]
+        batched = batched_steer(positions, yaws, speeds, waypoints)
+        legacy = [legacy_steer(*positions[i], yaws[i], speeds[i], waypoint_lists[i]) for i in range(num_vehicles)]
+        assert np.allclose(batched, legacy)
+
+        def run_legacy():
+            for i in range(num_vehicles):
+                legacy_steer(positions[i, 0], positions[i, 1], yaws[i], speeds[i], waypoint_lists[i])
+
+        def run_batched():
+            batched_steer(positions, yaws, speeds, waypoints)
+
+        for name, fn in (("legacy", run_legacy), ("batched", run_batched)):
+            calls = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                fn()
+                calls += 1
+            rate = calls * num_vehicles / (time.perf_counter() - start)
+            print("{:>9d} {:>10} {:>18.0f}".format(num_vehicles, name, rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--waypoints', type=int, default=300, help='number of waypoints per vehicle')
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds spent per measurement')
+    args = parser.parse_args()
+
+    main(vehicle_counts=[1, 30, 300], num_waypoints=args.waypoints, duration=args.duration)
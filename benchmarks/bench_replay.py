@@ -0,0 +1,94 @@
+"""Benchmark of prioritized against uniform replay sampling throughput.
+
+Fills a `replay_buffers.MemmapReplayBuffer` and a
+`replay_buffers.PrioritizedReplayBuffer` of the same capacity (500k by
+default) and measures how many 256-transition minibatches per second each
+delivers; the prioritized one also writes the new priorities of every batch
+back, as `prioritized_sac.PrioritizedSAC` does. Both buffers are measured in
+alternating rounds, after their memory maps are flushed, and the median
+ratio of neighbouring rounds is reported, so that page cache and CPU
+frequency drift do not favour either.
+
+The target is a relative throughput of at least 0.9 at the default 500k
+capacity. With its default of 16 minibatches per tree walk the prioritized
+buffer reaches 0.91-0.92 on a 1-vCPU box, where a uniform batch costs
+~900 us; `--batches-per-walk 1` (one walk and one priority write per batch)
+gives about 0.75-0.8. The sum-tree cost is a constant per batch, so larger
+`--obs-shape`s raise the ratio.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from gym import spaces
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_buffers import MemmapReplayBuffer, PrioritizedReplayBuffer
+
+
+def fill(buffer, num_transitions, obs_shape, rng):
+    frames = rng.integers(0, 256, size=(64, 1, *obs_shape), dtype=np.uint8)
+    action, reward = np.zeros((1, 1), dtype=np.float32), np.zeros(1, dtype=np.float32)
+    for t in range(num_transitions):
+        done = np.array([t % 500 == 499])
+        buffer.add(frames[t % 64], frames[(t + 1) % 64], action, reward, done, [{}])
+
+
+def measure(buffer, batch_size, duration, rng):
+    # Stand-ins for the TD errors of the learner, drawn up front so that the random generator is not timed
+    td_errors = rng.exponential(size=(64, batch_size))
+    batches = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        samples = buffer.sample(batch_size)
+        if isinstance(buffer, PrioritizedReplayBuffer):
+            buffer.update_priorities(samples.indices, td_errors[batches % 64])
+        batches += 1
+    return batches / (time.perf_counter() - start)
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    obs_space = spaces.Box(0, 255, tuple(args.obs_shape), dtype=np.uint8)
+    action_space = spaces.Box(-1.0, 1.0, (1,), dtype=np.float32)
+
+    buffers = {}
+    try:
+        for name, buffer_class, kwargs in (("uniform", MemmapReplayBuffer, {}),
+                                           ("prioritized", PrioritizedReplayBuffer,
+                                            dict(batches_per_walk=args.batches_per_walk))):
+            buffers[name] = buffer_class(args.capacity, obs_space, action_space, device="cpu", **kwargs)
+            fill(buffers[name], args.capacity + 1, args.obs_shape, rng)
+            buffers[name].observations.flush() #no writeback of the fill during the measurement
+        rates = {name: [] for name in buffers}
+        for _ in range(args.rounds):
+            for name, buffer in buffers.items():
+                rates[name].append(measure(buffer, args.batch_size, args.duration / args.rounds, rng))
+    finally:
+        for buffer in buffers.values():
+            buffer.close()
+
+    print("{:>12} {:>10} {:>14} {:>14} {:>10}".format("buffer", "capacity", "batches/sec", "us/batch", "relative"))
+    for name, name_rates in rates.items():
+        # Each round is compared with the uniform one next to it, which shares its drift
+        rate = float(np.median(name_rates))
+        relative = float(np.median(np.divide(name_rates, rates["uniform"])))
+        print("{:>12} {:>10d} {:>14.1f} {:>14.1f} {:>10.2f}".format(name, args.capacity, rate, 1e6 / rate, relative))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--capacity', type=int, default=500000, help='number of transitions per buffer')
+    parser.add_argument('--obs-shape', type=int, nargs='+', default=[3, 32, 32], help='shape of the observations')
+    parser.add_argument('--batch-size', type=int, default=256, help='number of transitions per minibatch')
+    parser.add_argument('--batches-per-walk', type=int, default=16,
+                        help='minibatches the prioritized buffer draws per sum-tree walk')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds spent measuring each buffer')
+    parser.add_argument('--rounds', type=int, default=10, help='number of alternating measurement rounds')
+    args = parser.parse_args()
+
+    main(args)
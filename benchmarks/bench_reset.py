@@ -0,0 +1,66 @@
+"""Benchmark of `CarlaEnv.reset` latency with and without actor pooling.
+
+Runs a number of short episodes against a running `CARLA` server, once
+respawning the ego vehicle and its sensors on every reset and once
+teleporting the pooled ones (`reuse_actors=True`), and reports the reset
+latency of both modes.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from carla_env import CarlaEnv
+
+
+def time_resets(env, num_resets, steps_per_reset, action):
+    latencies = []
+    for _ in range(num_resets):
+        start = time.perf_counter()
+        env.reset()
+        latencies.append(time.perf_counter() - start)
+        for _ in range(steps_per_reset):
+            _, _, done, _ = env.step(action)
+            if done:
+                break
+    return np.array(latencies)
+
+
+def main(args):
+    print("{:>10} {:>10} {:>10} {:>10} {:>10}".format("mode", "resets", "mean [s]", "p50 [s]", "p95 [s]"))
+    for reuse_actors in (False, True):
+        env = CarlaEnv(args.map, args.fps, args.width, args.height, repeat_action=1,
+                       start_transform_type=args.start_location, sensors=[args.sensor], action_type='fix_throttle',
+                       enable_preview=False, enable_spectator=False, steps_per_episode=args.steps + 1,
+                       host=args.host, port=args.port, tm_port=args.tm_port, reuse_actors=reuse_actors)
+        try:
+            env.reset() # the first reset always spawns
+            latencies = time_resets(env, args.resets, args.steps, np.array([0.0]))
+        finally:
+            env.close()
+        print("{:>10} {:>10d} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            "pooled" if reuse_actors else "respawn", len(latencies),
+            latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', type=str, default='localhost', help='host of the CARLA server')
+    parser.add_argument('--port', type=int, default=2000, help='RPC port of the CARLA server')
+    parser.add_argument('--tm-port', type=int, default=8000, help='Traffic Manager port')
+    parser.add_argument('--map', type=str, default='Town02', help='name of carla map')
+    parser.add_argument('--fps', type=int, default=10, help='fps of carla env')
+    parser.add_argument('--width', type=int, default=160, help='width of camera observations')
+    parser.add_argument('--height', type=int, default=120, help='height of camera observations')
+    parser.add_argument('--sensor', type=str, default='rgb', help='type of sensor: [rgb, semantic]')
+    parser.add_argument('--start-location', type=str, default='random', help='start location type')
+    parser.add_argument('--resets', type=int, default=20, help='number of timed resets per mode')
+    parser.add_argument('--steps', type=int, default=5, help='number of steps between two resets')
+    args = parser.parse_args()
+
+    main(args)
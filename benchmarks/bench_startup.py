@@ -0,0 +1,53 @@
+"""Benchmark of `CarlaEnv` construction time, with and without reloading the town.
+
+Installs `fake_carla` as the `carla` module with an artificial
+`load_world` latency (`--load-world-latency`, a few seconds on a real
+server) and times the construction of the two envs `train_sac.main`
+builds, on a server running another town: the first env loads the town,
+the second one finds it loaded. `--force-reload` rows reload it every time,
+as `setup.setup` always did.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_carla
+
+fake_carla.install()
+
+from carla_env import CarlaEnv
+
+
+def construct(args, force_reload):
+    start = time.perf_counter()
+    env = CarlaEnv(args.map, 20, 160, 120, repeat_action=1, start_transform_type='random', sensors=['rgb'],
+                   action_type='fix_throttle', enable_preview=False, enable_spectator=False, steps_per_episode=100,
+                   host=args.host, port=args.port, force_reload=force_reload)
+    elapsed = time.perf_counter() - start
+    env.close()
+    return elapsed
+
+
+def main(args):
+    fake_carla.configure(load_world_latency=args.load_world_latency)
+    print("{:>14} {:>14} {:>14}".format("mode", "first env [s]", "second env [s]"))
+    for force_reload in (True, False):
+        fake_carla.reset_servers() # the server starts on its default town
+        first = construct(args, force_reload)
+        second = construct(args, force_reload)
+        print("{:>14} {:>14.3f} {:>14.3f}".format("force_reload" if force_reload else "if_needed", first, second))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', type=str, default='localhost', help='host of the simulated server')
+    parser.add_argument('--port', type=int, default=2000, help='RPC port of the simulated server')
+    parser.add_argument('--map', type=str, default='Town02', help='name of carla map')
+    parser.add_argument('--load-world-latency', type=float, default=5.0, help='seconds taken by load_world')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,82 @@
+"""Benchmark of pipe against shared-memory observation transport for subprocess workers.
+
+Steps a synthetic environment returning camera-sized uint8 frames (no
+simulator work at all, so the transport cost is all that is measured) in
+SB3's `SubprocVecEnv`, which pickles every observation through a pipe, and
+in `vec_env.ShmSubprocVecEnv`, which writes them to shared memory, for
+several image sizes and worker counts.
+"""
+
+import argparse
+import functools
+import itertools
+import os
+import sys
+import time
+
+import gym
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stable_baselines3.common.vec_env import SubprocVecEnv
+
+from vec_env import ShmSubprocVecEnv
+
+
+class ImageEnv(gym.Env):
+    """Returns a fixed random frame every step and ends episodes after `episode_length` steps."""
+
+    def __init__(self, width, height, episode_length=100):
+        self.observation_space = gym.spaces.Box(0, 255, (height, width, 3), dtype=np.uint8)
+        self.action_space = gym.spaces.Box(-1.0, 1.0, (1,), dtype=np.float32)
+        self.frame = np.random.default_rng(0).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        self.episode_length = episode_length
+        self.steps = 0
+
+    def reset(self):
+        self.steps = 0
+        return self.frame
+
+    def step(self, action):
+        self.steps += 1
+        return self.frame, 0.0, self.steps >= self.episode_length, {}
+
+
+def measure(vec_env, duration):
+    actions = np.zeros((vec_env.num_envs, 1), dtype=np.float32)
+    vec_env.reset()
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        vec_env.step(actions)
+        steps += vec_env.num_envs
+    return steps / (time.perf_counter() - start)
+
+
+def main(args):
+    print("{:>10} {:>8} {:>16} {:>16} {:>8}".format("image", "workers", "pipe steps/sec", "shm steps/sec",
+                                                     "speedup"))
+    for (width, height), num_workers in itertools.product(args.sizes, args.workers):
+        env_fns = [functools.partial(ImageEnv, width, height)] * num_workers
+        rates = []
+        for vec_env_class in (SubprocVecEnv, ShmSubprocVecEnv):
+            vec_env = vec_env_class(env_fns, start_method=args.start_method)
+            try:
+                rates.append(measure(vec_env, args.duration))
+            finally:
+                vec_env.close()
+        print("{:>10} {:>8d} {:>16.0f} {:>16.0f} {:>8.2f}".format(
+            "{}x{}".format(width, height), num_workers, rates[0], rates[1], rates[1] / rates[0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=lambda s: tuple(int(v) for v in s.split('x')), nargs='+',
+                        default=[(84, 84), (160, 120), (400, 300), (800, 600)], help='image sizes as WIDTHxHEIGHT')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8], help='numbers of workers')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds spent per measurement')
+    parser.add_argument('--start-method', type=str, default='spawn', help='multiprocessing start method')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,28 @@
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+
+class TimingCallback(BaseCallback):
+    """Writes the per-phase step timings of `CarlaEnv` to the SB3 logger.
+
+    `CarlaEnv` reports rolling percentiles in `info['timing']`, next to the
+    drop, wait and timeout counters of its front camera buffer; every
+    `log_freq` calls they are averaged over the vectorized envs and recorded
+    under `timing/`, so they land in the TensorBoard run of `model.learn`.
+    """
+
+    def __init__(self, log_freq: int = 100, verbose: int = 0):
+        super().__init__(verbose)
+        self.log_freq = log_freq
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.log_freq != 0:
+            return True
+
+        values = {}
+        for info in self.locals.get("infos", []):
+            for key, value in info.get("timing", {}).items():
+                values.setdefault(key, []).append(value)
+        for key, samples in values.items():
+            self.logger.record("timing/{}".format(key), float(np.mean(samples)))
+        return True
@@ -8,14 +8,18 @@ import time
 import random
 import numpy as np
 import math
-from queue import Queue
-from misc import dist_to_roadline, exist_intersection
+from sensor_buffer import SensorBuffer
 from gym import spaces
 from gym.spaces import Discrete
-from setup import setup
+from session import SimulatorSession
+from traffic import TrafficPopulation
+from route import RouteCache
+from lane_geometry import LaneGeometry
+from spawn_points import SpawnSampler
+from timing import PhaseTimer
+import pure_pursuit
+from observations import DEFAULT_SEMANTIC_CHANNELS, FrameDecoder, SemanticEncoder
 from absl import logging
-import graphics
-import pygame
 import subprocess
 import glob
 
@@ -27,48 +31,93 @@ class CarlaEnv(gym.Env):
     metadata = {'render.modes': ['human']}
 
     def __init__(self, town, fps, im_width, im_height, repeat_action, start_transform_type, sensors,
-                 action_type, enable_preview, enable_spectator, steps_per_episode, playing=False, timeout=60):
+                 action_type, enable_preview, enable_spectator, steps_per_episode, playing=False, timeout=60,
+                 host='localhost', port=2000, tm_port=8000,
+                 semantic_channels=DEFAULT_SEMANTIC_CHANNELS, semantic_output='onehot', reuse_actors=False,
+                 num_traffic=30, sensor_buffer_size=4, sensor_timeout=2.0, render_schedule='every_tick',
+                 timing=True, reward_type='distance_from_start', lane_info=False, no_rendering=True,
+                 force_reload=False, ready_tick_budget=100, settle_speed=0.1, settle_dz=0.01, spawn_attempts=3,
+                 restore_async=False, capture_grace=0.02):
 
         #self.client, self.world, self.frame, self.server = setup(town=town, fps=fps, client_timeout=timeout)
-        self.client, self.world, self.frame = setup(town=town, fps=fps, client_timeout=timeout)
+        # The town is only loaded if the server runs another one; rendering is disabled in-process, as the
+        # PythonAPI/util/config.py --no-rendering subprocess used to do. Envs on the same server (e.g. the training and
+        # evaluation envs of train_sac) share one client, world and map, and take turns ticking it. Closing the env
+        # leaves the server synchronous unless restore_async is set, other processes may still be ticking it
+        self.session = SimulatorSession.acquire(town=town, fps=fps, host=host, port=port, client_timeout=timeout,
+                                                no_rendering=no_rendering, force_reload=force_reload,
+                                                restore_async=restore_async)
+        self.client, self.world, self.frame, self.map = \
+            self.session.client, self.session.world, self.session.frame, self.session.map
+        self.preempted = False #set when another env ticked the shared world during our episode
         self.client.set_timeout(5.0)
-        self.map = self.world.get_map()
         blueprint_library = self.world.get_blueprint_library()
         #self.truck = blueprint_library.filter('vehicle.carlamotors.firetruck')[0] #vehicle set here
         self.truck = blueprint_library.filter('vehicle.dodge.charger_2020')[0]
         self.im_width = im_width
         self.im_height = im_height
+        self.fps = fps
         self.repeat_action = repeat_action
+        # 'every_tick': cameras render every physics tick, 'decision': the front camera renders only on the
+        # last tick of each repeated action and the preview camera is not spawned during training
+        if render_schedule not in ('every_tick', 'decision'):
+            raise ValueError('unknown render schedule {}'.format(render_schedule))
+        self.render_schedule = render_schedule
+        # 'distance_from_start': squared straight-line distance gained from the spawn point, 'route_progress': meters
+        # driven along the episode route, with the lateral offset and heading error reported in info['route']
+        if reward_type not in ('distance_from_start', 'route_progress'):
+            raise ValueError('unknown reward type {}'.format(reward_type))
+        self.reward_type = reward_type
+        self.timer = PhaseTimer(enabled=timing) #per-phase step wall time, percentiles reported in info['timing']
         self.action_type = action_type
         self.start_transform_type = start_transform_type
         self.sensors = sensors
         self.actor_list = []
+        self.pooled_actor_list = [] #ego vehicle and sensors kept alive across episodes when reuse_actors is set
+        self.reuse_actors = reuse_actors
+        # Latest frames keyed by frame id, bounded so an undrained preview camera cannot grow memory
+        self.front_image_buffer = SensorBuffer(sensor_buffer_size)
+        self.preview_image_buffer = SensorBuffer(sensor_buffer_size)
+        self.sensor_timeout = sensor_timeout
+        # With the 'decision' schedule a frame that has not arrived capture_grace seconds after the last tick of a step
+        # is taken as not captured, see _rendered_image
+        self.capture_grace = capture_grace
+        # Reset ticks until the ego vehicle is at rest (speed in m/s, vertical motion in m per tick below these) and
+        # the cameras delivered a frame, at most ready_tick_budget ticks and sensor_timeout seconds of sensor waits
+        if ready_tick_budget < 1:
+            raise ValueError('ready_tick_budget must be at least 1, got {}'.format(ready_tick_budget))
+        self.ready_tick_budget = ready_tick_budget
+        self.settle_speed = settle_speed
+        self.settle_dz = settle_dz
+        self.frame_decoder = FrameDecoder(im_height, im_width) #reusable observation arrays, no per-step copies
+        self.semantic_encoder = SemanticEncoder(im_height, im_width, semantic_channels, semantic_output) #tag LUT -> uint8
         self.preview_camera = None        
         self.steps_per_episode = steps_per_episode
         self.playing = playing
         self.preview_camera_enabled = enable_preview
         self.spectator_view = enable_spectator #added1
-        self.traffic_manager = self.client.get_trafficmanager() #added for pure pursuit
+        self.traffic_manager = self.session.traffic_manager(tm_port) #added for pure pursuit, one TM port per server
         self.traffic_manager.global_percentage_speed_difference(60.0)  # Vehicles move at 40% of their top speed
+        self.route = RouteCache(self.map)
+        # Spawn points cached once, random starts and NPCs only get points no actor occupies
+        self.spawn_sampler = SpawnSampler(self.world, self.map)
+        self.spawn_attempts = spawn_attempts
+        # Lane centerlines, boundaries and junction flags of the town, sampled once and cached on disk per OpenDRIVE
+        self.lane_geometry = LaneGeometry.load_or_build(self.map) if lane_info else None
+        self.traffic = None
+        if self.action_type == 'lateral_purepursuit': #NPC traffic for throttle/brake learning, spawned in one batch per reset
+            self.traffic = TrafficPopulation(self.client, self.world, self.traffic_manager, num_vehicles=num_traffic)
 
 
         # self.episode = 0
         #self.spawn_traffic() #comment for no traffic
 
-        #comment for render-mode on
-        config_script_path = "/home/aku8wk/Carla/CARLA_0.9.15/PythonAPI/util/config.py"
-        try:
-            logging.debug("Running config script to disable rendering: {}".format(config_script_path))
-            subprocess.run([config_script_path, "--no-rendering"], check=True)
-        except subprocess.CalledProcessError as e:
-            logging.error("Failed to run config script: {}".format(e))
-            sys.exit(1)
-
-
 
     @property
     def observation_space(self, *args, **kwargs):
         """Returns the observation spec of the sensor."""
+        if 'rgb' not in self.sensors and 'semantic' in self.sensors:
+            return gym.spaces.Box(low=0, high=255, shape=self.semantic_encoder.shape, dtype=np.uint8)
         return gym.spaces.Box(low=0.0, high=255.0, shape=(self.im_height, self.im_width, 3), dtype=np.uint8)
 
     @property
@@ -98,28 +147,23 @@ class CarlaEnv(gym.Env):
 
     # Resets environment for new episode
     def reset(self):
+        self.session.claim(self)
+        self.session.ensure_synchronous() #a client of another process may have switched the server to async
+        self.preempted = False
+        # With reuse_actors the ego vehicle and its sensors survive across episodes, only traffic is respawned
+        pooled = self.reuse_actors and self._pooled_actors_alive()
         self._destroy_agents()
+        if not pooled:
+            self._destroy_pooled_agents()
         self.actor_list = []
+        self.spawn_sampler.clear() #the points of the last episode's actors are free again, or seen in the snapshot
+        if pooled: #teleport before the traffic batch so no NPC is spawned onto the new start
+            self._teleport_ego()
 
-        if self.action_type == 'lateral_purepursuit': #traffic spawning for throttle/brake learning
-            num_veh = 30
-            for _ in range(0,num_veh):
-                traffic_loc = random.choice(self.map.get_spawn_points())
-                bp_traffic = random.choice(self.world.get_blueprint_library().filter('vehicle'))
-                npc = self.world.try_spawn_actor(bp_traffic, traffic_loc)
-                if npc is not None:
-                    self.actor_list.append(npc)
-                    npc.set_autopilot(True, self.traffic_manager.get_port()) # Control by traffic manager
-                    self.traffic_manager.ignore_lights_percentage(npc, 0)  # Follow traffic lights
-                    self.traffic_manager.ignore_signs_percentage(npc, 0)  # Follow traffic signs
-                    self.traffic_manager.auto_lane_change(npc, False)  # Allow lane changing
-                    self.traffic_manager.distance_to_leading_vehicle(npc, 3) # Maintain distance
-                    self.traffic_manager.random_left_lanechange_percentage(npc,0)
-                    self.traffic_manager.random_right_lanechange_percentage(npc,0)
-                    self.traffic_manager.set_desired_speed(npc,20)
-                    self.traffic_manager.set_global_distance_to_leading_vehicle(3)
-                    self.traffic_manager.set_hybrid_physics_mode(False)
-                    #self.traffic_manager.set_hybrid_physics_radius(70.0)
+        if self.traffic is not None: #traffic spawning for throttle/brake learning, on free points only
+            self.traffic.spawn(self.spawn_sampler.sample(self.traffic.num_vehicles))
+        self.route.clear() #pure pursuit and route progress reference path, rebuilt from the new start on first use
+        self.route_progress = 0.0
 
 
         self.collision_hist = []
@@ -130,41 +174,62 @@ class CarlaEnv(gym.Env):
         self.dist_from_start = 0
         # self.total_reward = 0
 
-        self.front_image_Queue = Queue()
-        self.preview_image_Queue = Queue()
-
         # self.episode += 1
 
-        # When Carla breaks (stops working) or spawn point is already occupied, spawning a car throws an exception
-        # allow it to try for 3 seconds then forgive
-        spawn_start = time.time()
-        while True:
-            try:
-                # Get random spot from a list from predefined spots and try to spawn a car there
-                self.start_transform = self._get_start_transform()
-                #print(self.start_transform) #printing spawn location, can comment
-                self.curr_loc = self.start_transform.location
-                self.vehicle = self.world.spawn_actor(self.truck, self.start_transform)                               
-                break
-            except Exception as e:
-                logging.error('Error carla 141 {}'.format(str(e)))
-                time.sleep(0.01)
+        if not pooled:
+            # Pooled sensors go to their own list so that _destroy_agents keeps them at the end of an episode
+            self._spawn_ego(self.pooled_actor_list if self.reuse_actors else self.actor_list)
+
+        frame_id = self._wait_until_ready()
+        try:
+            image = self.front_image_buffer.get(timeout=self.sensor_timeout)
+        except TimeoutError as e: #not a single frame since the ego spawned, the camera or the server is broken
+            raise RuntimeError('The front camera delivered no frame within {} ticks and {} s of reset'.format(
+                self.ready_tick_budget, self.sensor_timeout)) from e
+
+        if self.render_schedule == 'decision' and image.frame != frame_id:
+            # The camera renders every repeat_action ticks counted from image.frame, tick until the next
+            # rendered frame so that the last tick of every following step is a rendered one
+            while (frame_id - image.frame) % self.repeat_action != 0:
+                frame_id = self.session.tick(self)
+            image = self._rendered_image(frame_id)
+
+        if self.reward_type == 'route_progress': #map queries for the whole episode route happen here, not in step
+            self.route.build(self.start_transform.location)
+
+        # Disengage brakes
+        self.vehicle.apply_control(carla.VehicleControl(brake=0.0))
+
+        image = self._get_observation(image)
 
-            # If that can't be done in 3 seconds - forgive (and allow main process to handle for this problem)
-            if time.time() > spawn_start + 3:
-                raise Exception('Can\'t spawn a car')
+        return image
+
+    def _spawn_ego(self, actor_list):
+        self.front_image_buffer.clear()
+        self.preview_image_buffer.clear()
+
+        # Random starts are sampled among the free spawn points, so the first try succeeds unless the simulator
+        # disagrees; a failed point stays handed out and the next try gets another one
+        for attempt in range(self.spawn_attempts):
+            self.start_transform = self._get_start_transform()
+            #print(self.start_transform) #printing spawn location, can comment
+            self.curr_loc = self.start_transform.location
+            self.vehicle = self.world.try_spawn_actor(self.truck, self.start_transform)
+            if self.vehicle is not None:
+                break
+            logging.warning('Spawning the ego vehicle at {} failed'.format(self.curr_loc))
+        else:
+            raise Exception('Can\'t spawn a car')
 
         bound_x = self.vehicle.bounding_box.extent.x #to set the boundaries of agent- half of width & length
         bound_y = self.vehicle.bounding_box.extent.y
         bound_z = self.vehicle.bounding_box.extent.z
 
         if self.vehicle is not None: #if-block added for spectator camera
-            spectator = self.world.get_spectator()
-            spectator.set_transform(carla.Transform(self.curr_loc + carla.Location(x=0, z=70), carla.Rotation(pitch=-90.0)))              
-                
+            self._move_spectator()
 
         # Append actor to a list of spawned actors, need to remove them after episode ends
-        self.actor_list.append(self.vehicle)
+        actor_list.append(self.vehicle)
 
         if 'rgb' in self.sensors:
             self.rgb_cam = self.world.get_blueprint_library().find('sensor.camera.rgb')
@@ -177,16 +242,21 @@ class CarlaEnv(gym.Env):
         self.rgb_cam.set_attribute('image_size_y', f'{self.im_height}')
         #self.rgb_cam.set_attribute('fov', '90')
         self.rgb_cam.set_attribute('fov', '100')
+        if self.render_schedule == 'decision':
+            # One capture per repeated action. The camera counts its own accumulated tick times, whose rounding may
+            # move a capture by a tick; _rendered_image then re-aligns the step to the captured frame instead of
+            # waiting sensor_timeout for a frame that never comes
+            self.rgb_cam.set_attribute('sensor_tick', str(self.repeat_action / self.fps))
 
 
         transform_front = carla.Transform(carla.Location(x=bound_x*1.5, y=0, z=bound_z*0.5), carla.Rotation(pitch=0)) #camera sensor position
         #transform_front = carla.Transform(carla.Location(x=bound_x*1.5, y=0, z=bound_z*0.5))
         self.sensor_front = self.world.spawn_actor(self.rgb_cam, transform_front, attach_to=self.vehicle)
-        self.sensor_front.listen(self.front_image_Queue.put)
-        self.actor_list.extend([self.sensor_front])
+        self.sensor_front.listen(self.front_image_buffer.put)
+        actor_list.extend([self.sensor_front])
 
-        # Preview ("above the car") camera
-        if self.preview_camera_enabled:
+        # Preview ("above the car") camera, nobody looks at it while training on the decision render schedule
+        if self._preview_spawned():
             
             self.preview_cam = self.world.get_blueprint_library().find('sensor.camera.rgb')
             self.preview_cam.set_attribute('image_size_x', '400')
@@ -194,13 +264,12 @@ class CarlaEnv(gym.Env):
             self.preview_cam.set_attribute('fov', '100')
             transform = carla.Transform(carla.Location(x=-5*bound_y, z=3*bound_z), carla.Rotation(pitch=6.0))
             self.preview_sensor = self.world.spawn_actor(self.preview_cam, transform, attach_to=self.vehicle, attachment_type=carla.AttachmentType.SpringArm)
-            self.preview_sensor.listen(self.preview_image_Queue.put)
-            self.actor_list.append(self.preview_sensor)
+            self.preview_sensor.listen(self.preview_image_buffer.put)
+            actor_list.append(self.preview_sensor)
         
 
         #some workarounds
-        self.vehicle.apply_control(carla.VehicleControl(throttle=1.0, brake=1.0))
-        time.sleep(4)
+        self.vehicle.apply_control(carla.VehicleControl(throttle=1.0, brake=1.0)) #held until the vehicle settles, see reset
 
         # Collision history is a list callback is going to append to (we brake simulation on a collision)
         self.collision_hist = []
@@ -214,38 +283,94 @@ class CarlaEnv(gym.Env):
         self.lanesensor.listen(lambda event: self._lane_invasion_data(event))
         #self.colsensor.listen(self._collision_data)
         #self.lanesensor.listen(self._lane_invasion_data)
-        self.actor_list.append(self.colsensor)
-        self.actor_list.append(self.lanesensor)
-
-        self.world.tick()
-
-        while self.front_image_Queue.empty():
-            logging.debug("waiting for camera to be ready")
-            time.sleep(0.01)
-            self.world.tick()
-
-        # Disengage brakes
-        self.vehicle.apply_control(carla.VehicleControl(brake=0.0))
+        actor_list.append(self.colsensor)
+        actor_list.append(self.lanesensor)
+
+    def _preview_spawned(self):
+        return self.preview_camera_enabled and (self.playing or self.render_schedule != 'decision')
+
+    def _wait_until_ready(self):
+        # Ticks until the ego vehicle rests on the road and the cameras delivered a frame. In synchronous mode nothing
+        # moves between ticks, so waiting in wall time (the former time.sleep(4)) only delayed every episode. The sensor
+        # waits of all the ticks share one sensor_timeout deadline, a dead camera costs seconds, not budget * timeout
+        location = self.vehicle.get_location()
+        first_frame_id = None
+        deadline = time.monotonic() + self.sensor_timeout
+        for _ in range(self.ready_tick_budget):
+            frame_id = self.session.tick(self)
+            if first_frame_id is None:
+                first_frame_id = frame_id
+            v = self.vehicle.get_velocity()
+            new_location = self.vehicle.get_location()
+            settled = math.sqrt(v.x**2 + v.y**2 + v.z**2) < self.settle_speed and \
+                abs(new_location.z - location.z) < self.settle_dz
+            location = new_location
+            if settled and self._sensors_ready(frame_id, first_frame_id, max(deadline - time.monotonic(), 0.0)):
+                break
+        else:
+            logging.warning("Ego vehicle not ready after {} ticks, starting the episode anyway".format(
+                self.ready_tick_budget))
 
-        image = self.front_image_Queue.get()
-        image = np.array(image.raw_data)
-        image = image.reshape((self.im_height, self.im_width, -1))
-        image = image[:, :, :3]
+        # Landing on the road may register as a collision or a lane invasion, the episode only starts now
+        self.collision_hist = []
+        self.lane_invasion_hist = []
+        return frame_id
+
+    def _sensors_ready(self, frame_id, first_frame_id, timeout):
+        if self.render_schedule == 'decision': #the front camera renders every repeat_action ticks, any new frame will do
+            latest_frame = self.front_image_buffer.latest_frame
+            if latest_frame is None or latest_frame < first_frame_id:
+                return False
+        elif not self.front_image_buffer.wait(frame_id, timeout=timeout):
+            return False
+        return not self._preview_spawned() or self.preview_image_buffer.wait(frame_id, timeout=timeout)
+
+    def _rendered_image(self, frame_id):
+        # Frame of the last tick of a step with the 'decision' schedule. A capture moved a tick early is already
+        # stored and taken, one moved a tick late is ticked on to with the same control; either way the camera counts
+        # its next sensor_tick from that frame, so the following steps are aligned again
+        first_frame_id = frame_id - self.repeat_action + 1
+        for _ in range(self.repeat_action): #a whole period without a capture means a broken camera, not rounding
+            image = self.front_image_buffer.get_from(first_frame_id, timeout=self.capture_grace)
+            if image is not None:
+                return image
+            frame_id = self.session.tick(self)
+        return self.front_image_buffer.get(frame_id, timeout=self.sensor_timeout)
+
+    def _teleport_ego(self):
+        # Move the pooled ego vehicle to the new start, at rest and braking, instead of respawning it and its sensors
+        self.start_transform = self._get_start_transform(ignore_ids=(self.vehicle.id,))
+        self.curr_loc = self.start_transform.location
+        self.vehicle.set_transform(self.start_transform)
+        self.vehicle.set_target_velocity(carla.Vector3D(0.0, 0.0, 0.0))
+        self.vehicle.set_target_angular_velocity(carla.Vector3D(0.0, 0.0, 0.0))
+        self.vehicle.apply_control(carla.VehicleControl(throttle=0.0, steer=0.0, brake=1.0))
+        self._move_spectator()
+
+        # Drop frames and events from the previous episode, the listeners keep pushing into the same buffers
+        self.front_image_buffer.clear()
+        self.preview_image_buffer.clear()
+        self.collision_hist = []
+        self.lane_invasion_hist = []
 
-        return image
+    def _move_spectator(self):
+        spectator = self.world.get_spectator()
+        spectator.set_transform(carla.Transform(self.curr_loc + carla.Location(x=0, z=70), carla.Rotation(pitch=-90.0)))              
 
     def step(self, action): #executing single action, _step is defined below
         total_reward = 0
-        for _ in range(self.repeat_action):
-            obs, rew, done, info = self._step(action)
+        for i in range(self.repeat_action):
+            # Every sub-step ticks and is rewarded, only the last one (or a terminal one) decodes its camera frame
+            obs, rew, done, info = self._step(action, observe=(i == self.repeat_action - 1))
             total_reward += rew
             if done:
                 break
         return obs, total_reward, done, info
 
     # Steps environment
-    def _step(self, action):
-        self.world.tick()
+    def _step(self, action, observe=True):
+        with self.timer.phase('tick'):
+            frame_id = self.session.tick(self)
         #self.render()
             
         self.frame_step += 1
@@ -290,33 +415,21 @@ class CarlaEnv(gym.Env):
         logging.debug('{}, {}, {}'.format(action.throttle, action.steer, action.brake))
         self.vehicle.apply_control(action)
 
+        self.timer.start('reward')
         # Calculate speed in km/h from car's velocity
         v = self.vehicle.get_velocity()
         kmh = 3.6 * math.sqrt(v.x**2 + v.y**2 + v.z**2)
 
-        loc = self.vehicle.get_location()
+        transform = self.vehicle.get_transform()
+        loc = transform.location
         new_dist_from_start = loc.distance(self.start_transform.location)
         square_dist_diff = new_dist_from_start ** 2 - self.dist_from_start ** 2
         self.dist_from_start = new_dist_from_start
-
-        image = self.front_image_Queue.get()
-        image = np.array(image.raw_data)
-        image = image.reshape((self.im_height, self.im_width, -1))
-
-        
-        if 'rgb' in self.sensors:
-            image = image[:, :, :3]
-        if 'semantic' in self.sensors:
-            image = image[:, :, 2]
-            image = (np.arange(13) == image[..., None]) #one hot encoded representation of pixels into classes
-            image = np.concatenate((image[:, :, 2:3], image[:, :, 6:8]), axis=2) #select   relevant classes and concatenate
-            image = image * 255 #converts image back to pxel value range
-            # logging.debug('{}'.format(image.shape))
-            # assert image.shape[0] == self.im_height
-            # assert image.shape[1] == self.im_width
-            # assert image.shape[2] == 3
+        # Incremental projection on the cached route, no map query per step
+        projection = self.route.project(loc, transform.rotation.yaw) if self.reward_type == 'route_progress' else None
 
         # dis_to_left, dis_to_right, sin_diff, cos_diff = dist_to_roadline(self.map, self.vehicle)
+        lane = self.lane_geometry.lane_offset(loc.x, loc.y) if self.lane_geometry is not None else None #no map query
 
         done = False
         reward = 0
@@ -350,7 +463,17 @@ class CarlaEnv(gym.Env):
 
         # reward += 0.1 * kmh
 
-        reward += square_dist_diff
+        if lane is not None:
+            info['lane'] = {'lateral_offset': lane.lateral_offset, 'distance_to_left': lane.distance_to_left,
+                            'distance_to_right': lane.distance_to_right, 'in_junction': lane.is_junction}
+
+        if projection is not None:
+            reward += projection.progress - self.route_progress
+            self.route_progress = projection.progress
+            info['route'] = {'progress': projection.progress, 'lateral_offset': projection.lateral_offset,
+                             'heading_error': projection.heading_error}
+        else:
+            reward += square_dist_diff
 
         # # Reward for speed
         # if not self.playing:
@@ -366,6 +489,12 @@ class CarlaEnv(gym.Env):
         if self.frame_step >= self.steps_per_episode:
             done = True
 
+        if self.preempted: #the ego drove uncontrolled while another env ticked, cut the episode like a time limit
+            info['preempted'] = True
+            if not done: #a collision or lane invasion this step stays a real terminal state
+                done = True
+                info['TimeLimit.truncated'] = True
+
         # if not self._on_highway(): #if vehicle is out of highway for more than 4sec, end episode
         #    self.out_of_loop += 1
         #    if self.out_of_loop >= 4:
@@ -375,12 +504,31 @@ class CarlaEnv(gym.Env):
 
         # self.total_reward += reward
 
+        self.timer.stop('reward')
+
+        image = None
+        if observe or done:
+            with self.timer.phase('sensor_wait'):
+                if self.render_schedule != 'decision':
+                    image = self.front_image_buffer.get(frame_id, timeout=self.sensor_timeout) #camera frame of this tick, not a stale one
+                elif observe:
+                    image = self._rendered_image(frame_id)
+                else:
+                    image = self.front_image_buffer.get() #episode ended between two rendered ticks, use the last rendered frame
+            with self.timer.phase('decode'):
+                image = self._get_observation(image)
+
         if done:
             # info['episode'] = {}
             # info['episode']['l'] = self.frame_step
             # info['episode']['r'] = reward
             logging.debug("Env lasts {} steps, restarting ... ".format(self.frame_step))
             self._destroy_agents()
+
+        info['timing'] = self.timer.summary()
+        if self.timer.enabled: #cumulative front camera counters, e.g. timeouts reveal a server falling behind
+            for key, value in self.front_image_buffer.stats().items():
+                info['timing']['front_sensor_{}'.format(key)] = value
         
         return image, reward, done, info
     
@@ -397,6 +545,7 @@ class CarlaEnv(gym.Env):
 
 #
 #        if self.preview_camera_enabled:
+#            import graphics, pygame #only the dashboard needs them, importing them costs every env process ~0.5 s
 #
 #            self._display, self._clock, self._font = graphics.setup(
             #     width=400,
@@ -404,7 +553,7 @@ class CarlaEnv(gym.Env):
             #     render=(mode=="human"),
             # )
 
-            # preview_img = self.preview_image_Queue.get()
+            # preview_img = self.preview_image_buffer.get()
             # preview_img = np.array(preview_img.raw_data)
             # preview_img = preview_img.reshape((400, 400, -1))
             # preview_img = preview_img[:, :, :3]
@@ -460,8 +609,20 @@ class CarlaEnv(gym.Env):
 
     
     def _destroy_agents(self):
+        with self.timer.phase('destroy'):
+            self._destroy_actors(self.actor_list)
+            self.actor_list = []
+            if self.traffic is not None:
+                self.traffic.destroy()
 
-        for actor in self.actor_list:
+    def _destroy_pooled_agents(self):
+        self._destroy_actors(self.pooled_actor_list)
+        self.pooled_actor_list = []
+
+    @staticmethod
+    def _destroy_actors(actor_list):
+
+        for actor in actor_list:
 
             # If it has a callback attached, remove it first
             if hasattr(actor, 'is_listening') and actor.is_listening:
@@ -471,7 +632,26 @@ class CarlaEnv(gym.Env):
             if actor.is_alive:
                 actor.destroy()
 
-        self.actor_list = []
+    def _pooled_actors_alive(self):
+        return len(self.pooled_actor_list) > 0 and all(actor.is_alive for actor in self.pooled_actor_list)
+
+    def close(self):
+        self._destroy_agents()
+        self._destroy_pooled_agents()
+        if self.session is not None:
+            self.session.release(self)
+            self.session = None
+
+    def on_preempted(self):
+        # Called by the session when another env on the same server starts ticking it
+        self.preempted = True
+
+    def _get_observation(self, image):
+        # The front camera is an RGB camera whenever 'rgb' is requested, see reset
+        if 'rgb' in self.sensors:
+            return self.frame_decoder.decode(image)
+        #semantic tags -> selected classes (one hot, class index or bit-packed), uint8 as in observation_space
+        return self.semantic_encoder.encode(image)
 
     def _collision_data(self, event):
 
@@ -515,14 +695,17 @@ class CarlaEnv(gym.Env):
     #     goal_waypoint = self.map.get_waypoint_xodr(road_id, goal_lane_id, vehicle_s)
     #     return not (goal_waypoint is None)
 
-    def _get_start_transform(self):
+    def _get_start_transform(self, ignore_ids=()):
         if self.start_transform_type == 'random':
-            return random.choice(self.map.get_spawn_points())
+            start_transforms = self.spawn_sampler.sample(ignore_ids=ignore_ids)
+            if not start_transforms:
+                raise Exception('Every spawn point is occupied')
+            return start_transforms[0]
 
         if self.start_transform_type == 'highway':
             if self.map.name == "Town03":
                 for trial in range(10):
-                    start_transform = random.choice(self.map.get_spawn_points())
+                    start_transform = random.choice(self.spawn_sampler.spawn_points)
                     start_waypoint = self.map.get_waypoint(start_transform.location)
                     if start_waypoint.road_id in list(range(15, 90)): 
                         break
@@ -577,75 +760,16 @@ class CarlaEnv(gym.Env):
             #         init_transforms.append(self.map.get_waypoint_xodr(road_id, lane_id, vehicle_s).transform)
 
     def pure_pursuit(self):
-        L = 2.875
-        Kdd = 4.0
-        alpha_prev = 0
-
-        transform = carla.Transform(carla.Location(x=193.5, y=125, z=1.85), carla.Rotation(yaw=270, pitch=0, roll=0)) #town2 90deg left1
-        #transform = carla.Transform(carla.Location(x=183, y=105.5, z=1.85), carla.Rotation(yaw=180, pitch=0, roll=0)) #town2 straight1
-        #transform = carla.Transform(carla.Location(x=50, y=105.5, z=1.85), carla.Rotation(yaw=180, pitch=0, roll=0)) #town2 90deg left2
-        #transform = carla.Transform(carla.Location(x=18, y=105.5, z=1.85), carla.Rotation(yaw=180, pitch=0, roll=0)) #town2 90deg left2
-        #transform = carla.Transform(carla.Location(x=-7, y=160, z=1.85), carla.Rotation(yaw=90, pitch=0, roll=0)) #town2 90deg left3
-        #transform = carla.Transform(carla.Location(x=-7, y=235, z=1.85), carla.Rotation(yaw=90, pitch=0, roll=0)) #town2 straight
-        #transform = carla.Transform(carla.Location(x=-7, y=285, z=1.85), carla.Rotation(yaw=90, pitch=0, roll=0)) #town2 straight
-        #transform = carla.Transform(carla.Location(x=12, y=306.5, z=1.85), carla.Rotation(yaw=0, pitch=0, roll=0)) #town2 90deg left5
-        #transform = carla.Transform(carla.Location(x=160, y=306.5, z=1.85), carla.Rotation(yaw=0, pitch=0, roll=0)) #town2 90deg left6
-        #transform = carla.Transform(carla.Location(x=193.5, y=270.5, z=1.85), carla.Rotation(yaw=-90, pitch=0, roll=0)) #town2 straight
-        #transform = carla.Transform(carla.Location(x=193.5, y=212, z=1.85), carla.Rotation(yaw=-90, pitch=0, roll=0)) #town2 straight
-  
-        vehicle_loc = self.vehicle.get_location()
-        wp = self.map.get_waypoint(vehicle_loc, project_to_road=True, lane_type=carla.LaneType.Driving)
-
-        waypoints = []
-        num_wp = 300
-        for _ in range(num_wp):
-            wp = wp.next(2.0)[0]
-            waypoints.append(wp)
-
-        waypoint_list = [(wp.transform.location.x, wp.transform.location.y) for wp in waypoints]
-
-        def calc_steering_angle(alpha, ld):
-            delta_prev = 0
-            delta = math.atan2(2 * L * np.sin(alpha), ld)
-            delta = np.clip(delta, -1.0, 1.0)
-            if math.isnan(delta):
-                delta = delta_prev
-            else:
-                delta_prev = delta
-            return delta
-
-        def get_target_wp_index(veh_location, waypoint_list):
-            dx = [abs(veh_location.x - wp[0]) for wp in waypoint_list]
-            dy = [abs(veh_location.y - wp[1]) for wp in waypoint_list]
-            dist = np.hypot(dx, dy)
-            idx = np.argmin(dist) + 4
-            if idx >= len(waypoint_list):
-                idx = len(waypoint_list) - 1
-            return idx, waypoint_list[idx][0], waypoint_list[idx][1]
-
-        def get_lookahead_dist(vf):
-            #return (20/3.6)*2 #taking 20kmph as vehicle velocity
-            return Kdd * vf
-
-        t = 0
-        while t < num_wp:
+        with self.timer.phase('pure_pursuit'):
+            # The route is generated once per episode, see reset, and only searched around the last matched waypoint
             veh_transform = self.vehicle.get_transform()
-            veh_location = self.vehicle.get_location()
+            veh_location = veh_transform.location
             veh_vel = self.vehicle.get_velocity()
-            vf = np.sqrt(veh_vel.x**2 + veh_vel.y**2)
-            vf = np.clip(vf, 0.1, 2.5)
 
-            min_index, tx, ty = get_target_wp_index(veh_location, waypoint_list)
-            ld = get_lookahead_dist(vf)
+            min_index, tx, ty = self.route.target(veh_location, lookahead=pure_pursuit.TARGET_OFFSET)
+            ld = pure_pursuit.lookahead_distance(np.hypot(veh_vel.x, veh_vel.y))
+            #ld = (20/3.6)*2 #taking 20kmph as vehicle velocity
 
             yaw = np.radians(veh_transform.rotation.yaw)
-            alpha = math.atan2(ty - veh_location.y, tx - veh_location.x) - yaw
-            #alpha = np.clip(alpha, -np.pi, np.pi)
-            if math.isnan(alpha):
-                alpha = alpha_prev
-            else:
-                alpha_prev = alpha
-        
-            steer_angle = calc_steering_angle(alpha, ld)
-    
-            return steer_angle
+            delta = pure_pursuit.steering_angle([[veh_location.x, veh_location.y]], yaw, [[tx, ty]], ld)
+            return float(delta[0])
@@ -7,12 +7,13 @@ from stable_baselines3.sac import CnnPolicy
 from stable_baselines3.common.noise import NormalActionNoise
 from stable_baselines3.common.evaluation import evaluate_policy
 from carla_env import CarlaEnv
+from latent_replay import encode, load_encoder
 import argparse
 import sys
 import torch
 
 def main(model_name,load_model, town, fps, im_width, im_height, repeat_action, start_transform_type, sensors, 
-enable_preview, enable_spectator, steps_per_episode, seed=7, action_type='fix_throttle'):
+enable_preview, enable_spectator, steps_per_episode, seed=7, action_type='fix_throttle', encoder_path=None):
     
     env = CarlaEnv(town, fps, im_width, im_height, repeat_action, start_transform_type, sensors,
                    action_type, enable_preview, enable_spectator, steps_per_episode, playing=False)
@@ -20,10 +21,11 @@ enable_preview, enable_spectator, steps_per_episode, seed=7, action_type='fix_th
     try:
         device = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
         model = SAC.load(model_name, device = device)
+        encoder = load_encoder(encoder_path) if encoder_path else None #models trained with --latent-replay
 
         obs = env.reset()
         while True:
-            action, _states = model.predict(obs)
+            action, _states = model.predict(obs if encoder is None else encode(encoder, obs[None])[0])
             obs, reward, done, info = env.step(action)
             print(reward, info)
             if done:
@@ -48,6 +50,7 @@ if __name__ == "__main__":
     parser.add_argument('--spectator', action='store_true', help='whether to enable spectator camera')
     parser.add_argument('--episode-length', type=int, help='maximum number of steps per episode')
     parser.add_argument('--seed', type=int, default=7, help='random seed for initialization')
+    parser.add_argument('--encoder', type=str, default=None, help='frozen encoder of a --latent-replay model')
     
     args = parser.parse_args()
     model_name = args.model_name
@@ -66,4 +69,4 @@ if __name__ == "__main__":
 
 
     main(model_name, load_model, town, fps, im_width, im_height, repeat_action, start_transform_type, sensors, 
-         enable_preview, enable_spectator, steps_per_episode, seed)
\ No newline at end of file
+         enable_preview, enable_spectator, steps_per_episode, seed, encoder_path=args.encoder)
\ No newline at end of file
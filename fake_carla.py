@@ -0,0 +1,1339 @@
+"""Offline stand-in for the subset of the `carla` Python API used by `CarlaEnv`.
+
+The module simulates, in-process and on the CPU, what `setup.py`,
+`carla_env.py` and `train_sac.py` need from a `CARLA` server:
+
+    * `Client`, `World` (synchronous `tick`, settings, actors, snapshots),
+      `Map` (spawn points, waypoints, topology, OpenDRIVE), the blueprint
+      library, `TrafficManager` and `carla.command` batches.
+    * Vehicles driven by a kinematic bicycle model, falling onto the ground
+      after spawning; Traffic Manager vehicles following their lane.
+    * Cameras producing synthetic BGRA (RGB or semantic tag) frames, honouring
+      `image_size_x/y` and `sensor_tick`, plus collision and lane-invasion
+      sensors. Sensor callbacks run inside `World.tick`.
+
+Every town is the same ring road (two straights per axis joined by arcs).
+A simulated server exists per `(host, port)`, so several clients can share
+one world. RPC-like calls are counted per server in `Server.calls` and can
+be given an artificial latency with `configure`.
+
+Usage:
+
+    import fake_carla
+    fake_carla.install() # `import carla` now returns this module
+    from carla_env import CarlaEnv
+"""
+
+import collections
+import fnmatch
+import functools
+import itertools
+import math
+import sys
+import time
+
+import numpy as np
+
+__version__ = "0.9.15-fake"
+
+GRAVITY = 9.81
+WHEELBASE = 2.875
+MAX_STEER_ANGLE = math.radians(70.0)
+MAX_ACCELERATION = 6.0
+MAX_DECELERATION = 9.0
+DEFAULT_FIXED_DELTA_SECONDS = 0.05
+
+RING_LENGTH_X = 200.0
+RING_LENGTH_Y = 120.0
+RING_RADIUS = 20.0
+LANE_WIDTH = 3.5
+SPAWN_POINT_SPACING = 12.0
+SPAWN_POINT_HEIGHT = 0.5
+DEFAULT_TOWN = "Town10HD_Opt"
+TOWNS = ("Town01", "Town02", "Town03", "Town04", "Town05", "Town10HD_Opt")
+
+_LATENCY = {"rpc": 0.0, "load_world": 0.0, "tick": 0.0}
+
+
+def configure(rpc_latency=None, load_world_latency=None, tick_latency=None):
+    """Sets the artificial latency (in seconds) of RPC calls, `load_world` and `tick`."""
+    for key, value in (("rpc", rpc_latency), ("load_world", load_world_latency), ("tick", tick_latency)):
+        if value is not None:
+            _LATENCY[key] = value
+
+
+def install():
+    """Makes `import carla` return this module and returns it."""
+    module = sys.modules[__name__]
+    sys.modules["carla"] = module
+    return module
+
+
+def _rpc(method):
+    # Counts the call on the server owning `self` and pays the RPC latency.
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._server.calls[name] += 1
+        if _LATENCY["rpc"] > 0.0:
+            time.sleep(_LATENCY["rpc"])
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+# -----------------------------------------------------------------------------
+# Geometry.
+# -----------------------------------------------------------------------------
+
+
+class Vector3D(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k):
+        return type(self)(self.x * k, self.y * k, self.z * k)
+
+    def __eq__(self, other):
+        return isinstance(other, Vector3D) and (self.x, self.y, self.z) == (other.x, other.y, other.z)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def length(self):
+        return math.sqrt(self.x**2 + self.y**2 + self.z**2)
+
+    def distance(self, other):
+        return math.sqrt((self.x - other.x)**2 + (self.y - other.y)**2 + (self.z - other.z)**2)
+
+    def __repr__(self):
+        return "{}(x={:.6f}, y={:.6f}, z={:.6f})".format(type(self).__name__, self.x, self.y, self.z)
+
+
+class Location(Vector3D):
+    pass
+
+
+class Vector2D(object):
+
+    def __init__(self, x=0.0, y=0.0):
+        self.x = float(x)
+        self.y = float(y)
+
+
+class Rotation(object):
+
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def get_forward_vector(self):
+        yaw, pitch = math.radians(self.yaw), math.radians(self.pitch)
+        return Vector3D(math.cos(pitch) * math.cos(yaw), math.cos(pitch) * math.sin(yaw), math.sin(pitch))
+
+    def get_right_vector(self):
+        yaw = math.radians(self.yaw)
+        return Vector3D(-math.sin(yaw), math.cos(yaw), 0.0)
+
+    def __repr__(self):
+        return "Rotation(pitch={:.6f}, yaw={:.6f}, roll={:.6f})".format(self.pitch, self.yaw, self.roll)
+
+
+class Transform(object):
+
+    def __init__(self, location=None, rotation=None):
+        self.location = location if location is not None else Location()
+        self.rotation = rotation if rotation is not None else Rotation()
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+    def get_right_vector(self):
+        return self.rotation.get_right_vector()
+
+    def transform(self, point):
+        """Returns `point`, relative to this transform, in world coordinates (yaw only)."""
+        yaw = math.radians(self.rotation.yaw)
+        return Location(self.location.x + point.x * math.cos(yaw) - point.y * math.sin(yaw),
+                        self.location.y + point.x * math.sin(yaw) + point.y * math.cos(yaw),
+                        self.location.z + point.z)
+
+    def __repr__(self):
+        return "Transform({}, {})".format(self.location, self.rotation)
+
+
+def _copy_transform(transform):
+    return Transform(Location(transform.location.x, transform.location.y, transform.location.z),
+                     Rotation(transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll))
+
+
+class BoundingBox(object):
+
+    def __init__(self, location=None, extent=None):
+        self.location = location if location is not None else Location()
+        self.extent = extent if extent is not None else Vector3D()
+
+
+class Color(object):
+
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r, self.g, self.b, self.a = r, g, b, a
+
+
+# -----------------------------------------------------------------------------
+# Enumerations and settings.
+# -----------------------------------------------------------------------------
+
+
+class LaneType(object):
+    NONE = 1
+    Driving = 2
+    Stop = 4
+    Shoulder = 8
+    Biking = 16
+    Sidewalk = 32
+    Border = 64
+    Any = -2
+
+
+class LaneChange(object):
+    NONE = 0
+    Right = 1
+    Left = 2
+    Both = 3
+
+
+class LaneMarkingType(object):
+    NONE = "NONE"
+    Other = "Other"
+    Broken = "Broken"
+    Solid = "Solid"
+    SolidSolid = "SolidSolid"
+
+
+class LaneMarkingColor(object):
+    Standard = "Standard"
+    White = "White"
+    Yellow = "Yellow"
+
+
+class LaneMarking(object):
+
+    def __init__(self, type=LaneMarkingType.Solid, color=LaneMarkingColor.White, width=0.15,
+                 lane_change=LaneChange.NONE):
+        self.type = type
+        self.color = color
+        self.width = width
+        self.lane_change = lane_change
+
+
+class AttachmentType(object):
+    Rigid = 0
+    SpringArm = 1
+    SpringArmGhost = 2
+
+
+class VehicleLightState(object):
+    NONE = 0
+    Position = 1
+    LowBeam = 2
+    HighBeam = 4
+    Brake = 8
+    All = 0xFFFF
+
+
+class VehicleControl(object):
+
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False, manual_gear_shift=False,
+                 gear=0):
+        self.throttle = float(throttle)
+        self.steer = float(steer)
+        self.brake = float(brake)
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WeatherParameters(object):
+
+    def __init__(self, cloudiness=0.0, precipitation=0.0, sun_altitude_angle=45.0):
+        self.cloudiness = cloudiness
+        self.precipitation = precipitation
+        self.sun_altitude_angle = sun_altitude_angle
+
+
+WeatherParameters.ClearNoon = WeatherParameters(cloudiness=5.0, sun_altitude_angle=45.0)
+WeatherParameters.CloudyNoon = WeatherParameters(cloudiness=60.0, sun_altitude_angle=45.0)
+WeatherParameters.ClearSunset = WeatherParameters(cloudiness=5.0, sun_altitude_angle=15.0)
+
+
+class WorldSettings(object):
+
+    def __init__(self, synchronous_mode=False, no_rendering_mode=False, fixed_delta_seconds=None,
+                 substepping=True, max_substep_delta_time=0.01, max_substeps=10):
+        self.synchronous_mode = synchronous_mode
+        self.no_rendering_mode = no_rendering_mode
+        self.fixed_delta_seconds = fixed_delta_seconds
+        self.substepping = substepping
+        self.max_substep_delta_time = max_substep_delta_time
+        self.max_substeps = max_substeps
+
+    def _copy(self):
+        return WorldSettings(self.synchronous_mode, self.no_rendering_mode, self.fixed_delta_seconds,
+                             self.substepping, self.max_substep_delta_time, self.max_substeps)
+
+
+# -----------------------------------------------------------------------------
+# Map: a ring road sampled into arrays.
+# -----------------------------------------------------------------------------
+
+
+class _Ring(object):
+    """Closed lane centerline made of four straights joined by quarter arcs."""
+
+    RESOLUTION = 0.25
+
+    def __init__(self, length_x=RING_LENGTH_X, length_y=RING_LENGTH_Y, radius=RING_RADIUS):
+        # (kind, length, start x, start y, start yaw) of every road, driving counter-clockwise in yaw.
+        self.roads = []
+        x, y, yaw = radius, 0.0, 0.0
+        for straight in (length_x, length_y, length_x, length_y):
+            self.roads.append(("straight", straight, x, y, yaw))
+            x += straight * math.cos(yaw)
+            y += straight * math.sin(yaw)
+            self.roads.append(("arc", 0.5 * math.pi * radius, x, y, yaw))
+            cx, cy = x - radius * math.sin(yaw), y + radius * math.cos(yaw)
+            yaw += 0.5 * math.pi
+            x, y = cx + radius * math.sin(yaw), cy - radius * math.cos(yaw)
+        self.radius = radius
+        self.road_start = np.cumsum([0.0] + [road[1] for road in self.roads])
+        self.length = float(self.road_start[-1])
+
+        self.s = np.arange(0.0, self.length, self.RESOLUTION)
+        poses = np.array([self._exact_pose(s) for s in self.s])
+        self.x, self.y, self.yaw = poses[:, 0], poses[:, 1], poses[:, 2]
+
+    def road_of(self, s):
+        s = s % self.length
+        road_id = int(np.searchsorted(self.road_start, s, side="right") - 1)
+        return min(road_id, len(self.roads) - 1), s - self.road_start[min(road_id, len(self.roads) - 1)]
+
+    def _exact_pose(self, s):
+        road_id, ds = self.road_of(s)
+        kind, _, x, y, yaw = self.roads[road_id]
+        if kind == "straight":
+            return x + ds * math.cos(yaw), y + ds * math.sin(yaw), yaw
+        cx, cy = x - self.radius * math.sin(yaw), y + self.radius * math.cos(yaw)
+        heading = yaw + ds / self.radius
+        return cx + self.radius * math.sin(heading), cy - self.radius * math.cos(heading), heading
+
+    def pose(self, s):
+        """Returns `(x, y, yaw[rad])` at arc length `s`."""
+        return self._exact_pose(s)
+
+    def project(self, x, y):
+        """Returns `(s, lateral offset)` of the closest centerline point, positive to the right."""
+        i = int(np.argmin((self.x - x)**2 + (self.y - y)**2))
+        yaw = self.yaw[i]
+        dx, dy = x - self.x[i], y - self.y[i]
+        along = dx * math.cos(yaw) + dy * math.sin(yaw)
+        lateral = -dx * math.sin(yaw) + dy * math.cos(yaw)
+        return (self.s[i] + along) % self.length, lateral
+
+
+class Waypoint(object):
+
+    def __init__(self, carla_map, s):
+        self._map = carla_map
+        self._server = carla_map._server
+        self.s_ring = s % carla_map._ring.length
+        self.road_id, self.s = carla_map._ring.road_of(self.s_ring)
+        self.id = int(self.s_ring * 100)
+        self.lane_id = -1
+        self.section_id = 0
+        self.lane_width = LANE_WIDTH
+        self.lane_type = LaneType.Driving
+        self.is_junction = False
+        self.is_intersection = False
+        self.lane_change = LaneChange.NONE
+        self.left_lane_marking = LaneMarking(LaneMarkingType.Solid, LaneMarkingColor.Yellow)
+        self.right_lane_marking = LaneMarking(LaneMarkingType.Solid, LaneMarkingColor.White)
+        x, y, yaw = carla_map._ring.pose(self.s_ring)
+        self.transform = Transform(Location(x, y, 0.0), Rotation(yaw=math.degrees(yaw)))
+
+    @_rpc
+    def next(self, distance):
+        return [Waypoint(self._map, self.s_ring + distance)]
+
+    @_rpc
+    def previous(self, distance):
+        return [Waypoint(self._map, self.s_ring - distance)]
+
+    def get_left_lane(self):
+        return None
+
+    def get_right_lane(self):
+        return None
+
+    def get_junction(self):
+        return None
+
+    def __repr__(self):
+        return "Waypoint(road_id={}, lane_id={}, s={:.2f})".format(self.road_id, self.lane_id, self.s)
+
+
+class Map(object):
+
+    def __init__(self, server, town):
+        self._server = server
+        self._ring = server.ring
+        self.name = "Carla/Maps/{}".format(town)
+
+    @_rpc
+    def get_spawn_points(self):
+        spawn_points = []
+        for s in np.arange(0.0, self._ring.length - SPAWN_POINT_SPACING / 2, SPAWN_POINT_SPACING):
+            x, y, yaw = self._ring.pose(s)
+            spawn_points.append(Transform(Location(x, y, SPAWN_POINT_HEIGHT), Rotation(yaw=math.degrees(yaw))))
+        return spawn_points
+
+    @_rpc
+    def get_waypoint(self, location, project_to_road=True, lane_type=LaneType.Driving):
+        s, lateral = self._ring.project(location.x, location.y)
+        if not project_to_road and abs(lateral) > LANE_WIDTH / 2:
+            return None
+        return Waypoint(self, s)
+
+    @_rpc
+    def generate_waypoints(self, distance):
+        return [Waypoint(self, s) for s in np.arange(0.0, self._ring.length, distance)]
+
+    @_rpc
+    def get_topology(self):
+        topology = []
+        for road_id in range(len(self._ring.roads)):
+            start, end = self._ring.road_start[road_id], self._ring.road_start[road_id + 1]
+            topology.append((Waypoint(self, start), Waypoint(self, end - 1e-3)))
+        return topology
+
+    @_rpc
+    def to_opendrive(self):
+        roads = "".join('<road id="{}" type="{}" length="{:.3f}"/>'.format(i, road[0], road[1])
+                        for i, road in enumerate(self._ring.roads))
+        return '<?xml version="1.0"?><OpenDRIVE><header name="{}"/>{}</OpenDRIVE>'.format(self.name, roads)
+
+    def get_junction(self, location):
+        return None
+
+    def __repr__(self):
+        return "Map(name={})".format(self.name)
+
+
+# -----------------------------------------------------------------------------
+# Blueprints.
+# -----------------------------------------------------------------------------
+
+
+class ActorAttribute(object):
+
+    def __init__(self, id, value, recommended_values=()):
+        self.id = id
+        self.value = str(value)
+        self.recommended_values = list(recommended_values)
+
+    def as_str(self):
+        return self.value
+
+    def as_int(self):
+        return int(float(self.value))
+
+    def as_float(self):
+        return float(self.value)
+
+    def as_bool(self):
+        return self.value.lower() == "true"
+
+    def __str__(self):
+        return self.value
+
+    def __int__(self):
+        return self.as_int()
+
+    def __float__(self):
+        return self.as_float()
+
+
+class ActorBlueprint(object):
+
+    def __init__(self, id, tags, attributes):
+        self.id = id
+        self.tags = list(tags)
+        self._attributes = dict(attributes)
+
+    def has_attribute(self, id):
+        return id in self._attributes
+
+    def get_attribute(self, id):
+        value = self._attributes[id]
+        recommended = value if isinstance(value, (list, tuple)) else [value]
+        return ActorAttribute(id, recommended[0], recommended)
+
+    def set_attribute(self, id, value):
+        if id not in self._attributes:
+            raise IndexError("blueprint {} has no attribute {}".format(self.id, id))
+        self._attributes[id] = str(value)
+
+    def has_tag(self, tag):
+        return tag in self.tags
+
+    def match_tags(self, pattern):
+        return any(fnmatch.fnmatch(tag, pattern) for tag in self.tags)
+
+    def _copy(self):
+        return ActorBlueprint(self.id, self.tags, self._attributes)
+
+    def __iter__(self):
+        return iter(self.get_attribute(id) for id in self._attributes)
+
+    def __repr__(self):
+        return "ActorBlueprint(id={})".format(self.id)
+
+
+_VEHICLE_EXTENTS = {
+    "vehicle.dodge.charger_2020": (2.5, 1.05, 0.77),
+    "vehicle.tesla.model3": (2.4, 1.08, 0.75),
+    "vehicle.audi.tt": (2.1, 1.0, 0.69),
+    "vehicle.lincoln.mkz_2020": (2.45, 1.07, 0.75),
+    "vehicle.toyota.prius": (2.26, 1.0, 0.76),
+    "vehicle.nissan.patrol": (2.3, 0.96, 0.93),
+}
+
+
+def _make_blueprints():
+    blueprints = []
+    for id in sorted(_VEHICLE_EXTENTS):
+        blueprints.append(ActorBlueprint(id, ["vehicle", "car"] + id.split(".")[1:], {
+            "role_name": "autopilot",
+            "color": ["0,0,0", "255,255,255", "200,20,20"],
+            "generation": "2",
+            "base_type": "car",
+            "number_of_wheels": "4",
+        }))
+    camera = {"image_size_x": "800", "image_size_y": "600", "fov": "90", "sensor_tick": "0.0", "role_name": "front"}
+    blueprints.append(ActorBlueprint("sensor.camera.rgb", ["sensor", "camera", "rgb"], camera))
+    blueprints.append(ActorBlueprint("sensor.camera.semantic_segmentation",
+                                     ["sensor", "camera", "semantic_segmentation"], camera))
+    blueprints.append(ActorBlueprint("sensor.other.collision", ["sensor", "other", "collision"], {"role_name": ""}))
+    blueprints.append(ActorBlueprint("sensor.other.lane_invasion", ["sensor", "other", "lane_invasion"],
+                                     {"role_name": ""}))
+    return blueprints
+
+
+_BLUEPRINTS = _make_blueprints()
+
+
+class BlueprintLibrary(object):
+
+    def __init__(self, blueprints):
+        self._blueprints = [bp._copy() for bp in blueprints]
+
+    def filter(self, pattern):
+        return [bp for bp in self._blueprints
+                if fnmatch.fnmatch(bp.id, pattern) or bp.match_tags(pattern)]
+
+    def find(self, id):
+        for bp in self._blueprints:
+            if bp.id == id:
+                return bp
+        raise IndexError("blueprint {} not found".format(id))
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+    def __getitem__(self, index):
+        return self._blueprints[index]
+
+
+# -----------------------------------------------------------------------------
+# Actors.
+# -----------------------------------------------------------------------------
+
+
+class Actor(object):
+
+    def __init__(self, world, blueprint, transform, parent=None, attachment_type=AttachmentType.Rigid):
+        self._world = world
+        self._server = world._server
+        self.id = next(world._server.actor_ids)
+        self.type_id = blueprint.id if blueprint is not None else "spectator"
+        self.attributes = dict((a.id, a.value) for a in blueprint) if blueprint is not None else {}
+        self.parent = parent
+        self.attachment_type = attachment_type
+        self._transform = _copy_transform(transform)
+        self._alive = True
+        self.bounding_box = BoundingBox()
+
+    @property
+    def is_alive(self):
+        return self._alive
+
+    @_rpc
+    def get_transform(self):
+        return self._world_transform()
+
+    @_rpc
+    def get_location(self):
+        return self._world_transform().location
+
+    @_rpc
+    def set_transform(self, transform):
+        self._transform = _copy_transform(transform)
+
+    @_rpc
+    def set_location(self, location):
+        self._transform.location = Location(location.x, location.y, location.z)
+
+    @_rpc
+    def get_velocity(self):
+        return self._velocity()
+
+    @_rpc
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    @_rpc
+    def get_acceleration(self):
+        return Vector3D()
+
+    @_rpc
+    def destroy(self):
+        if not self._alive:
+            return False
+        self._world._remove(self)
+        return True
+
+    def _velocity(self):
+        return Vector3D()
+
+    def _world_transform(self):
+        if self.parent is None:
+            return _copy_transform(self._transform)
+        parent = self.parent._world_transform()
+        location = parent.transform(self._transform.location)
+        return Transform(location, Rotation(self._transform.rotation.pitch,
+                                            parent.rotation.yaw + self._transform.rotation.yaw,
+                                            self._transform.rotation.roll))
+
+    def _tick(self, dt):
+        pass
+
+    def __repr__(self):
+        return "Actor(id={}, type={})".format(self.id, self.type_id)
+
+
+class Vehicle(Actor):
+    """Kinematic bicycle model that falls onto the ground (z = 0) after spawning."""
+
+    def __init__(self, world, blueprint, transform, parent=None, attachment_type=AttachmentType.Rigid):
+        super().__init__(world, blueprint, transform, parent, attachment_type)
+        extent = _VEHICLE_EXTENTS.get(self.type_id, (2.3, 1.0, 0.75))
+        self.bounding_box = BoundingBox(Location(0.0, 0.0, extent[2]), Vector3D(*extent))
+        self._control = VehicleControl()
+        self._speed = 0.0
+        self._vz = 0.0
+        self._yaw_rate = 0.0
+        self._autopilot = False
+        self._tm = None
+        self._ring_s = None
+
+    @_rpc
+    def apply_control(self, control):
+        self._control = control
+
+    @_rpc
+    def get_control(self):
+        return self._control
+
+    @_rpc
+    def set_autopilot(self, enabled=True, tm_port=8000):
+        self._autopilot = enabled
+        self._tm = self._server.traffic_managers.get(tm_port) if enabled else None
+        self._ring_s = None
+
+    def _velocity(self):
+        yaw = math.radians(self._transform.rotation.yaw)
+        return Vector3D(self._speed * math.cos(yaw), self._speed * math.sin(yaw), self._vz)
+
+    @_rpc
+    def get_angular_velocity(self):
+        return Vector3D(0.0, 0.0, math.degrees(self._yaw_rate))
+
+    @_rpc
+    def set_target_velocity(self, velocity):
+        yaw = math.radians(self._transform.rotation.yaw)
+        self._speed = max(0.0, velocity.x * math.cos(yaw) + velocity.y * math.sin(yaw))
+        self._vz = velocity.z
+
+    @_rpc
+    def set_target_angular_velocity(self, velocity):
+        self._yaw_rate = math.radians(velocity.z)
+
+    @_rpc
+    def set_simulate_physics(self, enabled=True):
+        pass
+
+    @_rpc
+    def set_light_state(self, light_state):
+        pass
+
+    def _tick(self, dt):
+        transform = self._transform
+        if transform.location.z > 0.0 or self._vz > 0.0:
+            self._vz -= GRAVITY * dt
+            transform.location.z = max(0.0, transform.location.z + self._vz * dt)
+            if transform.location.z == 0.0:
+                self._vz = 0.0
+            return # no traction while airborne
+
+        if self._autopilot:
+            self._follow_lane(dt)
+            return
+
+        control = self._control
+        acceleration = MAX_ACCELERATION * control.throttle - MAX_DECELERATION * control.brake
+        if control.hand_brake:
+            acceleration = -MAX_DECELERATION
+        self._speed = min(max(0.0, self._speed + acceleration * dt - 0.01 * self._speed**2 * dt), 70.0)
+
+        self._yaw_rate = self._speed / WHEELBASE * math.tan(max(-1.0, min(1.0, control.steer)) * MAX_STEER_ANGLE)
+        yaw = math.radians(transform.rotation.yaw) + self._yaw_rate * dt
+        transform.rotation.yaw = math.degrees(math.atan2(math.sin(yaw), math.cos(yaw)))
+        transform.location.x += self._speed * math.cos(yaw) * dt
+        transform.location.y += self._speed * math.sin(yaw) * dt
+
+    def _follow_lane(self, dt):
+        ring = self._server.ring
+        if self._ring_s is None:
+            self._ring_s, _ = ring.project(self._transform.location.x, self._transform.location.y)
+        self._speed = self._tm._target_speed(self) if self._tm is not None else 30.0 / 3.6
+        self._ring_s = (self._ring_s + self._speed * dt) % ring.length
+        x, y, yaw = ring.pose(self._ring_s)
+        self._transform.location.x, self._transform.location.y = x, y
+        self._transform.rotation.yaw = math.degrees(yaw)
+
+
+class Image(object):
+
+    def __init__(self, frame, timestamp, transform, width, height, fov, raw_data):
+        self.frame = frame
+        self.frame_number = frame
+        self.timestamp = timestamp
+        self.transform = transform
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.raw_data = raw_data
+
+    def __len__(self):
+        return self.width * self.height
+
+
+class CollisionEvent(object):
+
+    def __init__(self, frame, timestamp, actor, other_actor, normal_impulse):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.actor = actor
+        self.other_actor = other_actor
+        self.normal_impulse = normal_impulse
+
+
+class LaneInvasionEvent(object):
+
+    def __init__(self, frame, timestamp, actor, crossed_lane_markings):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.actor = actor
+        self.crossed_lane_markings = crossed_lane_markings
+
+
+class Sensor(Actor):
+
+    def __init__(self, world, blueprint, transform, parent=None, attachment_type=AttachmentType.Rigid):
+        super().__init__(world, blueprint, transform, parent, attachment_type)
+        self._callback = None
+        self._since_last = float("inf")
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    @_rpc
+    def listen(self, callback):
+        self._callback = callback
+
+    @_rpc
+    def stop(self):
+        self._callback = None
+
+    def _measure(self, frame, timestamp):
+        return None
+
+    def _tick(self, dt):
+        self._since_last += dt
+        sensor_tick = float(self.attributes.get("sensor_tick", "0.0"))
+        if self._since_last < sensor_tick:
+            return
+        self._since_last = 0.0
+        data = self._measure(self._world._frame, self._world._elapsed)
+        if data is not None and self._callback is not None:
+            self._callback(data)
+
+
+class Camera(Sensor):
+    """Produces the same synthetic BGRA frame on every measurement."""
+
+    def __init__(self, world, blueprint, transform, parent=None, attachment_type=AttachmentType.Rigid):
+        super().__init__(world, blueprint, transform, parent, attachment_type)
+        self.width = int(self.attributes["image_size_x"])
+        self.height = int(self.attributes["image_size_y"])
+        self.fov = float(self.attributes["fov"])
+        self._raw_data = memoryview(self._synthetic_frame().tobytes())
+
+    def _synthetic_frame(self):
+        frame = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        horizon = self.height * 2 // 5
+        rows = np.arange(self.height)[:, None]
+        cols = np.arange(self.width)[None, :]
+        road = (rows >= horizon) & (np.abs(cols - self.width / 2) <= (rows - horizon + 1) * 1.2)
+        line = road & (np.abs(cols - self.width / 2) <= 1)
+        if "semantic_segmentation" in self.type_id:
+            tags = np.full((self.height, self.width), 1, dtype=np.uint8) # Building
+            tags[horizon:] = 8 # SideWalk
+            tags[road] = 7 # Road
+            tags[line] = 6 # RoadLine
+            tags[horizon:horizon + max(1, self.height // 20)] = 2 # Fence
+            frame[:, :, 2] = tags
+        else:
+            frame[:, :, 0] = np.where(rows < horizon, 235, 90).astype(np.uint8)
+            frame[:, :, 1] = np.where(rows < horizon, 206, 110).astype(np.uint8)
+            frame[:, :, 2] = np.where(rows < horizon, 135, 60).astype(np.uint8)
+            frame[road] = (70, 70, 70, 255)
+            frame[line] = (255, 255, 255, 255)
+        frame[:, :, 3] = 255
+        return frame
+
+    def _measure(self, frame, timestamp):
+        return Image(frame, timestamp, self._world_transform(), self.width, self.height, self.fov, self._raw_data)
+
+
+class CollisionSensor(Sensor):
+
+    def _measure(self, frame, timestamp):
+        if self.parent is None or not self.parent.is_alive:
+            return None
+        location = self.parent._transform.location
+        for other in self._world._actors.values():
+            if other is self.parent or not isinstance(other, Vehicle):
+                continue
+            reach = self.parent.bounding_box.extent.x + other.bounding_box.extent.x
+            if location.distance(other._transform.location) < 0.8 * reach:
+                impulse = Vector3D(1000.0 * max(self.parent._speed, 1.0), 0.0, 0.0)
+                return CollisionEvent(frame, timestamp, self.parent, other, impulse)
+        return None
+
+
+class LaneInvasionSensor(Sensor):
+
+    def __init__(self, world, blueprint, transform, parent=None, attachment_type=AttachmentType.Rigid):
+        super().__init__(world, blueprint, transform, parent, attachment_type)
+        self._side = None
+
+    def _measure(self, frame, timestamp):
+        if self.parent is None or not self.parent.is_alive:
+            return None
+        location = self.parent._transform.location
+        _, lateral = self._server.ring.project(location.x, location.y)
+        side = int(math.floor((lateral + LANE_WIDTH / 2) / LANE_WIDTH))
+        crossed, self._side = self._side is not None and side != self._side, side
+        if not crossed:
+            return None
+        marking = LaneMarking(LaneMarkingType.Solid, LaneMarkingColor.White)
+        return LaneInvasionEvent(frame, timestamp, self.parent, [marking])
+
+
+class ActorList(list):
+
+    def filter(self, pattern):
+        return ActorList(actor for actor in self if fnmatch.fnmatch(actor.type_id, pattern))
+
+    def find(self, actor_id):
+        for actor in self:
+            if actor.id == actor_id:
+                return actor
+        return None
+
+
+class ActorSnapshot(object):
+
+    def __init__(self, actor):
+        self.id = actor.id
+        self._transform = actor._world_transform()
+        self._velocity = actor._velocity()
+
+    def get_transform(self):
+        return self._transform
+
+    def get_velocity(self):
+        return self._velocity
+
+
+class Timestamp(object):
+
+    def __init__(self, frame, elapsed_seconds, delta_seconds):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = time.time()
+
+
+class WorldSnapshot(object):
+
+    def __init__(self, world):
+        self.id = world.id
+        self.frame = world._frame
+        self.timestamp = Timestamp(world._frame, world._elapsed, world._delta_seconds())
+        self._actors = collections.OrderedDict((actor.id, ActorSnapshot(actor)) for actor in world._actors.values())
+
+    def __iter__(self):
+        return iter(self._actors.values())
+
+    def __len__(self):
+        return len(self._actors)
+
+    def find(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def has_actor(self, actor_id):
+        return actor_id in self._actors
+
+
+# -----------------------------------------------------------------------------
+# World, Traffic Manager and Client.
+# -----------------------------------------------------------------------------
+
+
+class World(object):
+
+    def __init__(self, server, town):
+        self._server = server
+        self.id = next(server.world_ids)
+        self._town = town
+        self._settings = WorldSettings()
+        self._weather = WeatherParameters()
+        self._actors = collections.OrderedDict()
+        self._frame = 0
+        self._elapsed = 0.0
+        self._spectator = Actor(self, None, Transform(Location(0.0, 0.0, 50.0), Rotation(pitch=-90.0)))
+        self._actors[self._spectator.id] = self._spectator
+
+    def _delta_seconds(self):
+        return self._settings.fixed_delta_seconds or DEFAULT_FIXED_DELTA_SECONDS
+
+    @_rpc
+    def get_map(self):
+        return Map(self._server, self._town)
+
+    @_rpc
+    def get_blueprint_library(self):
+        return BlueprintLibrary(_BLUEPRINTS)
+
+    @_rpc
+    def get_spectator(self):
+        return self._spectator
+
+    @_rpc
+    def get_settings(self):
+        return self._settings._copy()
+
+    @_rpc
+    def apply_settings(self, settings):
+        self._settings = settings._copy()
+        return self._frame
+
+    @_rpc
+    def set_weather(self, weather):
+        self._weather = weather
+
+    @_rpc
+    def get_weather(self):
+        return self._weather
+
+    @_rpc
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return ActorList(self._actors.values())
+        return ActorList(self._actors[i] for i in actor_ids if i in self._actors)
+
+    @_rpc
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    @_rpc
+    def get_snapshot(self):
+        return WorldSnapshot(self)
+
+    @_rpc
+    def spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        return self._spawn(blueprint, transform, attach_to, attachment_type)
+
+    @_rpc
+    def try_spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        try:
+            return self._spawn(blueprint, transform, attach_to, attachment_type)
+        except RuntimeError:
+            return None
+
+    @_rpc
+    def tick(self, seconds=10.0):
+        if _LATENCY["tick"] > 0.0:
+            time.sleep(_LATENCY["tick"])
+        dt = self._delta_seconds()
+        self._frame += 1
+        self._elapsed += dt
+        actors = list(self._actors.values())
+        for actor in actors: # physics first, then sensors observe the new state
+            if not isinstance(actor, Sensor):
+                actor._tick(dt)
+        for actor in actors:
+            if isinstance(actor, Sensor) and actor.is_alive:
+                actor._tick(dt)
+        return self._frame
+
+    @_rpc
+    def wait_for_tick(self, seconds=10.0):
+        return WorldSnapshot(self)
+
+    def _spawn(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        if attach_to is not None and not attach_to.is_alive:
+            raise RuntimeError("Spawn failed because parent actor is not alive")
+        if blueprint.id.startswith("vehicle."):
+            extent = _VEHICLE_EXTENTS.get(blueprint.id, (2.3, 1.0, 0.75))[0]
+            for other in self._actors.values():
+                if isinstance(other, Vehicle) and \
+                        other._transform.location.distance(transform.location) < extent + other.bounding_box.extent.x:
+                    raise RuntimeError("Spawn failed because of collision at spawn position")
+            actor = Vehicle(self, blueprint, transform, attach_to, attachment_type)
+        elif blueprint.id.startswith("sensor.camera."):
+            actor = Camera(self, blueprint, transform, attach_to, attachment_type)
+        elif blueprint.id == "sensor.other.collision":
+            actor = CollisionSensor(self, blueprint, transform, attach_to, attachment_type)
+        elif blueprint.id == "sensor.other.lane_invasion":
+            actor = LaneInvasionSensor(self, blueprint, transform, attach_to, attachment_type)
+        else:
+            actor = Actor(self, blueprint, transform, attach_to, attachment_type)
+        self._actors[actor.id] = actor
+        return actor
+
+    def _remove(self, actor):
+        actor._alive = False
+        self._actors.pop(actor.id, None)
+        for child in [a for a in self._actors.values() if a.parent is actor]:
+            self._remove(child)
+
+    def __repr__(self):
+        return "World(id={}, map={})".format(self.id, self._town)
+
+
+class TrafficManager(object):
+
+    def __init__(self, server, port):
+        self._server = server
+        self._port = port
+        self._global_speed_difference = 30.0
+        self._speed_difference = {}
+        self._desired_speed = {}
+        self.settings = {}
+
+    def get_port(self):
+        return self._port
+
+    def _target_speed(self, vehicle):
+        if vehicle.id in self._desired_speed:
+            return self._desired_speed[vehicle.id] / 3.6
+        difference = self._speed_difference.get(vehicle.id, self._global_speed_difference)
+        return 30.0 / 3.6 * (1.0 - difference / 100.0)
+
+    @_rpc
+    def global_percentage_speed_difference(self, percentage):
+        self._global_speed_difference = percentage
+
+    @_rpc
+    def vehicle_percentage_speed_difference(self, actor, percentage):
+        self._speed_difference[actor.id] = percentage
+
+    @_rpc
+    def set_desired_speed(self, actor, speed):
+        self._desired_speed[actor.id] = speed
+
+    def _set(self, name, *args):
+        self._server.calls["TrafficManager." + name] += 1
+        if _LATENCY["rpc"] > 0.0:
+            time.sleep(_LATENCY["rpc"])
+        key = (name, args[0].id) if len(args) > 1 and isinstance(args[0], Actor) else name
+        self.settings[key] = args[-1] if args else None
+
+    def set_synchronous_mode(self, enabled=True):
+        self._set("set_synchronous_mode", enabled)
+
+    def set_global_distance_to_leading_vehicle(self, distance):
+        self._set("set_global_distance_to_leading_vehicle", distance)
+
+    def set_hybrid_physics_mode(self, enabled=False):
+        self._set("set_hybrid_physics_mode", enabled)
+
+    def set_hybrid_physics_radius(self, radius):
+        self._set("set_hybrid_physics_radius", radius)
+
+    def set_random_device_seed(self, seed):
+        self._set("set_random_device_seed", seed)
+
+    def set_respawn_dormant_vehicles(self, enabled=False):
+        self._set("set_respawn_dormant_vehicles", enabled)
+
+    def ignore_lights_percentage(self, actor, percentage):
+        self._set("ignore_lights_percentage", actor, percentage)
+
+    def ignore_signs_percentage(self, actor, percentage):
+        self._set("ignore_signs_percentage", actor, percentage)
+
+    def ignore_vehicles_percentage(self, actor, percentage):
+        self._set("ignore_vehicles_percentage", actor, percentage)
+
+    def auto_lane_change(self, actor, enabled):
+        self._set("auto_lane_change", actor, enabled)
+
+    def distance_to_leading_vehicle(self, actor, distance):
+        self._set("distance_to_leading_vehicle", actor, distance)
+
+    def random_left_lanechange_percentage(self, actor, percentage):
+        self._set("random_left_lanechange_percentage", actor, percentage)
+
+    def random_right_lanechange_percentage(self, actor, percentage):
+        self._set("random_right_lanechange_percentage", actor, percentage)
+
+    def update_vehicle_lights(self, actor, enabled):
+        self._set("update_vehicle_lights", actor, enabled)
+
+
+class _FutureActor(object):
+
+    def __repr__(self):
+        return "FutureActor"
+
+
+class command(object):
+    """Namespace mirroring `carla.command`."""
+
+    FutureActor = _FutureActor()
+
+    class Response(object):
+
+        def __init__(self, actor_id=0, error=""):
+            self.actor_id = actor_id
+            self.error = error
+
+        def has_error(self):
+            return bool(self.error)
+
+    class SpawnActor(object):
+
+        def __init__(self, blueprint, transform, parent=None):
+            self.blueprint = blueprint
+            self.transform = transform
+            self.parent = parent
+            self.chained = []
+
+        def then(self, command):
+            self.chained.append(command)
+            return self
+
+    class SetAutopilot(object):
+
+        def __init__(self, actor, enabled, tm_port=8000):
+            self.actor = actor
+            self.enabled = enabled
+            self.tm_port = tm_port
+
+    class DestroyActor(object):
+
+        def __init__(self, actor):
+            self.actor = actor
+
+    class ApplyTransform(object):
+
+        def __init__(self, actor, transform):
+            self.actor = actor
+            self.transform = transform
+
+    class ApplyTargetVelocity(object):
+
+        def __init__(self, actor, velocity):
+            self.actor = actor
+            self.velocity = velocity
+
+    class ApplyVehicleControl(object):
+
+        def __init__(self, actor, control):
+            self.actor = actor
+            self.control = control
+
+
+class Server(object):
+    """State of one simulated `CARLA` server."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.calls = collections.Counter()
+        self.ring = _Ring()
+        self.actor_ids = itertools.count(1)
+        self.world_ids = itertools.count(1)
+        self.world = World(self, DEFAULT_TOWN)
+        self.traffic_managers = {}
+
+
+_SERVERS = {}
+
+
+def get_server(host="localhost", port=2000):
+    """Returns (creating it if needed) the simulated server at `(host, port)`."""
+    key = ("localhost" if host == "127.0.0.1" else host, port)
+    if key not in _SERVERS:
+        _SERVERS[key] = Server(*key)
+    return _SERVERS[key]
+
+
+def reset_servers():
+    """Forgets every simulated server."""
+    _SERVERS.clear()
+
+
+class Client(object):
+
+    def __init__(self, host="localhost", port=2000, worker_threads=0):
+        self._server = get_server(host, port)
+        self._timeout = 5.0
+
+    @_rpc
+    def set_timeout(self, seconds):
+        self._timeout = seconds
+
+    @_rpc
+    def get_server_version(self):
+        return __version__
+
+    def get_client_version(self):
+        return __version__
+
+    @_rpc
+    def get_available_maps(self):
+        return ["/Game/Carla/Maps/{}".format(town) for town in TOWNS]
+
+    @_rpc
+    def get_world(self):
+        return self._server.world
+
+    @_rpc
+    def load_world(self, map_name, reset_settings=True):
+        return self._load_world(map_name, reset_settings)
+
+    def _load_world(self, map_name, reset_settings):
+        town = map_name.split("/")[-1]
+        if town not in TOWNS:
+            raise RuntimeError("map '{}' not found".format(map_name))
+        if _LATENCY["load_world"] > 0.0:
+            time.sleep(_LATENCY["load_world"])
+        settings = self._server.world._settings
+        self._server.world = World(self._server, town)
+        if not reset_settings:
+            self._server.world._settings = settings
+        return self._server.world
+
+    @_rpc
+    def reload_world(self, reset_settings=True):
+        return self._load_world(self._server.world._town, reset_settings)
+
+    @_rpc
+    def get_trafficmanager(self, port=8000):
+        if port not in self._server.traffic_managers:
+            self._server.traffic_managers[port] = TrafficManager(self._server, port)
+        return self._server.traffic_managers[port]
+
+    @_rpc
+    def apply_batch(self, commands, do_tick=False):
+        self._apply_batch(commands, do_tick)
+
+    @_rpc
+    def apply_batch_sync(self, commands, do_tick=False):
+        return self._apply_batch(commands, do_tick)
+
+    def _apply_batch(self, commands, do_tick):
+        world = self._server.world
+        responses = []
+        for cmd in commands:
+            try:
+                actor_id = self._execute(world, cmd, None)
+                responses.append(command.Response(actor_id))
+            except RuntimeError as error:
+                responses.append(command.Response(0, str(error)))
+        if do_tick:
+            world.tick()
+        return responses
+
+    def _execute(self, world, cmd, future_id):
+        def resolve(actor):
+            if actor is command.FutureActor:
+                actor = future_id
+            if isinstance(actor, Actor):
+                return actor
+            found = world._actors.get(actor)
+            if found is None:
+                raise RuntimeError("actor {} not found".format(actor))
+            return found
+
+        if isinstance(cmd, command.SpawnActor):
+            parent = resolve(cmd.parent) if cmd.parent is not None else None
+            actor = world._spawn(cmd.blueprint, cmd.transform, parent)
+            for chained in cmd.chained:
+                self._execute(world, chained, actor.id)
+            return actor.id
+        actor = resolve(cmd.actor)
+        if isinstance(cmd, command.SetAutopilot):
+            actor.set_autopilot(cmd.enabled, cmd.tm_port)
+        elif isinstance(cmd, command.DestroyActor):
+            actor.destroy()
+        elif isinstance(cmd, command.ApplyTransform):
+            actor.set_transform(cmd.transform)
+        elif isinstance(cmd, command.ApplyTargetVelocity):
+            actor.set_target_velocity(cmd.velocity)
+        elif isinstance(cmd, command.ApplyVehicleControl):
+            actor.apply_control(cmd.control)
+        else:
+            raise RuntimeError("unsupported command {}".format(type(cmd).__name__))
+        return actor.id
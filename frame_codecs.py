@@ -0,0 +1,126 @@
+import io
+import zlib
+from typing import Tuple
+
+import numpy as np
+
+CODECS = ("zlib", "png", "jpeg")
+
+
+class FrameCodec(object):
+    """Compresses `uint8` image observations of a fixed shape to bytes and back.
+
+    Frames may be channel-last `(height, width, channels)` or, as SB3's
+    `VecTransposeImage` hands them to the replay buffer, channel-first
+    `(channels, height, width)`. `decode` writes into a caller-provided
+    array so that a minibatch is decoded in place, row by row.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], channels_first: bool = False):
+        self.shape = tuple(shape)
+        self.channels_first = channels_first
+
+    def encode(self, frame: np.ndarray) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes, out: np.ndarray) -> None:
+        raise NotImplementedError
+
+
+class ZlibCodec(FrameCodec):
+    """Lossless DEFLATE of the raw bytes, fast and very effective on semantic masks."""
+
+    def __init__(self, shape, channels_first=False, level: int = 1):
+        super().__init__(shape, channels_first)
+        self.level = level
+
+    def encode(self, frame):
+        return zlib.compress(np.ascontiguousarray(frame, dtype=np.uint8).tobytes(), self.level)
+
+    def decode(self, data, out):
+        out[...] = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(self.shape)
+
+
+class _PillowCodec(FrameCodec):
+    # Pillow works on channel-last images with 1 (L) or 3 (RGB) channels
+
+    format = None
+
+    def __init__(self, shape, channels_first=False):
+        super().__init__(shape, channels_first)
+        try:
+            import PIL.Image # noqa: F401
+        except ImportError as e:
+            raise ImportError("The {} codec needs Pillow, `pip install pillow`".format(self.format)) from e
+        channels = self.shape[0] if channels_first else self.shape[-1]
+        if len(self.shape) != 3 or channels not in (1, 3):
+            raise ValueError("The {} codec needs 1 or 3 channel images, got shape {}".format(self.format, shape))
+
+    def _save_kwargs(self):
+        return {}
+
+    def encode(self, frame):
+        from PIL import Image
+        if self.channels_first:
+            frame = frame.transpose(1, 2, 0)
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape[-1] == 1:
+            frame = frame[:, :, 0]
+        data = io.BytesIO()
+        Image.fromarray(frame).save(data, format=self.format, **self._save_kwargs())
+        return data.getvalue()
+
+    def decode(self, data, out):
+        from PIL import Image
+        image = np.asarray(Image.open(io.BytesIO(data)))
+        if image.ndim == 2:
+            image = image[:, :, None]
+        out[...] = image.transpose(2, 0, 1) if self.channels_first else image
+
+
+class PngCodec(_PillowCodec):
+    """Lossless PNG, smaller than zlib on camera images thanks to its row filters."""
+
+    format = "PNG"
+
+    def __init__(self, shape, channels_first=False, level: int = 1):
+        super().__init__(shape, channels_first)
+        self.level = level
+
+    def _save_kwargs(self):
+        return {"compress_level": self.level}
+
+
+class JpegCodec(_PillowCodec):
+    """Lossy JPEG for RGB frames. Never use it on semantic masks, whose values are labels."""
+
+    format = "JPEG"
+
+    def __init__(self, shape, channels_first=False, quality: int = 90):
+        super().__init__(shape, channels_first)
+        self.quality = quality
+
+    def _save_kwargs(self):
+        return {"quality": self.quality}
+
+
+def make_codec(name: str, shape: Tuple[int, ...], channels_first: bool = False, quality: int = 90,
+               dtype=np.uint8) -> FrameCodec:
+    """Returns the codec `name` (one of `CODECS`) for frames of `shape`.
+
+    Args:
+        name: 'zlib' or 'png' (lossless) or 'jpeg' (lossy, RGB only).
+        shape: The shape of the frames.
+        channels_first: Whether the frames are `(channels, height, width)`.
+        quality: The JPEG quality, from 1 to 95.
+        dtype: The dtype of the frames, every codec only takes `uint8` ones.
+    """
+    if np.dtype(dtype) != np.uint8:
+        raise ValueError("Frame codecs only take uint8 frames, got {}".format(np.dtype(dtype)))
+    if name == "zlib":
+        return ZlibCodec(shape, channels_first)
+    if name == "png":
+        return PngCodec(shape, channels_first)
+    if name == "jpeg":
+        return JpegCodec(shape, channels_first, quality=quality)
+    raise ValueError("Unknown codec {}, expected one of {}".format(name, CODECS))
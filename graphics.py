@@ -1,14 +1,5 @@
-import glob
-import os
-import tempfile
-import carla
-import imageio
-import matplotlib.pyplot as plt
-import numpy as np
 import pygame
-import tqdm
 from absl import logging
-from skimage import transform
 
 def setup(
     width: int = 400,
@@ -0,0 +1,268 @@
+import glob
+import hashlib
+import math
+import os
+import tempfile
+from typing import NamedTuple
+
+import carla
+import numpy as np
+from absl import logging
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "lane_geometry")
+
+
+class LaneOffset(NamedTuple):
+    """Position of a point relative to its nearest lane, see `LaneGeometry.lane_offset`."""
+    index: int #nearest centerline sample, -1 if no lane is within max_distance
+    lateral_offset: float #signed distance (in meters) to the centerline, positive to its right
+    distance_to_left: float #distance (in meters) to the left lane boundary, negative once crossed
+    distance_to_right: float #distance (in meters) to the right lane boundary, negative once crossed
+    is_junction: bool
+
+
+class LaneGeometry(object):
+    """Driving lanes of a town sampled into NumPy arrays, with a raster index for O(1) lookups.
+
+    `build` samples every driving lane with `carla_map.generate_waypoints`
+    once and keeps, per sample: centerline `x`, `y`, `yaw` (radians), the
+    left and right boundary points, `lane_width`, `road_id`, `section_id`,
+    `lane_id`, `s` and `is_junction`. Samples are sorted by lane and by `s`,
+    `lane_starts` delimits the lanes, so `x[lane_starts[k]:lane_starts[k + 1]]`
+    is the centerline of lane `k`.
+
+    The index is a raster of `cell_size` cells covering the town, each
+    holding the sample closest to its center (or -1 when no lane is within
+    `max_distance`), so a nearest-lane query is one array read; the answer
+    is off by at most half a cell diagonal plus half the sample spacing.
+
+    The scalar queries cost a cell read plus the Python call: `nearest`
+    stays around 0.3-1 us, but `lane_offset` builds a `LaneOffset` and takes
+    1-4 us depending on the machine (`benchmarks/bench_lane_geometry.py`),
+    still far below the tens of microseconds of a `get_waypoint` RPC. The
+    `*_many` forms answer a whole batch of points (e.g. every vehicle of a
+    step) in a few array operations, well under a microsecond per point.
+
+    Sampling a town takes seconds of map queries, so `load_or_build` saves
+    the arrays under the SHA1 of the OpenDRIVE of the map, as
+    `no_rendering_mode.MapImage` does for its rendered map, and later runs
+    just load them.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, arrays):
+        """Wraps the arrays produced by `build` or stored by `save`."""
+        self.arrays = dict(arrays)
+        for name, array in self.arrays.items():
+            setattr(self, name, array)
+        self.spacing, self.cell_size, self.max_distance = (float(v) for v in self.params)
+        self._origin_x, self._origin_y = (float(v) for v in self.origin)
+        self._inverse_cell_size = 1.0 / self.cell_size
+        self._num_cells_x, self._num_cells_y = self.grid.shape
+        # A flat memoryview and Python lists for the scalar queries, indexing them is several times faster than
+        # indexing arrays
+        self._cells = memoryview(np.ascontiguousarray(self.grid).reshape(-1))
+        self._x, self._y = self.x.tolist(), self.y.tolist()
+        self._sin, self._cos = np.sin(self.yaw).tolist(), np.cos(self.yaw).tolist()
+        self._half_width = (0.5 * self.lane_width).tolist()
+        self._is_junction = self.is_junction.tolist()
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def build(cls, carla_map, spacing: float = 1.0, cell_size: float = 0.5, max_distance: float = 8.0,
+              _opendrive_hash: str = "") -> "LaneGeometry":
+        """Samples the driving lanes of `carla_map` and rasterizes the nearest-sample index.
+
+        Args:
+            carla_map: The `CARLA` map.
+            spacing: The distance (in meters) between two samples of a lane.
+            cell_size: The side (in meters) of a raster cell.
+            max_distance: The distance (in meters) beyond which no lane is reported.
+        """
+        waypoints = [wp for wp in carla_map.generate_waypoints(spacing) if wp.lane_type == carla.LaneType.Driving]
+        assert waypoints, "the map has no driving lanes"
+        columns = {name: [] for name in ("x", "y", "yaw", "lane_width", "road_id", "section_id", "lane_id", "s",
+                                          "is_junction")}
+        for wp in waypoints:
+            transform = wp.transform
+            columns["x"].append(transform.location.x)
+            columns["y"].append(transform.location.y)
+            columns["yaw"].append(math.radians(transform.rotation.yaw))
+            columns["lane_width"].append(wp.lane_width)
+            columns["road_id"].append(wp.road_id)
+            columns["section_id"].append(wp.section_id)
+            columns["lane_id"].append(wp.lane_id)
+            columns["s"].append(wp.s)
+            columns["is_junction"].append(wp.is_junction)
+        arrays = {name: np.array(values, dtype=np.int32 if name.endswith("_id") else None)
+                  for name, values in columns.items()}
+        arrays["is_junction"] = arrays["is_junction"].astype(bool)
+
+        order = np.lexsort((arrays["s"], arrays["lane_id"], arrays["section_id"], arrays["road_id"]))
+        arrays = {name: array[order] for name, array in arrays.items()}
+        keys = np.stack((arrays["road_id"], arrays["section_id"], arrays["lane_id"]), axis=1)
+        changes = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+        arrays["lane_starts"] = np.concatenate(([0], changes, [len(order)])).astype(np.int64)
+
+        # The right of the driving direction is +y rotated by yaw, CARLA being left-handed
+        right_x, right_y = -np.sin(arrays["yaw"]), np.cos(arrays["yaw"])
+        half_width = 0.5 * arrays["lane_width"]
+        arrays["left_x"] = arrays["x"] - half_width * right_x
+        arrays["left_y"] = arrays["y"] - half_width * right_y
+        arrays["right_x"] = arrays["x"] + half_width * right_x
+        arrays["right_y"] = arrays["y"] + half_width * right_y
+
+        arrays["origin"], arrays["grid"] = cls._rasterize(arrays["x"], arrays["y"], cell_size, max_distance)
+        arrays["params"] = np.array([spacing, cell_size, max_distance])
+        arrays["version"] = np.array(cls.FORMAT_VERSION)
+        arrays["opendrive_hash"] = np.array(_opendrive_hash)
+        logging.info("Sampled {} lanes into {} points, {}x{} index cells".format(
+            len(arrays["lane_starts"]) - 1, len(order), *arrays["grid"].shape))
+        return cls(arrays)
+
+    @staticmethod
+    def _rasterize(x, y, cell_size, max_distance):
+        # Samples are binned in buckets of max_distance, so the 3x3 buckets around a cell contain every sample
+        # within max_distance of it and each bucket is solved with one small distance matrix
+        origin = np.array([x.min() - max_distance, y.min() - max_distance])
+        cells_per_bucket = max(int(math.ceil(max_distance / cell_size)), 1)
+        bucket_size = cells_per_bucket * cell_size
+        num_bx = int((x.max() + max_distance - origin[0]) // bucket_size) + 1
+        num_by = int((y.max() + max_distance - origin[1]) // bucket_size) + 1
+        grid = np.full((num_bx * cells_per_bucket, num_by * cells_per_bucket), -1, dtype=np.int32)
+
+        bx = ((x - origin[0]) // bucket_size).astype(np.int64)
+        by = ((y - origin[1]) // bucket_size).astype(np.int64)
+        bucket = bx * num_by + by
+        order = np.argsort(bucket, kind="stable")
+        starts = np.searchsorted(bucket[order], np.arange(num_bx * num_by + 1))
+
+        # Only buckets next to an occupied one can have cells within max_distance of a sample
+        occupied = np.zeros((num_bx + 2, num_by + 2), dtype=bool)
+        occupied[bx + 1, by + 1] = True
+        near = np.zeros((num_bx, num_by), dtype=bool)
+        for di in range(3):
+            for dj in range(3):
+                near |= occupied[di:di + num_bx, dj:dj + num_by]
+
+        offsets = (np.arange(cells_per_bucket) + 0.5) * cell_size
+        for i, j in zip(*np.nonzero(near)):
+            low, high = max(j - 1, 0), min(j + 2, num_by)
+            candidates = np.concatenate([order[starts[r * num_by + low]:starts[r * num_by + high]]
+                                         for r in range(max(i - 1, 0), min(i + 2, num_bx))])
+            cx = origin[0] + i * bucket_size + offsets
+            cy = origin[1] + j * bucket_size + offsets
+            dist2 = (cx[:, None, None] - x[candidates]) ** 2 + (cy[None, :, None] - y[candidates]) ** 2
+            nearest = np.argmin(dist2, axis=2)
+            within = np.take_along_axis(dist2, nearest[:, :, None], axis=2)[:, :, 0] <= max_distance ** 2
+            grid[i * cells_per_bucket:(i + 1) * cells_per_bucket, j * cells_per_bucket:(j + 1) * cells_per_bucket] = \
+                np.where(within, candidates[nearest], -1)
+        return origin, grid
+
+    def save(self, path: str) -> None:
+        """Writes the arrays to the `.npz` file `path`."""
+        np.savez(path, **self.arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "LaneGeometry":
+        """Reads arrays written by `save`."""
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    @classmethod
+    def load_or_build(cls, carla_map, cache_dir: str = DEFAULT_CACHE_DIR, spacing: float = 1.0,
+                      cell_size: float = 0.5, max_distance: float = 8.0) -> "LaneGeometry":
+        """Returns the cached geometry of `carla_map`, building and caching it if needed.
+
+        The cache file is named after the town and the SHA1 of its OpenDRIVE,
+        so an edited map is sampled again; files of older versions of the
+        same town are removed. A cached file built with other parameters is
+        rebuilt. The file is written under a temporary name and renamed into
+        place, so envs starting together never read a partial file.
+        """
+        hash_func = hashlib.sha1()
+        hash_func.update(carla_map.to_opendrive().encode("UTF-8"))
+        opendrive_hash = str(hash_func.hexdigest())
+        town = carla_map.name.split('/')[-1]
+        path = os.path.join(cache_dir, "{}_{}.npz".format(town, opendrive_hash))
+
+        if os.path.isfile(path):
+            geometry = cls.load(path)
+            if int(geometry.version) == cls.FORMAT_VERSION and \
+                    np.allclose(geometry.params, [spacing, cell_size, max_distance]):
+                return geometry
+            logging.info("Lane geometry cache {} was built with other parameters, rebuilding it".format(path))
+
+        geometry = cls.build(carla_map, spacing, cell_size, max_distance, _opendrive_hash=opendrive_hash)
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=town + ".", suffix=".tmp", delete=False) as f:
+            try:
+                np.savez(f, **geometry.arrays)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+        for town_filename in glob.glob(os.path.join(cache_dir, town + "_*.npz")):
+            if town_filename != path: #older OpenDRIVE versions of the town
+                try:
+                    os.remove(town_filename)
+                except OSError: #already removed by another env
+                    pass
+        return geometry
+
+    def nearest(self, x: float, y: float) -> int:
+        """Returns the index of the centerline sample closest to `(x, y)`, -1 if none is within `max_distance`."""
+        i = math.floor((x - self._origin_x) * self._inverse_cell_size)
+        j = math.floor((y - self._origin_y) * self._inverse_cell_size)
+        if 0 <= i < self._num_cells_x and 0 <= j < self._num_cells_y:
+            return self._cells[i * self._num_cells_y + j]
+        return -1
+
+    def nearest_many(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Vectorized `nearest` over arrays of coordinates."""
+        i = np.floor((np.asarray(x) - self._origin_x) / self.cell_size).astype(np.int64)
+        j = np.floor((np.asarray(y) - self._origin_y) / self.cell_size).astype(np.int64)
+        inside = (i >= 0) & (i < self.grid.shape[0]) & (j >= 0) & (j < self.grid.shape[1])
+        nearest = np.full(i.shape, -1, dtype=np.int64)
+        nearest[inside] = self.grid[i[inside], j[inside]]
+        return nearest
+
+    def lane_offset(self, x: float, y: float) -> LaneOffset:
+        """Returns the lateral offset of `(x, y)` to its nearest lane and the distances to the lane boundaries.
+
+        The offset is measured across the tangent of the nearest sample. Off
+        the road (no lane within `max_distance`) the distances are infinite.
+        """
+        # nearest, inlined: it is called on every step
+        i = math.floor((x - self._origin_x) * self._inverse_cell_size)
+        j = math.floor((y - self._origin_y) * self._inverse_cell_size)
+        k = self._cells[i * self._num_cells_y + j] if 0 <= i < self._num_cells_x and 0 <= j < self._num_cells_y else -1
+        if k < 0:
+            return LaneOffset(-1, math.inf, -math.inf, -math.inf, False)
+        lateral = -(x - self._x[k]) * self._sin[k] + (y - self._y[k]) * self._cos[k]
+        half_width = self._half_width[k]
+        return LaneOffset(k, lateral, half_width + lateral, half_width - lateral, self._is_junction[k])
+
+    def lane_offset_many(self, x: np.ndarray, y: np.ndarray) -> LaneOffset:
+        """Vectorized `lane_offset` over arrays of coordinates, returns a `LaneOffset` of arrays."""
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        k = self.nearest_many(x, y)
+        on_road = k >= 0
+        safe = np.where(on_road, k, 0)
+        lateral = -(x - self.x[safe]) * np.sin(self.yaw[safe]) + (y - self.y[safe]) * np.cos(self.yaw[safe])
+        half_width = 0.5 * self.lane_width[safe]
+        return LaneOffset(k, np.where(on_road, lateral, np.inf), np.where(on_road, half_width + lateral, -np.inf),
+                          np.where(on_road, half_width - lateral, -np.inf), on_road & self.is_junction[safe])
+
+    def in_junction(self, x: float, y: float) -> bool:
+        """Returns whether the lane closest to `(x, y)` is part of a junction."""
+        k = self.nearest(x, y)
+        return k >= 0 and self._is_junction[k]
+
+    def lane_of(self, k: int):
+        """Returns the `(road_id, section_id, lane_id)` of sample `k`."""
+        return int(self.road_id[k]), int(self.section_id[k]), int(self.lane_id[k])
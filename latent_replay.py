@@ -0,0 +1,154 @@
+from typing import Union
+
+import gym
+import numpy as np
+import torch as th
+from absl import logging
+from torch import nn
+from torch.nn import functional as F
+from stable_baselines3.common.torch_layers import NatureCNN
+from stable_baselines3.common.vec_env import DummyVecEnv, VecEnv, VecEnvWrapper
+
+# Resolution divisor of the pretraining reconstruction target
+_TARGET_POOLING = 4
+
+
+def _image_space(observation_space: gym.spaces.Box) -> gym.spaces.Box:
+    # NatureCNN expects the channel-first images SB3 produces with VecTransposeImage
+    height, width, channels = observation_space.shape
+    return gym.spaces.Box(low=0, high=255, shape=(channels, height, width), dtype=np.uint8)
+
+
+def make_encoder(observation_space: gym.spaces.Box, features_dim: int = 256) -> NatureCNN:
+    """Returns an untrained encoder of `CarlaEnv` (height, width, channels) `uint8` observations.
+
+    The architecture is the `NatureCNN` of SB3's `CnnPolicy`, so the
+    features extractor of a trained SAC model can be used instead.
+    """
+    return NatureCNN(_image_space(observation_space), features_dim=features_dim)
+
+
+def encode(encoder: nn.Module, obs: np.ndarray) -> np.ndarray:
+    """Returns the float16 features of a batch of (height, width, channels) `uint8` observations."""
+    device = next(encoder.parameters()).device
+    images = th.as_tensor(np.asarray(obs), device=device).permute(0, 3, 1, 2).float() / 255.0
+    with th.no_grad():
+        return encoder(images).cpu().numpy().astype(np.float16)
+
+
+def _as_vec_env(env: Union[gym.Env, VecEnv]) -> VecEnv:
+    if isinstance(env, VecEnv):
+        return env
+    return DummyVecEnv([lambda: env])
+
+
+def collect_frames(env: Union[gym.Env, VecEnv], num_frames: int) -> np.ndarray:
+    """Returns `num_frames` observations of `env` (a `CarlaEnv` or a `VecEnv`) driven by random actions."""
+    env = _as_vec_env(env)
+    frames = []
+    obs = env.reset()
+    while len(frames) * env.num_envs < num_frames:
+        frames.append(obs.copy())
+        obs, _, _, _ = env.step(np.stack([env.action_space.sample() for _ in range(env.num_envs)]))
+    return np.concatenate(frames)[:num_frames]
+
+
+def pretrain_encoder(encoder: NatureCNN, frames: np.ndarray, epochs: int = 10, batch_size: int = 64,
+                     learning_rate: float = 1e-3, device: Union[th.device, str] = "cpu") -> NatureCNN:
+    """Trains `encoder` as the front of an autoencoder on `frames` and returns it frozen.
+
+    A linear decoder reconstructs every frame at 1/4 resolution from its
+    features, which is enough to make them capture the road layout while
+    keeping pretraining a few minutes of CPU time.
+
+    Args:
+        encoder: The encoder, e.g. from `make_encoder`.
+        frames: (num_frames, height, width, channels) `uint8` observations, e.g. from `collect_frames`.
+        epochs: The number of passes over `frames`.
+        batch_size: The number of frames per gradient step.
+        learning_rate: The Adam learning rate.
+        device: The PyTorch device to train on.
+    """
+    encoder = encoder.to(device).train()
+    target_shape = (frames.shape[3], frames.shape[1] // _TARGET_POOLING, frames.shape[2] // _TARGET_POOLING)
+    decoder = nn.Linear(encoder.features_dim, int(np.prod(target_shape))).to(device)
+    optimizer = th.optim.Adam(list(encoder.parameters()) + list(decoder.parameters()), lr=learning_rate)
+
+    for epoch in range(epochs):
+        losses = []
+        for batch in np.array_split(np.random.permutation(len(frames)), max(len(frames) // batch_size, 1)):
+            images = th.as_tensor(frames[batch], device=device).permute(0, 3, 1, 2).float() / 255.0
+            target = F.avg_pool2d(images, _TARGET_POOLING)[:, :, :target_shape[1], :target_shape[2]]
+            loss = F.mse_loss(decoder(encoder(images)).view(-1, *target_shape), target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        logging.info("Encoder pretraining epoch {}: reconstruction loss {:.5f}".format(epoch, np.mean(losses)))
+    return freeze(encoder)
+
+
+def freeze(encoder: nn.Module) -> nn.Module:
+    """Puts `encoder` in eval mode without gradients and returns it."""
+    encoder.eval()
+    for parameter in encoder.parameters():
+        parameter.requires_grad_(False)
+    return encoder
+
+
+def save_encoder(encoder: NatureCNN, path: str) -> None:
+    """Saves `encoder` and the observation space it takes, for `load_encoder`."""
+    th.save({"image_shape": tuple(encoder._observation_space.shape), "features_dim": encoder.features_dim,
+             "state_dict": encoder.state_dict()}, path)
+
+
+def load_encoder(path: str, device: Union[th.device, str] = "cpu") -> NatureCNN:
+    """Returns the frozen encoder saved at `path`.
+
+    Args:
+        path: A file written by `save_encoder`, or a SAC model `.zip` trained with `CnnPolicy`, whose actor
+            features extractor is taken.
+        device: The PyTorch device to load the encoder on.
+    """
+    if path.endswith(".zip"):
+        from stable_baselines3 import SAC
+        return freeze(SAC.load(path, device=device).actor.features_extractor)
+    saved = th.load(path, map_location=device)
+    image_space = gym.spaces.Box(low=0, high=255, shape=saved["image_shape"], dtype=np.uint8)
+    encoder = NatureCNN(image_space, features_dim=saved["features_dim"])
+    encoder.load_state_dict(saved["state_dict"])
+    return freeze(encoder.to(device))
+
+
+class VecLatentObservation(VecEnvWrapper):
+    """Replaces the image observations of a `VecEnv` by float16 features of a frozen encoder.
+
+    The observation space becomes a `(features_dim,)` float16 `Box`, so SAC
+    with an `MlpPolicy` trains its heads on the features and SB3's replay
+    buffer stores 2 bytes per feature (512 bytes per observation with 256
+    features instead of 57.6 kB for a 160x120x3 frame), and no gradient step
+    runs a CNN. Observations are encoded once per env step, in a batch over
+    the envs; the terminal observations of auto-resets are encoded as well.
+    """
+
+    def __init__(self, venv: VecEnv, encoder: NatureCNN):
+        features_space = gym.spaces.Box(low=-np.inf, high=np.inf, shape=(encoder.features_dim,), dtype=np.float16)
+        super().__init__(venv, observation_space=features_space)
+        self.encoder = freeze(encoder)
+
+    def reset(self) -> np.ndarray:
+        return encode(self.encoder, self.venv.reset())
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        terminal = [i for i, info in enumerate(infos) if "terminal_observation" in info]
+        if terminal:
+            features = encode(self.encoder, np.stack([infos[i]["terminal_observation"] for i in terminal]))
+            for i, feature in zip(terminal, features):
+                infos[i]["terminal_observation"] = feature
+        return encode(self.encoder, obs), rewards, dones, infos
+
+
+def make_latent_env(env: Union[gym.Env, VecEnv], encoder: NatureCNN) -> VecLatentObservation:
+    """Wraps a `CarlaEnv` or a `VecEnv` of them in `VecLatentObservation`."""
+    return VecLatentObservation(_as_vec_env(env), encoder)
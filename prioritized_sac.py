@@ -0,0 +1,107 @@
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from stable_baselines3 import SAC
+from stable_baselines3.common.utils import polyak_update
+
+from replay_buffers import PrioritizedReplayBuffer
+
+
+class PrioritizedSAC(SAC):
+    """SAC trained from a `PrioritizedReplayBuffer`.
+
+    The critic loss of every sampled transition is scaled by its importance
+    sampling weight, and the absolute TD errors (averaged over the critics)
+    are fed back as the new priorities of the sampled transitions. Takes the
+    arguments of `SAC`; `replay_buffer_class` defaults to
+    `PrioritizedReplayBuffer` and `replay_buffer_kwargs` may set its `alpha`,
+    `beta`, `beta_steps` and `epsilon`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get("replay_buffer_class") is None:
+            kwargs["replay_buffer_class"] = PrioritizedReplayBuffer
+        super().__init__(*args, **kwargs)
+
+    def train(self, gradient_steps: int, batch_size: int = 64) -> None:
+        # SAC.train with a weighted critic loss and priority updates, see stable_baselines3/sac/sac.py
+        self.policy.set_training_mode(True)
+        optimizers = [self.actor.optimizer, self.critic.optimizer]
+        if self.ent_coef_optimizer is not None:
+            optimizers += [self.ent_coef_optimizer]
+        self._update_learning_rate(optimizers)
+
+        ent_coef_losses, ent_coefs = [], []
+        actor_losses, critic_losses, td_errors_mean = [], [], []
+
+        for gradient_step in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+
+            if self.use_sde:
+                self.actor.reset_noise()
+
+            actions_pi, log_prob = self.actor.action_log_prob(replay_data.observations)
+            log_prob = log_prob.reshape(-1, 1)
+
+            ent_coef_loss = None
+            if self.ent_coef_optimizer is not None and self.log_ent_coef is not None:
+                ent_coef = th.exp(self.log_ent_coef.detach())
+                ent_coef_loss = -(self.log_ent_coef * (log_prob + self.target_entropy).detach()).mean()
+                ent_coef_losses.append(ent_coef_loss.item())
+            else:
+                ent_coef = self.ent_coef_tensor
+            ent_coefs.append(ent_coef.item())
+
+            if ent_coef_loss is not None and self.ent_coef_optimizer is not None:
+                self.ent_coef_optimizer.zero_grad()
+                ent_coef_loss.backward()
+                self.ent_coef_optimizer.step()
+
+            with th.no_grad():
+                next_actions, next_log_prob = self.actor.action_log_prob(replay_data.next_observations)
+                next_q_values = th.cat(self.critic_target(replay_data.next_observations, next_actions), dim=1)
+                next_q_values, _ = th.min(next_q_values, dim=1, keepdim=True)
+                next_q_values = next_q_values - ent_coef * next_log_prob.reshape(-1, 1)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            current_q_values = self.critic(replay_data.observations, replay_data.actions)
+
+            # Importance sampling weights correct the bias of the prioritized sampling
+            critic_loss = 0.5 * sum(
+                (replay_data.weights * F.mse_loss(current_q, target_q_values, reduction="none")).mean()
+                for current_q in current_q_values)
+            critic_losses.append(critic_loss.item())
+
+            with th.no_grad():
+                td_errors = th.stack([current_q - target_q_values for current_q in current_q_values]).abs().mean(dim=0)
+            td_errors = td_errors.cpu().numpy().reshape(-1)
+            self.replay_buffer.update_priorities(replay_data.indices, td_errors)
+            td_errors_mean.append(td_errors.mean())
+
+            self.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            self.critic.optimizer.step()
+
+            q_values_pi = th.cat(self.critic(replay_data.observations, actions_pi), dim=1)
+            min_qf_pi, _ = th.min(q_values_pi, dim=1, keepdim=True)
+            actor_loss = (ent_coef * log_prob - min_qf_pi).mean()
+            actor_losses.append(actor_loss.item())
+
+            self.actor.optimizer.zero_grad()
+            actor_loss.backward()
+            self.actor.optimizer.step()
+
+            if gradient_step % self.target_update_interval == 0:
+                polyak_update(self.critic.parameters(), self.critic_target.parameters(), self.tau)
+                polyak_update(self.batch_norm_stats, self.batch_norm_stats_target, 1.0)
+
+        self._n_updates += gradient_steps
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/ent_coef", np.mean(ent_coefs))
+        self.logger.record("train/actor_loss", np.mean(actor_losses))
+        self.logger.record("train/critic_loss", np.mean(critic_losses))
+        self.logger.record("train/td_error", np.mean(td_errors_mean))
+        self.logger.record("train/per_beta", self.replay_buffer.beta)
+        if len(ent_coef_losses) > 0:
+            self.logger.record("train/ent_coef_loss", np.mean(ent_coef_losses))
@@ -0,0 +1,63 @@
+"""Vectorized pure-pursuit lateral controller.
+
+Every function works on a batch of `N` vehicles: positions are `(N, 2)`,
+yaws and speeds `(N,)` and waypoints `(N, M, 2)` (or `(M, 2)` when all
+vehicles follow the same path).
+"""
+
+import numpy as np
+
+WHEELBASE = 2.875 # Wheelbase of the vehicle (distance between the front and rear axles)
+KDD = 4.0 # Look-ahead distance gain factor
+TARGET_OFFSET = 4 # Number of waypoints the target is placed past the closest one
+
+
+def target_waypoint_index(positions, waypoints, offset=TARGET_OFFSET):
+    """Returns the target waypoint index, target `(x, y)` and distances of every vehicle.
+
+    Args:
+        positions: The `(N, 2)` vehicle positions.
+        waypoints: The `(N, M, 2)` or `(M, 2)` waypoints.
+        offset: The number of waypoints the target is placed past the closest one.
+
+    Returns:
+        idx: The `(N,)` target indices, clamped to the last waypoint.
+        targets: The `(N, 2)` target positions.
+        dist: The `(N, M)` Euclidean distances from each vehicle to each waypoint.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    waypoints = np.asarray(waypoints, dtype=np.float64)
+    if waypoints.ndim == 2:
+        waypoints = np.broadcast_to(waypoints, (positions.shape[0],) + waypoints.shape)
+
+    delta = waypoints - positions[:, None, :]
+    dist = np.hypot(delta[..., 0], delta[..., 1])
+    idx = np.minimum(np.argmin(dist, axis=1) + offset, waypoints.shape[1] - 1)
+    targets = waypoints[np.arange(waypoints.shape[0]), idx]
+    return idx, targets, dist
+
+
+def lookahead_distance(speeds, kdd=KDD, min_speed=0.1, max_speed=2.5):
+    """Returns the look-ahead distance of every vehicle from its (clipped) forward speed."""
+    return kdd * np.clip(speeds, min_speed, max_speed)
+
+
+def steering_angle(positions, yaws, targets, lookahead, wheelbase=WHEELBASE, max_steer=1.0, previous=0.0):
+    """Returns the `(N,)` pure-pursuit steering commands.
+
+    Args:
+        positions: The `(N, 2)` vehicle positions.
+        yaws: The `(N,)` vehicle headings (in radians).
+        targets: The `(N, 2)` target waypoints.
+        lookahead: The `(N,)` (or scalar) look-ahead distances.
+        wheelbase: The wheelbase (in meters) of the vehicles.
+        max_steer: The steering command is clipped to `[-max_steer, max_steer]`.
+        previous: The command(s) used where the new one is not finite.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+    alpha = np.arctan2(targets[:, 1] - positions[:, 1], targets[:, 0] - positions[:, 0]) - yaws
+    delta = np.arctan2(2.0 * wheelbase * np.sin(alpha), lookahead)
+    delta = np.clip(delta, -max_steer, max_steer)
+    return np.where(np.isnan(delta), previous, delta)
+
@@ -0,0 +1,433 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import torch as th
+from gym import spaces
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+from stable_baselines3.common.preprocessing import is_image_space_channels_first
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+from frame_codecs import make_codec
+from sum_tree import SumTree
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """Replay buffer keeping image observations once, in a disk-backed ring.
+
+    Observations are stored in their own dtype (uint8 for camera images) in
+    a `np.memmap` of shape `(buffer_size, n_envs, *obs_shape)`, so a buffer
+    of 500k 160x120x3 frames takes ~29 GB of disk and only the pages in use
+    of RAM. The next observation of a transition is the observation stored
+    at the following index, as in SB3's `optimize_memory_usage`. Terminal
+    next observations, which the following reset observation overwrites,
+    are kept apart so that time-limit truncations still bootstrap from the
+    right frame.
+
+    Actions, rewards and flags are small and stay in RAM. Batches are
+    gathered with one fancy-indexing read per array, in increasing index
+    order to keep disk reads sequential.
+    """
+
+    def __init__(self, buffer_size: int, observation_space: spaces.Space, action_space: spaces.Space,
+                 device="auto", n_envs: int = 1, optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True, path: Optional[str] = None):
+        """Constructs the buffer.
+
+        Args:
+            buffer_size: The maximum number of transitions, over all envs.
+            observation_space: The observation space.
+            action_space: The action space.
+            device: The PyTorch device of the sampled batches.
+            n_envs: The number of parallel environments.
+            optimize_memory_usage: Ignored, next observations are always derived by index.
+            handle_timeout_termination: Whether to bootstrap from time-limit truncated transitions.
+            path: The file backing the observations, a temporary file that is removed by `close` if None.
+        """
+        # Skip ReplayBuffer.__init__, which allocates obs and next_obs in RAM
+        BaseBuffer.__init__(self, buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = True
+        self.handle_timeout_termination = handle_timeout_termination
+
+        self._init_observations(path)
+        self.next_observations = None
+        self.terminal_observations = {} #(index, env) -> next observation of a done transition
+
+        self.actions = np.zeros((self.buffer_size, self.n_envs, self.action_dim), dtype=action_space.dtype)
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+    def _init_observations(self, path: Optional[str]) -> None:
+        self._owns_file = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="replay_", suffix=".dat")
+            os.close(fd)
+        self.path = path
+        self.observations = np.memmap(path, dtype=self.observation_space.dtype, mode="w+",
+                                      shape=(self.buffer_size, self.n_envs, *self.obs_shape))
+
+    def _store_observations(self, pos: int, obs: np.ndarray) -> None:
+        self.observations[pos] = obs
+
+    def _store_frame(self, frame: np.ndarray):
+        # How a terminal next observation is kept in `terminal_observations`
+        return np.array(frame, dtype=self.observations.dtype)
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray, reward: np.ndarray,
+            done: np.ndarray, infos: List[Dict[str, Any]]) -> None:
+        next_pos = (self.pos + 1) % self.buffer_size
+        done = np.asarray(done).reshape(self.n_envs)
+        for env in range(self.n_envs):
+            self.terminal_observations.pop((self.pos, env), None)
+            if done[env]:
+                self.terminal_observations[(self.pos, env)] = self._store_frame(next_obs[env])
+
+        # next_obs is the obs of the next add unless the episode ended, so each frame is written once
+        self._store_observations(self.pos, obs)
+        self.actions[self.pos] = np.asarray(action).reshape((self.n_envs, self.action_dim))
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        if self.handle_timeout_termination:
+            self.timeouts[self.pos] = [info.get("TimeLimit.truncated", False) for info in infos]
+
+        self.pos = next_pos
+        if self.pos == 0:
+            self.full = True
+
+    def _sample_indices(self, batch_size: int) -> np.ndarray:
+        # The newest transition is skipped, its next observation is only written by the next add
+        if self.full:
+            batch_inds = (np.random.randint(0, self.buffer_size - 1, size=batch_size) + self.pos) % self.buffer_size
+        else:
+            batch_inds = np.random.randint(0, max(self.pos - 1, 1), size=batch_size)
+        return np.sort(batch_inds)
+
+    def sample(self, batch_size: int, env: Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        return self._get_samples(self._sample_indices(batch_size), env=env)
+
+    def _get_samples(self, batch_inds: np.ndarray, env: Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        env_indices = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+        return ReplayBufferSamples(*tuple(map(self.to_torch, self._gather(batch_inds, env_indices, env))))
+
+    def _gather(self, batch_inds: np.ndarray, env_indices: np.ndarray, env: Optional[VecNormalize] = None):
+        obs = np.asarray(self.observations[batch_inds, env_indices])
+        next_obs = np.asarray(self.observations[(batch_inds + 1) % self.buffer_size, env_indices])
+        if self.terminal_observations:
+            for i in np.flatnonzero(self.dones[batch_inds, env_indices]):
+                next_obs[i] = self.terminal_observations[(batch_inds[i], env_indices[i])]
+
+        return (
+            self._normalize_obs(obs, env),
+            self.actions[batch_inds, env_indices],
+            self._normalize_obs(next_obs, env),
+            # Only use dones that are not due to timeouts
+            (self.dones[batch_inds, env_indices] * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env),
+        )
+
+    def close(self) -> None:
+        """Releases the memory map and removes its file if it is a temporary one."""
+        if self.observations is None:
+            return
+        self.observations.flush()
+        self.observations = None
+        if self._owns_file and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getstate__(self):
+        # Pickle (e.g. save_replay_buffer) the file path instead of the observations
+        self.observations.flush()
+        state = self.__dict__.copy()
+        state["observations"] = None
+        state["_owns_file"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.observations = np.memmap(self.path, dtype=self.observation_space.dtype, mode="r+",
+                                      shape=(self.buffer_size, self.n_envs, *self.obs_shape))
+
+
+class CompressedReplayBuffer(MemmapReplayBuffer):
+    """Replay buffer keeping image observations once, compressed, in RAM.
+
+    Frames are encoded on `add` by a `frame_codecs.FrameCodec`, 'zlib' or
+    'png' losslessly (semantic masks compress 20-50x) or 'jpeg' for RGB
+    frames, and kept as `bytes` in an object array of shape
+    `(buffer_size, n_envs)`. Next observations are derived by index as in
+    `MemmapReplayBuffer`. `compression_ratio` reports the achieved ratio.
+
+    A minibatch is decoded by `num_threads` threads (zlib and Pillow release
+    the GIL), and with `prefetch` the next one is drawn and decoded in the
+    background as soon as a minibatch is returned, so the learner only
+    waits when decoding is slower than a gradient step. The encoded frames
+    of a prefetched minibatch are referenced when it is drawn, so `add`s
+    in between never tear it, but it cannot contain their transitions.
+    """
+
+    def __init__(self, buffer_size: int, observation_space: spaces.Space, action_space: spaces.Space,
+                 device="auto", n_envs: int = 1, optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True, codec: str = "zlib", quality: int = 90,
+                 num_threads: int = 4, prefetch: bool = True):
+        """Constructs the buffer.
+
+        Args:
+            codec: One of `frame_codecs.CODECS`.
+            quality: The JPEG quality, from 1 to 95.
+            num_threads: The number of threads decoding a minibatch.
+            prefetch: Whether to decode the next minibatch while the learner uses the current one.
+
+        The other arguments are those of `MemmapReplayBuffer`, minus `path`.
+        """
+        if observation_space.dtype != np.uint8: #e.g. latent features, encoding would cast them to uint8
+            raise ValueError("CompressedReplayBuffer only stores uint8 observations, got {}".format(
+                observation_space.dtype))
+        self.codec = make_codec(codec, observation_space.shape, is_image_space_channels_first(observation_space)
+                                if len(observation_space.shape) == 3 else False, quality=quality,
+                                dtype=observation_space.dtype)
+        self.num_threads = num_threads
+        self.prefetch = prefetch
+        self.stored_bytes = 0
+        super().__init__(buffer_size, observation_space, action_space, device, n_envs, optimize_memory_usage,
+                         handle_timeout_termination)
+        self._pool = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="replay_decode")
+        self._pending = None
+
+    def _init_observations(self, path: Optional[str]) -> None:
+        self._owns_file = False
+        self.path = None
+        self.observations = np.empty((self.buffer_size, self.n_envs), dtype=object)
+
+    def _store_observations(self, pos: int, obs: np.ndarray) -> None:
+        for env in range(self.n_envs):
+            data = self.codec.encode(obs[env])
+            previous = self.observations[pos, env]
+            self.stored_bytes += len(data) - (0 if previous is None else len(previous))
+            self.observations[pos, env] = data
+
+    def _store_frame(self, frame: np.ndarray):
+        data = self.codec.encode(frame)
+        self.stored_bytes += len(data)
+        return data
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray, reward: np.ndarray,
+            done: np.ndarray, infos: List[Dict[str, Any]]) -> None:
+        for env in range(self.n_envs): #terminal next observations the base class drops or replaces
+            previous = self.terminal_observations.get((self.pos, env))
+            if previous is not None:
+                self.stored_bytes -= len(previous)
+        super().add(obs, next_obs, action, reward, done, infos)
+
+    @property
+    def compression_ratio(self) -> float:
+        """Returns the raw size of the stored observations, terminal ones included, over their compressed size."""
+        frames = (self.buffer_size if self.full else self.pos) * self.n_envs + len(self.terminal_observations)
+        raw_bytes = frames * int(np.prod(self.obs_shape)) * np.dtype(self.observation_space.dtype).itemsize
+        return raw_bytes / max(self.stored_bytes, 1)
+
+    def _decode_rows(self, encoded: np.ndarray, out: np.ndarray, rows: np.ndarray) -> None:
+        for row in rows:
+            if encoded[row] is None: #next observation of the only transition, not stored yet
+                out[row] = 0
+            else:
+                self.codec.decode(encoded[row], out[row])
+
+    def _decode_async(self, batch_inds: np.ndarray, env_indices: np.ndarray):
+        # Everything is read here, in the caller's thread, the threads only decode into `out`
+        dones = self.dones[batch_inds, env_indices]
+        next_encoded = self.observations[(batch_inds + 1) % self.buffer_size, env_indices]
+        for i in np.flatnonzero(dones):
+            next_encoded[i] = self.terminal_observations[(batch_inds[i], env_indices[i])]
+        encoded = np.concatenate([self.observations[batch_inds, env_indices], next_encoded])
+        out = np.empty((len(encoded), *self.obs_shape), dtype=self.observation_space.dtype)
+        futures = [self._pool.submit(self._decode_rows, encoded, out, rows)
+                   for rows in np.array_split(np.arange(len(encoded)), self.num_threads)]
+        return (out, futures, self.actions[batch_inds, env_indices],
+                # Only use dones that are not due to timeouts
+                (dones * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+                self.rewards[batch_inds, env_indices].reshape(-1, 1))
+
+    def _wait(self, pending, env: Optional[VecNormalize] = None):
+        out, futures, actions, dones, rewards = pending
+        for future in futures:
+            future.result()
+        obs, next_obs = np.split(out, 2)
+        return (self._normalize_obs(obs, env), actions, self._normalize_obs(next_obs, env), dones,
+                self._normalize_reward(rewards, env))
+
+    def _gather(self, batch_inds: np.ndarray, env_indices: np.ndarray, env: Optional[VecNormalize] = None):
+        return self._wait(self._decode_async(batch_inds, env_indices), env)
+
+    def _draw(self, batch_size: int):
+        return self._decode_async(self._sample_indices(batch_size),
+                                  np.random.randint(0, high=self.n_envs, size=(batch_size,)))
+
+    def sample(self, batch_size: int, env: Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        pending, self._pending = self._pending, None
+        if pending is None or len(pending[2]) != batch_size:
+            pending = self._draw(batch_size)
+        obs, actions, next_obs, dones, rewards = self._wait(pending, env)
+        # The observations are views of a batch freshly decoded for this call, so they are wrapped, not copied
+        samples = ReplayBufferSamples(th.from_numpy(obs).to(self.device), self.to_torch(actions),
+                                      th.from_numpy(next_obs).to(self.device), self.to_torch(dones),
+                                      self.to_torch(rewards))
+        # Drawn after the conversion, so the decoding threads do not compete with it
+        if self.prefetch:
+            self._pending = self._draw(batch_size)
+        return samples
+
+    def close(self) -> None:
+        """Stops the decoding threads."""
+        self._pending = None
+        self._pool.shutdown(wait=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_pool"]
+        state["_pending"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="replay_decode")
+
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor
+    indices: np.ndarray
+
+
+class PrioritizedReplayBuffer(MemmapReplayBuffer):
+    """Proportional prioritized experience replay (Schaul et al., 2016) on a `SumTree`.
+
+    Transitions are drawn with probability `p_i^alpha / sum_k p_k^alpha`,
+    one per equal-mass stratum of the tree, and returned with importance
+    sampling weights `(N P(i))^-beta`, normalized by their batch maximum.
+    `beta` is annealed linearly to 1 over `beta_steps` calls to `sample`.
+    New transitions get the largest priority seen so far; the learner
+    reports TD errors back through `update_priorities`, see
+    `prioritized_sac.PrioritizedSAC`.
+
+    Leaf `pos * n_envs + env` holds the priority of transition `(pos, env)`.
+    The newest transitions keep a zero priority until the next `add` writes
+    their next observation, like the uniform buffer skips them.
+
+    A tree walk costs about as much for a few minibatches as for one, so
+    `sample` draws `batches_per_walk` minibatches at once and hands them out
+    one per call, and `update_priorities` queues the new priorities until
+    the next walk writes them in one pass. The later minibatches of a walk
+    thus miss the newest priorities and transitions (for at most
+    `batches_per_walk - 1` gradient steps), and their importance sampling
+    weights use the priorities they were drawn with. Every slot records the
+    `add` that last wrote it: a drawn minibatch holding a slot written since
+    the walk is drawn again, and reported priorities of such slots are
+    dropped, since they belong to the overwritten transition.
+    """
+
+    def __init__(self, buffer_size: int, observation_space: spaces.Space, action_space: spaces.Space,
+                 device="auto", n_envs: int = 1, optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True, path: Optional[str] = None, alpha: float = 0.6,
+                 beta: float = 0.4, beta_steps: int = 100000, epsilon: float = 1e-6, batches_per_walk: int = 16):
+        """Constructs the buffer.
+
+        Args:
+            alpha: How much prioritization is used, 0 samples uniformly.
+            beta: The initial importance sampling exponent.
+            beta_steps: The number of `sample` calls over which beta reaches 1.
+            epsilon: Added to absolute TD errors so that no transition gets a zero priority.
+            batches_per_walk: The number of minibatches drawn per tree walk, 1 draws every minibatch from
+                up-to-date priorities.
+
+        The other arguments are those of `MemmapReplayBuffer`.
+        """
+        super().__init__(buffer_size, observation_space, action_space, device, n_envs, optimize_memory_usage,
+                         handle_timeout_termination, path)
+        self.alpha = alpha
+        self.beta0 = beta
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.num_samples = 0
+        self.batches_per_walk = batches_per_walk
+        self.tree = SumTree(self.buffer_size * self.n_envs)
+        self.num_adds = 0
+        self._written = np.zeros(self.buffer_size, dtype=np.int64) #num_adds of the add that last wrote each slot
+        self._walked = 0 #num_adds at the last walk
+        self._drawn = [] #(leaves, priorities) of the minibatches left from the last walk, the next one last
+        self._queued = [] #(leaves, priorities) reported since the last walk
+
+    @property
+    def beta(self) -> float:
+        return min(1.0, self.beta0 + (1.0 - self.beta0) * self.num_samples / self.beta_steps)
+
+    def _leaves(self, pos: int) -> np.ndarray:
+        return pos * self.n_envs + np.arange(self.n_envs)
+
+    def add(self, obs: np.ndarray, next_obs: np.ndarray, action: np.ndarray, reward: np.ndarray,
+            done: np.ndarray, infos: List[Dict[str, Any]]) -> None:
+        pos = self.pos
+        previous = (pos - 1) % self.buffer_size
+        super().add(obs, next_obs, action, reward, done, infos)
+        self.num_adds += 1
+        self._written[pos] = self.num_adds
+        # This obs completes the previous transition, the new one waits for its next observation; one tree pass
+        if previous != pos and (self.full or pos > 0):
+            self.tree.update(np.concatenate([self._leaves(previous), self._leaves(pos)]),
+                             np.repeat([self.max_priority**self.alpha, 0.0], self.n_envs))
+        else:
+            self.tree.update(self._leaves(pos), 0.0)
+
+    def _walk(self, batch_size: int) -> None:
+        # Draws the next minibatches from the tree, once the queued priorities are in, with their weights for the
+        # beta of the sample call that returns them
+        self._write_priorities()
+        self._walked = self.num_adds
+        if self.tree.total > 0.0:
+            leaves = self.tree.sample_batches(batch_size, self.batches_per_walk) #rows in increasing order
+            priorities = self.tree.get(leaves)
+        else: #only the first transition is stored, as the uniform buffer does
+            leaves = np.zeros((1, batch_size), dtype=np.int64)
+            priorities = np.ones((1, batch_size))
+        steps = self.num_samples + np.arange(len(leaves))
+        betas = np.minimum(1.0, self.beta0 + (1.0 - self.beta0) * steps / self.beta_steps)
+        # (N P_i)^-beta over its batch maximum, N and the total cancel out; float32 as returned, and a faster power
+        priorities = priorities.astype(np.float32)
+        weights = (priorities.min(axis=1, keepdims=True) / priorities)**betas[:, None].astype(np.float32)
+        batch_inds, env_indices = np.divmod(leaves, self.n_envs)
+        self._drawn = list(zip(leaves[::-1], batch_inds[::-1], env_indices[::-1], weights[::-1, :, None]))
+
+    def sample(self, batch_size: int, env: Optional[VecNormalize] = None) -> PrioritizedReplayBufferSamples:
+        if not self._drawn or len(self._drawn[-1][0]) != batch_size or \
+                (self.num_adds != self._walked and self._written[self._drawn[-1][1]].max() > self._walked):
+            self._walk(batch_size) #none left, or holding a transition overwritten since the walk
+        leaves, batch_inds, env_indices, weights = self._drawn.pop()
+        self.num_samples += 1
+
+        data = tuple(map(self.to_torch, self._gather(batch_inds, env_indices, env)))
+        return PrioritizedReplayBufferSamples(*data, self.to_torch(weights), leaves)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """Sets the priorities of the last sampled `indices` from their absolute TD errors, written on the next walk."""
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64).reshape(-1)) + self.epsilon
+        self._queued.append((np.asarray(indices, dtype=np.int64).reshape(-1), priorities))
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def _write_priorities(self) -> None:
+        if not self._queued:
+            return
+        indices, values = (np.concatenate(arrays) for arrays in zip(*self._queued))
+        self._queued = []
+        # Every queued minibatch was drawn by the last walk; the last value of a duplicated leaf wins, so the latest
+        # report of a leaf is kept
+        kept = self._written[indices // self.n_envs] <= self._walked
+        self.tree.update(indices[kept], values[kept]**self.alpha)
@@ -0,0 +1,178 @@
+import math
+from typing import NamedTuple, Optional
+
+import carla
+import numpy as np
+from absl import logging
+
+
+class RouteProjection(NamedTuple):
+    """Position of the vehicle relative to the route, see `RouteCache.project`."""
+    segment: int #index of the route segment (waypoints segment, segment + 1) the vehicle is on
+    progress: float #arc length (in meters) travelled along the route
+    lateral_offset: float #signed distance (in meters) to the route, positive to its right
+    heading_error: float #vehicle yaw minus route yaw (in radians), in [-pi, pi)
+
+
+class RouteCache(object):
+    """Reference path of an episode stored as contiguous NumPy arrays.
+
+    The path is generated once by chaining `waypoint.next(spacing)` from the
+    vehicle's start and kept as `x`, `y` and `yaw` arrays, with the
+    cumulative arc length at every waypoint in `s`. `nearest` only searches
+    a sliding window that starts at the last matched index and moves forward
+    as the vehicle progresses, so the steady state costs O(window) array math
+    and no map queries; `project` walks segment by segment from the previous
+    one, which is O(1) per step. The path is extended in chunks when the
+    vehicle nears its end and rebuilt if it strays further than
+    `max_deviation`, keeping the progress travelled so far.
+    """
+
+    def __init__(self, carla_map, spacing: float = 2.0, num_waypoints: int = 300, window: int = 20,
+                 max_deviation: float = 5.0):
+        """Constructs the cache.
+
+        Args:
+            carla_map: The `CARLA` map the route is generated on.
+            spacing: The distance (in meters) between two route waypoints.
+            num_waypoints: The number of waypoints generated per chunk.
+            window: The number of waypoints searched per query.
+            max_deviation: The distance (in meters) to the nearest waypoint
+            above which the route is rebuilt from the vehicle location.
+        """
+        self.map = carla_map
+        self.spacing = spacing
+        self.num_waypoints = num_waypoints
+        self.window = window
+        self.max_deviation = max_deviation
+        self.clear()
+
+    def clear(self) -> None:
+        """Drops the current route, the next query rebuilds it."""
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.yaw = np.empty(0)
+        self.s = np.empty(0)
+        self.index = 0
+        self.segment = 0
+        self.progress = 0.0
+        self._last_waypoint = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def build(self, location) -> None:
+        """Generates the route starting from the driving lane closest to `location`.
+
+        The progress travelled so far is kept, `s` starts from it.
+        """
+        progress = self.progress
+        self.clear()
+        self.progress = progress
+        wp = self.map.get_waypoint(location, project_to_road=True, lane_type=carla.LaneType.Driving)
+        self.x = np.array([wp.transform.location.x])
+        self.y = np.array([wp.transform.location.y])
+        self.yaw = np.array([math.radians(wp.transform.rotation.yaw)])
+        self.s = np.array([progress])
+        self._last_waypoint = wp
+        self._extend()
+
+    def _extend(self) -> None:
+        x = np.empty(self.num_waypoints)
+        y = np.empty(self.num_waypoints)
+        yaw = np.empty(self.num_waypoints)
+        wp = self._last_waypoint
+        for i in range(self.num_waypoints):
+            wp = wp.next(self.spacing)[0]
+            transform = wp.transform
+            x[i] = transform.location.x
+            y[i] = transform.location.y
+            yaw[i] = math.radians(transform.rotation.yaw)
+        self._last_waypoint = wp
+        step = np.hypot(np.diff(np.concatenate((self.x[-1:], x))), np.diff(np.concatenate((self.y[-1:], y))))
+        self.s = np.concatenate((self.s, self.s[-1] + np.cumsum(step)))
+        self.x = np.concatenate((self.x, x))
+        self.y = np.concatenate((self.y, y))
+        self.yaw = np.concatenate((self.yaw, yaw))
+
+    def nearest(self, location, _rebuilt=False):
+        """Returns the index of and distance to the route waypoint closest to `location`.
+
+        Only the window starting at the last matched index is searched, the
+        route is built, extended or rebuilt as needed.
+        """
+        if len(self) == 0:
+            self.build(location)
+        if self.index + self.window >= len(self):
+            self._extend()
+
+        end = self.index + self.window
+        dist = np.hypot(self.x[self.index:end] - location.x, self.y[self.index:end] - location.y)
+        offset = int(np.argmin(dist))
+        if dist[offset] > self.max_deviation and not _rebuilt:
+            logging.debug("Vehicle is {:.1f} m off the cached route, rebuilding it".format(dist[offset]))
+            self.build(location)
+            return self.nearest(location, _rebuilt=True)
+
+        self.index += offset
+        return self.index, float(dist[offset])
+
+    def target(self, location, lookahead: int = 4):
+        """Returns the index and `(x, y)` of the waypoint `lookahead` points past the closest one."""
+        idx, _ = self.nearest(location)
+        idx = min(idx + lookahead, len(self) - 1)
+        return idx, self.x[idx], self.y[idx]
+
+    def _segment_point(self, i: int, px: float, py: float):
+        # Fraction along segment i of the orthogonal projection of (px, py), and the segment vector
+        dx = self.x[i + 1] - self.x[i]
+        dy = self.y[i + 1] - self.y[i]
+        t = ((px - self.x[i]) * dx + (py - self.y[i]) * dy) / max(dx * dx + dy * dy, 1e-9)
+        return t, dx, dy
+
+    def project(self, location, yaw: Optional[float] = None, _rebuilt=False) -> RouteProjection:
+        """Projects `location` on the route, walking segment by segment from the previous projection.
+
+        Args:
+            location: The `carla.Location` of the vehicle.
+            yaw: The yaw (in degrees, as in `carla.Rotation`) of the vehicle, the heading error is 0 if None.
+
+        Returns:
+            A `RouteProjection`. Its `progress` only changes by the distance
+            driven along the route, also when the route is rebuilt.
+        """
+        if len(self) == 0:
+            self.build(location)
+        px, py = location.x, location.y
+        i = self.segment
+        t, dx, dy = self._segment_point(i, px, py)
+        steps = 0
+        while t > 1.0 and steps < self.window: #forward; the route is extended ahead of the vehicle
+            if i + 2 >= len(self):
+                self._extend()
+            i += 1
+            steps += 1
+            t, dx, dy = self._segment_point(i, px, py)
+        while t < 0.0 and i > 0 and steps == 0: #backward, only if not moved forward, which would oscillate at corners
+            t_previous, dx_previous, dy_previous = self._segment_point(i - 1, px, py)
+            if t_previous > 1.0:
+                break
+            i, t, dx, dy = i - 1, t_previous, dx_previous, dy_previous
+
+        t = min(max(t, 0.0), 1.0)
+        offset_x = px - (self.x[i] + t * dx)
+        offset_y = py - (self.y[i] + t * dy)
+        distance = math.hypot(offset_x, offset_y)
+        if (distance > self.max_deviation or steps >= self.window) and not _rebuilt:
+            logging.debug("Vehicle is {:.1f} m off the cached route, rebuilding it".format(distance))
+            self.build(location)
+            return self.project(location, yaw, _rebuilt=True)
+
+        self.segment = i
+        self.progress = float(self.s[i] + t * (self.s[i + 1] - self.s[i]))
+        # CARLA is left-handed (y points right of x), so a positive cross product is right of the route
+        lateral = math.copysign(distance, dx * offset_y - dy * offset_x)
+        heading_error = 0.0
+        if yaw is not None:
+            heading_error = (math.radians(yaw) - math.atan2(dy, dx) + math.pi) % (2.0 * math.pi) - math.pi
+        return RouteProjection(i, self.progress, lateral, heading_error)
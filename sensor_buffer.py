@@ -0,0 +1,131 @@
+import collections
+import threading
+import time
+
+from absl import logging
+
+
+class SensorBuffer(object):
+    """Keeps the latest `maxlen` sensor measurements keyed by their frame id.
+
+    `put` is meant to be passed to `sensor.listen`. Consumers ask for the
+    measurement of a given simulation frame (the id returned by
+    `world.tick()`) and block until it arrives, so a stale frame from an
+    earlier tick is never returned silently. Older measurements are evicted
+    once `maxlen` is reached, which bounds memory when nobody drains the
+    buffer (e.g. the preview camera).
+
+    Counters:
+        drops: measurements evicted without ever being read.
+        waits: `get` calls that had to block for their frame.
+        timeouts: `get` calls whose frame did not arrive within the timeout.
+    """
+
+    def __init__(self, maxlen: int = 4):
+        assert maxlen >= 1
+        self.maxlen = maxlen
+        self._data = collections.OrderedDict()
+        self._read = set()
+        self._cond = threading.Condition()
+        self.drops = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def put(self, data) -> None:
+        """Stores a measurement, evicting the oldest one if the buffer is full."""
+        with self._cond:
+            self._data[data.frame] = data
+            while len(self._data) > self.maxlen:
+                frame, _ = self._data.popitem(last=False)
+                if frame in self._read:
+                    self._read.discard(frame)
+                else:
+                    self.drops += 1
+            self._cond.notify_all()
+
+    def empty(self) -> bool:
+        with self._cond:
+            return not self._data
+
+    def clear(self) -> None:
+        """Drops every stored measurement (e.g. those of a previous episode)."""
+        with self._cond:
+            self._data.clear()
+            self._read.clear()
+
+    @property
+    def latest_frame(self):
+        """Returns the frame id of the newest measurement, or None."""
+        with self._cond:
+            return next(reversed(self._data)) if self._data else None
+
+    def wait(self, frame=None, timeout: float = 2.0) -> bool:
+        """Blocks until the measurement of `frame` (or any, if None) is stored.
+
+        Returns:
+            True if it arrived within `timeout` seconds, False otherwise.
+        """
+        with self._cond:
+            return self._wait(frame, timeout)
+
+    def get(self, frame=None, timeout: float = 2.0):
+        """Returns the measurement of `frame`, or the newest one if `frame` is None.
+
+        Blocks until a matching measurement arrives. If it does not arrive
+        within `timeout` seconds, the newest older measurement is returned
+        instead and a `TimeoutError` is raised when there is none.
+        """
+        with self._cond:
+            if not self._wait(frame, timeout):
+                return self._on_timeout(frame)
+            key = next(reversed(self._data)) if frame is None else frame
+            self._read.add(key)
+            return self._data[key]
+
+    def get_from(self, frame, timeout: float = 2.0):
+        """Returns the measurement of `frame`, or of the first later frame, for sensors that skip frames.
+
+        Measurements arrive in frame order, so a later one means that the
+        sensor skipped `frame`.
+
+        Returns:
+            The measurement, or None if none arrived within `timeout` seconds.
+        """
+        with self._cond:
+            if not self._wait(frame, timeout, later=True):
+                return None
+            key = next(key for key in self._data if key >= frame)
+            self._read.add(key)
+            return self._data[key]
+
+    def _wait(self, frame, timeout, later=False) -> bool:
+        if self._ready(frame, later):
+            return True
+        self.waits += 1
+        deadline = time.monotonic() + timeout
+        while not self._ready(frame, later):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def _ready(self, frame, later=False) -> bool:
+        if frame is None:
+            return bool(self._data)
+        if later:
+            return any(key >= frame for key in self._data)
+        return frame in self._data
+
+    def _on_timeout(self, frame):
+        self.timeouts += 1
+        older = [key for key in self._data if frame is None or key < frame]
+        if not older:
+            raise TimeoutError("No sensor data for frame {} after timeout".format(frame))
+        logging.warning("Sensor data for frame {} timed out, using frame {}".format(frame, older[-1]))
+        self._read.add(older[-1])
+        return self._data[older[-1]]
+
+    def stats(self):
+        """Returns the buffer counters as a dictionary."""
+        return {"drops": self.drops, "waits": self.waits, "timeouts": self.timeouts}
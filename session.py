@@ -0,0 +1,146 @@
+import threading
+from typing import Dict, Tuple
+
+from absl import logging
+
+from setup import setup
+
+_SESSIONS: Dict[Tuple[str, int], "SimulatorSession"] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class SimulatorSession(object):
+    """`carla.Client`, world, map and Traffic Managers shared by every `CarlaEnv` of one server.
+
+    `acquire` connects (through `setup.setup`) on first use of a
+    `(host, port)` and otherwise returns the live session, counting
+    references; `release` drops one. The count only covers this process,
+    other processes (vec env workers, actor-learner collectors) may still
+    drive the same server, so the last release leaves it synchronous unless
+    an acquirer passed `restore_async` (the process that owns the server).
+    `ensure_synchronous`, called on every reset, re-applies synchronous mode
+    if another client switched the server back to asynchronous mode.
+
+    In synchronous mode every `world.tick()` advances all the actors of the
+    server, so the session records which env drives the simulation. An env
+    claims the ticks by calling `tick(self)` (or `claim(self)` on reset); when
+    another env takes them over, the previous owner's `on_preempted` is
+    called, since its episode went on without it. Usage:
+
+        session = SimulatorSession.acquire('Town02', fps=10, port=2000)
+        frame = session.tick(env)
+        session.release()
+    """
+
+    def __init__(self, key, town, fps, client, world, frame, carla_map, no_rendering, restore_async=False):
+        self.key = key
+        self.town = town
+        self.fps = fps
+        self.no_rendering = no_rendering
+        self.restore_async = restore_async
+        self.client = client
+        self.world = world
+        self.frame = frame
+        self.map = carla_map
+        self.references = 0
+        self.owner = None
+        self._traffic_managers = {}
+        self._tick_lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, town: str, fps: int, host: str = "localhost", port: int = 2000, client_timeout: float = 20.0,
+                no_rendering: bool = False, force_reload: bool = False,
+                restore_async: bool = False) -> "SimulatorSession":
+        """Returns the session of `(host, port)`, connecting to the server and loading `town` if needed.
+
+        Args:
+            town: The `CARLA` town identifier, must match the town of a live session.
+            fps: The frequency (in Hz) of the simulation, must match the one of a live session.
+            host: The host name or IP of the `CARLA` server.
+            port: The RPC port of the `CARLA` server.
+            client_timeout: The timeout (in seconds) of the client.
+            no_rendering: Whether the server skips rendering, only applied by the first acquirer.
+            force_reload: Whether the first acquirer loads `town` even if it is already the current map.
+            restore_async: Whether the last `release` switches the server back to asynchronous mode. Only for the
+                process owning the server, any other process still using it would be left asynchronous.
+        """
+        key = (host, port)
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(key)
+            if session is None:
+                client, world, frame, carla_map = setup(town=town, fps=fps, host=host, port=port,
+                                                        client_timeout=client_timeout, no_rendering=no_rendering,
+                                                        force_reload=force_reload)
+                session = cls(key, town, fps, client, world, frame, carla_map, no_rendering)
+                _SESSIONS[key] = session
+            else:
+                # Loading another town or changing the time step would silently break the other envs
+                if town != session.town or fps != session.fps:
+                    raise ValueError("{}:{} already runs {} at {} fps, cannot share it for {} at {} fps".format(
+                        host, port, session.town, session.fps, town, fps))
+                if no_rendering != session.no_rendering:
+                    logging.warning("{}:{} keeps no_rendering={} of its first env".format(
+                        host, port, session.no_rendering))
+                logging.debug("Reusing the session of {}:{}".format(host, port))
+            session.restore_async = session.restore_async or restore_async #any owner of the server
+            session.references += 1
+            return session
+
+    def traffic_manager(self, tm_port: int = 8000):
+        """Returns the Traffic Manager of `tm_port`, switched to synchronous mode once."""
+        traffic_manager = self._traffic_managers.get(tm_port)
+        if traffic_manager is None:
+            traffic_manager = self.client.get_trafficmanager(tm_port)
+            traffic_manager.set_synchronous_mode(True) #the world is synchronous, see setup
+            self._traffic_managers[tm_port] = traffic_manager
+        return traffic_manager
+
+    def ensure_synchronous(self) -> None:
+        """Re-applies synchronous mode and the time step if another client of the server changed them."""
+        settings = self.world.get_settings()
+        delta = 1.0 / self.fps
+        if settings.synchronous_mode and settings.fixed_delta_seconds is not None and \
+                abs(settings.fixed_delta_seconds - delta) < 1e-9:
+            return
+        logging.warning("{}:{} left synchronous mode (another client released it), re-applying it".format(*self.key))
+        settings.synchronous_mode = True
+        settings.fixed_delta_seconds = delta
+        self.frame = self.world.apply_settings(settings)
+        for traffic_manager in self._traffic_managers.values():
+            traffic_manager.set_synchronous_mode(True)
+
+    def claim(self, owner) -> None:
+        """Makes `owner` the env driving the ticks, notifying the previous one."""
+        if self.owner is not owner:
+            previous, self.owner = self.owner, owner
+            if previous is not None:
+                logging.debug("{} takes over the ticks of {}:{}".format(type(owner).__name__, *self.key))
+                previous.on_preempted()
+
+    def tick(self, owner) -> int:
+        """Ticks the world on behalf of `owner` and returns the new frame id."""
+        with self._tick_lock:
+            self.claim(owner)
+            self.frame = self.world.tick()
+            return self.frame
+
+    def release(self, owner=None) -> None:
+        """Drops a reference, the last one forgets the session and, with `restore_async`, restores asynchronous mode."""
+        with _SESSIONS_LOCK:
+            if owner is not None and self.owner is owner:
+                self.owner = None
+            self.references -= 1
+            if self.references > 0:
+                return
+            _SESSIONS.pop(self.key, None)
+        if not self.restore_async: #other processes may still tick the server
+            return
+        try:
+            for traffic_manager in self._traffic_managers.values():
+                traffic_manager.set_synchronous_mode(False)
+            settings = self.world.get_settings()
+            settings.synchronous_mode = False
+            settings.fixed_delta_seconds = None
+            self.world.apply_settings(settings)
+        except RuntimeError as e: #the server is already gone
+            logging.debug("Could not restore asynchronous mode on {}:{}: {}".format(*self.key, e))
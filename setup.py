@@ -25,26 +25,39 @@ logging.set_verbosity(logging.DEBUG)
 def setup(
     town: str,
     fps: int = 20,
+    host: str = "localhost",
+    port: int = 2000,
     server_timestop: float = 30.0,
     client_timeout: float = 20.0,
     num_max_restarts: int = 10,
+    no_rendering: bool = False,
+    force_reload: bool = False,
 ):
-    """Returns the `CARLA` `server`, `client` and `world`.
+    """Returns the `CARLA` `client`, `world`, first frame and map.
+
+    `town` is only loaded when the server runs another map (or with
+    `force_reload`), since `load_world` takes seconds and destroys the actors
+    of any other client of the same server. Synchronous mode, the time step
+    and the rendering mode are applied in-process with one `WorldSettings`.
 
     Args:
         town: The `CARLA` town identifier.
         fps: The frequency (in Hz) of the simulation.
+        host: The host name or IP of the `CARLA` server.
+        port: The RPC port of the `CARLA` server.
         server_timestop: The time interval between spawing the server
         and resuming program.
         client_timeout: The time interval before stopping
         the search for the carla server.
         num_max_restarts: Number of attempts to connect to the server.
+        no_rendering: Whether the server skips rendering (cameras then return no images).
+        force_reload: Whether to load `town` even if it is already the current map.
 
     Returns:
         client: The `CARLA` client.
         world: The `CARLA` world.
         frame: The synchronous simulation time step ID.
-        server: The `CARLA` server.
+        carla_map: The map of `town`.
     """
     assert town in ("Town01", "Town02", "Town03", "Town04", "Town05")
 
@@ -57,7 +70,6 @@ def setup(
 
         # Random assignment of port.
         #port = np.random.randint(2000, 3000)
-        port = 2000
 
         ## Start CARLA server.
         #env = os.environ.copy()
@@ -94,30 +106,33 @@ def setup(
         # Connect client.
         logging.debug("Connects a CARLA client at port={}".format(port))
         try:
-            client = carla.Client("localhost", port)  # pylint: disable=no-member
+            client = carla.Client(host, port)  # pylint: disable=no-member
             client.set_timeout(client_timeout)
-            client.load_world(map_name='Town02') #set town, or just set town to assert one of the 5
             world = client.get_world()
+            carla_map = world.get_map()
+            loaded_town = carla_map.name.split('/')[-1]
+            if force_reload or loaded_town != town:
+                logging.debug("Loads {} (server runs {})".format(town, loaded_town))
+                world = client.load_world(town)
+                carla_map = world.get_map()
+            else:
+                logging.debug("{} is already loaded, skipping load_world".format(town))
             world.set_weather(carla.WeatherParameters.ClearNoon)  # pylint: disable=no-member
-            # if hasattr(world, 'set_no_rendering_mode'):                
-            #     world.set_no_rendering_mode(True)  # No rendering mode
-                
-            #world.set_no_rendering_mode(True) #no rendering mode
-            frame = world.apply_settings(
-                carla.WorldSettings(  # pylint: disable=no-member
-                    synchronous_mode=True,
-                    fixed_delta_seconds=1.0 / fps,
-                ))
+
+            settings = world.get_settings() #keeps the server's other settings, e.g. substepping
+            settings.synchronous_mode = True
+            settings.fixed_delta_seconds = 1.0 / fps
+            settings.no_rendering_mode = no_rendering
+            frame = world.apply_settings(settings)
             logging.debug("Server version: {}".format(client.get_server_version()))
             logging.debug("Client version: {}".format(client.get_client_version()))
-            #return client, world, frame, server
-            return client, world, frame
+            return client, world, frame, carla_map
         except RuntimeError as msg: #carla connection attempt failed
             logging.debug(msg)
             attempts += 1
-            logging.debug("Stopping CARLA server at port={}".format(port))
-            os.killpg(server.pid, signal.SIGKILL)
-            atexit.unregister(lambda: os.killpg(server.pid, signal.SIGKILL))
+            #logging.debug("Stopping CARLA server at port={}".format(port))
+            #os.killpg(server.pid, signal.SIGKILL)
+            #atexit.unregister(lambda: os.killpg(server.pid, signal.SIGKILL))
 
     logging.debug(
         "Failed to connect to CARLA after {} attempts".format(num_max_restarts))
@@ -0,0 +1,60 @@
+from multiprocessing import shared_memory
+from typing import Mapping, Tuple
+
+import numpy as np
+
+
+class SharedArrays(object):
+    """Named NumPy arrays laid out in one `multiprocessing.shared_memory` block.
+
+    The creating process calls `SharedArrays(layout)`; other processes
+    receive `spec` (a small picklable tuple) and call `SharedArrays.attach`.
+    Both sides then read and write the same memory through `arrays[name]`,
+    without pickling. Only the creator unlinks the block, in `close`.
+
+    Usage:
+
+        shared = SharedArrays({'obs': ((4, 120, 160, 3), np.uint8), 'reward': ((4,), np.float32)})
+        child = SharedArrays.attach(shared.spec) # in another process
+        child.arrays['reward'][0] = 1.0
+    """
+
+    ALIGNMENT = 64
+
+    def __init__(self, layout: Mapping[str, Tuple[Tuple[int, ...], type]], _shm=None):
+        """Allocates the block.
+
+        Args:
+            layout: Maps every array name to its `(shape, dtype)`.
+        """
+        self.layout = {name: (tuple(shape), np.dtype(dtype).str) for name, (shape, dtype) in layout.items()}
+        offsets, size = {}, 0
+        for name, (shape, dtype) in self.layout.items():
+            offsets[name] = size
+            nbytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            size += -(-max(nbytes, 1) // self.ALIGNMENT) * self.ALIGNMENT #cache line aligned arrays
+        self._owner = _shm is None
+        self.shm = shared_memory.SharedMemory(create=True, size=size) if _shm is None else _shm
+        self.arrays = {name: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offsets[name])
+                       for name, (shape, dtype) in self.layout.items()}
+
+    @property
+    def spec(self):
+        """Returns what `attach` needs to map the block in another process."""
+        return self.shm.name, self.layout
+
+    @classmethod
+    def attach(cls, spec) -> "SharedArrays":
+        """Maps the block described by `spec` (see `spec`) into this process."""
+        name, layout = spec
+        return cls(layout, _shm=shared_memory.SharedMemory(name=name))
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def close(self) -> None:
+        """Unmaps the block, and frees it if this process created it."""
+        self.arrays = {}
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
@@ -0,0 +1,90 @@
+import collections
+import math
+import random
+from typing import Iterable, List
+
+import numpy as np
+
+
+class SpawnSampler(object):
+    """Map spawn points, cached once and sampled among the ones no vehicle or walker occupies.
+
+    A spawn point is occupied when a vehicle or walker stands within
+    `clearance` meters of it, according to one `get_actors` call and the
+    world snapshot, or when `sample` already handed it out since the last
+    `clear`. Actors spawned before the next tick are missing from the
+    snapshot, so the handed out points cover them: `CarlaEnv.reset` clears
+    the sampler, then samples the NPC points and the ego start, and every
+    vehicle gets a free point on its first try.
+
+    Spawn points are bucketed in `clearance`-sized cells once, so marking
+    the points blocked by an actor only looks at the 3x3 cells around it.
+    """
+
+    def __init__(self, world, carla_map=None, clearance: float = 5.0):
+        """Caches the spawn points of `carla_map` (defaults to the map of `world`).
+
+        Args:
+            world: The `CARLA` world the actors live in.
+            carla_map: The `CARLA` map, saves a `get_map` call when the caller has it.
+            clearance: The distance (in meters) within which an actor blocks a spawn point.
+        """
+        self.world = world
+        self.spawn_points = (carla_map if carla_map is not None else world.get_map()).get_spawn_points()
+        self.clearance = clearance
+        self._x = np.array([transform.location.x for transform in self.spawn_points])
+        self._y = np.array([transform.location.y for transform in self.spawn_points])
+        self._cells = collections.defaultdict(list)
+        for index, (x, y) in enumerate(zip(self._x.tolist(), self._y.tolist())):
+            self._cells[self._cell(x, y)].append(index)
+        self._cells = {cell: np.array(indices) for cell, indices in self._cells.items()}
+        self._claimed = np.zeros(len(self.spawn_points), dtype=bool)
+
+    def __len__(self):
+        return len(self.spawn_points)
+
+    def _cell(self, x, y):
+        return math.floor(x / self.clearance), math.floor(y / self.clearance)
+
+    def clear(self) -> None:
+        """Forgets the points handed out by `sample`, call it once their actors are destroyed or ticked."""
+        self._claimed[:] = False
+
+    def occupied(self, ignore_ids: Iterable[int] = ()) -> np.ndarray:
+        """Returns a boolean mask of the occupied spawn points.
+
+        Args:
+            ignore_ids: Ids of actors that do not block a point, e.g. the ego vehicle about to be teleported.
+        """
+        occupied = self._claimed.copy()
+        ignore_ids = set(ignore_ids)
+        actors = self.world.get_actors()
+        snapshot = self.world.get_snapshot()
+        clearance2 = self.clearance ** 2
+        for actor in list(actors.filter('vehicle.*')) + list(actors.filter('walker.*')):
+            actor_snapshot = snapshot.find(actor.id) if actor.id not in ignore_ids else None
+            if actor_snapshot is None: #ignored, or spawned after the snapshot
+                continue
+            location = actor_snapshot.get_transform().location
+            i, j = self._cell(location.x, location.y)
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    indices = self._cells.get((i + di, j + dj))
+                    if indices is not None:
+                        near = (self._x[indices] - location.x) ** 2 + (self._y[indices] - location.y) ** 2 < clearance2
+                        occupied[indices[near]] = True
+        return occupied
+
+    def sample(self, k: int = 1, ignore_ids: Iterable[int] = ()) -> List:
+        """Returns up to `k` distinct random free spawn points and marks them handed out.
+
+        Fewer than `k` points are returned when fewer are free.
+
+        Args:
+            k: The number of spawn points.
+            ignore_ids: Ids of actors that do not block a point, see `occupied`.
+        """
+        free = np.flatnonzero(~self.occupied(ignore_ids))
+        picks = random.sample(free.tolist(), min(k, len(free)))
+        self._claimed[picks] = True
+        return [self.spawn_points[index] for index in picks]
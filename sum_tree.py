@@ -0,0 +1,98 @@
+import numpy as np
+
+_BELOW = 1.0 - 2.0**-52
+
+
+class SumTree(object):
+    """Array-backed tree whose inner nodes hold the sum of their leaves.
+
+    Every level is one float64 array. The top level is a row of up to
+    `max_top` nodes, searched at once with a cumulative sum and
+    `np.searchsorted`; below it level `d` holds `top * fanout**d` nodes and
+    node `i` has children `i * fanout ... i * fanout + fanout - 1` on the
+    next level. The leaf level is padded with zeros. `update` and `find`
+    walk the tree one level at a time for a whole batch of leaves, so a
+    256-sample minibatch costs a handful of vectorized NumPy calls (two
+    levels below a 1954-node top for 500k leaves with the defaults) instead
+    of 256 Python loops; the wide top replaces the upper levels, whose
+    gathers cost more than its cumulative sum. Parents are recomputed from their children rather
+    than incremented, so no rounding error accumulates over millions of
+    updates.
+    """
+
+    def __init__(self, capacity: int, fanout: int = 16, max_top: int = 2048):
+        assert capacity >= 1 and fanout >= 2 and max_top >= 1
+        self.size = capacity
+        self.fanout = fanout
+        self.depth = 0
+        while -(-capacity // fanout**self.depth) > max_top:
+            self.depth += 1
+        top = -(-capacity // fanout**self.depth)
+        self.levels = [np.zeros(top * fanout**d, dtype=np.float64) for d in range(self.depth + 1)]
+        self._upper = np.triu(np.ones((fanout, fanout)))
+        self._ones = np.ones(fanout)
+
+    @property
+    def total(self) -> float:
+        return float(self.levels[0].sum())
+
+    def get(self, indices) -> np.ndarray:
+        """Returns the values of the leaves `indices`."""
+        return self.levels[-1][indices]
+
+    def update(self, indices, values) -> None:
+        """Sets the leaves `indices` to `values` and refreshes their ancestors.
+
+        Duplicated indices keep the last value, as with NumPy assignment.
+        """
+        nodes = np.asarray(indices, dtype=np.int64)
+        self.levels[-1][nodes] = values
+        for depth in range(self.depth, 0, -1):
+            # Shared ancestors are written several times with the same sum, cheaper than deduplicating; a product
+            # with ones sums the small rows faster than sum(axis=1)
+            nodes = nodes // self.fanout
+            self.levels[depth - 1][nodes] = self.levels[depth].reshape(-1, self.fanout).take(nodes, axis=0) @ self._ones
+
+    def find(self, prefix_sums) -> np.ndarray:
+        """Returns, for each value in `prefix_sums`, the leaf whose cumulative range contains it.
+
+        Increasing `prefix_sums` give increasing leaves.
+        """
+        return self._find(np.array(prefix_sums, dtype=np.float64), np.cumsum(self.levels[0]))
+
+    def _find(self, prefix_sums, cumulative):
+        # Keep every prefix below the sum of its node despite rounding, then take the first node whose cumulative
+        # sum exceeds it, so empty nodes (and padding) are never chosen. Scaling by 1 - 2**-52 lowers any normal
+        # double by one or two ulps, like a much slower nextafter(sum, 0)
+        np.minimum(prefix_sums, cumulative[-1] * _BELOW, out=prefix_sums)
+        nodes = np.searchsorted(cumulative, prefix_sums, side="right")
+        prefix_sums -= cumulative[nodes] - self.levels[0][nodes]
+        offsets = np.arange(len(prefix_sums)) * self.fanout
+        for depth in range(1, self.depth + 1):
+            children = self.levels[depth].reshape(-1, self.fanout).take(nodes, axis=0)
+            cumulative = children @ self._upper #row-wise cumulative sums, much faster than cumsum(axis=1)
+            np.minimum(prefix_sums, cumulative[:, -1] * _BELOW, out=prefix_sums)
+            child = (cumulative <= prefix_sums[:, None]).argmin(axis=1) #first False, the clamp guarantees one
+            picked = offsets + child
+            prefix_sums -= cumulative.ravel()[picked] - children.ravel()[picked]
+            nodes = nodes * self.fanout + child
+        return nodes
+
+    def sample(self, batch_size: int, rng=np.random) -> np.ndarray:
+        """Draws `batch_size` leaves proportionally to their values, one per equal-mass stratum, in increasing order."""
+        return self.sample_batches(batch_size, 1, rng)[0]
+
+    def sample_batches(self, batch_size: int, num_batches: int, rng=np.random) -> np.ndarray:
+        """Draws `num_batches` independent batches as `sample` does, in one walk of the tree.
+
+        The cost of a walk is mostly per NumPy call, so a walk for several
+        batches costs much less than one walk per batch.
+
+        Returns:
+            A `(num_batches, batch_size)` array, every row in increasing order.
+        """
+        cumulative = np.cumsum(self.levels[0])
+        # Row i holds the draws of every batch in stratum i, so each column is one stratified batch
+        bounds = (np.arange(batch_size)[:, None] + rng.uniform(size=(batch_size, num_batches))) * \
+            (cumulative[-1] / batch_size)
+        return self._find(bounds.ravel(), cumulative).reshape(batch_size, num_batches).T
@@ -0,0 +1,107 @@
+import collections
+import time
+
+import numpy as np
+
+
+class _NullPhase(object):
+    """Context manager that does nothing, shared by every phase of a disabled timer."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, samples):
+        self._samples = samples
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._samples.append(time.perf_counter() - self._start)
+        return False
+
+
+class PhaseTimer(object):
+    """Rolling wall-time statistics of the phases of an environment step.
+
+    Usage:
+
+        with timer.phase('tick'):
+            world.tick()
+
+    Each phase keeps its last `window` durations. `summary` returns their
+    percentiles in milliseconds, recomputed every `report_interval` calls
+    and cached in between. A disabled timer hands out a shared no-op
+    context, so instrumented code costs one attribute lookup and call.
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 1000, report_interval: int = 100,
+                 percentiles=(50, 90, 99)):
+        """Constructs the timer.
+
+        Args:
+            enabled: If False no time is measured.
+            window: The number of most recent durations kept per phase.
+            report_interval: The number of `summary` calls between two recomputations.
+            percentiles: The percentiles reported per phase.
+        """
+        self.enabled = enabled
+        self.window = window
+        self.report_interval = report_interval
+        self.percentiles = tuple(percentiles)
+        self._samples = collections.OrderedDict()
+        self._phases = {}
+        self._summary = {}
+        self._calls = 0
+
+    def phase(self, name: str):
+        """Returns the context manager timing `name`."""
+        if not self.enabled:
+            return _NULL_PHASE
+        phase = self._phases.get(name)
+        if phase is None:
+            self._samples[name] = collections.deque(maxlen=self.window)
+            phase = self._phases[name] = _Phase(self._samples[name])
+        return phase
+
+    def start(self, name: str) -> None:
+        """Starts timing `name`, for spans that do not fit a `with` block."""
+        self.phase(name).__enter__()
+
+    def stop(self, name: str) -> None:
+        """Stops timing `name`, see `start`."""
+        self.phase(name).__exit__(None, None, None)
+
+    def summary(self):
+        """Returns `{'<phase>_p<q>_ms': value}` for every phase and percentile."""
+        if not self.enabled:
+            return {}
+        if self._calls % self.report_interval == 0:
+            summary = {}
+            for name, samples in self._samples.items():
+                if not samples:
+                    continue
+                values = np.percentile(np.fromiter(samples, dtype=np.float64), self.percentiles) * 1000.0
+                for q, value in zip(self.percentiles, values):
+                    summary["{}_p{}_ms".format(name, q)] = float(value)
+            self._summary = summary
+        self._calls += 1
+        return dict(self._summary)
+
+    def reset(self):
+        """Drops every recorded duration."""
+        for samples in self._samples.values():
+            samples.clear()
+        self._summary = {}
+        self._calls = 0
@@ -1,31 +1,85 @@
 import gym
 import numpy as np
 from stable_baselines3 import SAC
-from stable_baselines3.sac import CnnPolicy
+from stable_baselines3.sac import CnnPolicy, MlpPolicy
 from stable_baselines3.common.noise import NormalActionNoise
 from stable_baselines3.common.evaluation import evaluate_policy
 from carla_env import CarlaEnv
+from vec_env import make_carla_vec_env
+from callbacks import TimingCallback
+from replay_buffers import CompressedReplayBuffer, MemmapReplayBuffer, PrioritizedReplayBuffer
+from prioritized_sac import PrioritizedSAC
+from actor_learner import ActorLearner
+from latent_replay import (collect_frames, load_encoder, make_encoder, make_latent_env, pretrain_encoder,
+                           save_encoder)
 from gym.spaces import Discrete
 import sys
 import argparse
 import torch
 import glob
 import sys
-#from stable_baselines3.common.buffers import PrioritizedReplayBuffer
 
 def main(model_name, load_model, town, fps, im_width, im_height, repeat_action, start_transform_type, sensors, 
-         enable_preview, enable_spectator, steps_per_episode, seed=7, action_type='fix_throttle'):
+         enable_preview, enable_spectator, steps_per_episode, seed=7, action_type='fix_throttle',
+         num_envs=1, host='localhost', base_port=2000, base_tm_port=8000, render_schedule='every_tick',
+         replay_buffer='ram', buffer_path=None, actor_learner=False, codec='zlib', jpeg_quality=90,
+         latent_replay=False, encoder_path=None, pretrain_frames=5000, reward_type='distance_from_start'):
 
-    env = CarlaEnv(town, fps, im_width, im_height, repeat_action, start_transform_type, sensors,
-                   action_type, enable_preview, enable_spectator, steps_per_episode, playing=False)
+    # 'memmap' keeps the uint8 observations once, in a file backed ring, instead of obs and next_obs in RAM,
+    # 'prioritized' adds sum-tree prioritized sampling on top of it, trained by PrioritizedSAC,
+    # 'compressed' keeps them once in RAM, encoded with codec, and decodes minibatches in background threads
+    if latent_replay and actor_learner:
+        raise ValueError('latent replay is not supported by the actor-learner mode')
+    if latent_replay and replay_buffer == 'compressed': #the frame codecs only take uint8 images, not float16 features
+        raise ValueError('latent replay is not supported by the compressed replay buffer')
+    algorithm = SAC
+    if replay_buffer == 'memmap':
+        buffer_kwargs = dict(replay_buffer_class=MemmapReplayBuffer, replay_buffer_kwargs=dict(path=buffer_path))
+    elif replay_buffer == 'prioritized':
+        algorithm = PrioritizedSAC
+        buffer_kwargs = dict(replay_buffer_class=PrioritizedReplayBuffer,
+                             replay_buffer_kwargs=dict(path=buffer_path, alpha=0.6, beta=0.4))
+    elif replay_buffer == 'compressed':
+        buffer_kwargs = dict(replay_buffer_class=CompressedReplayBuffer,
+                             replay_buffer_kwargs=dict(codec=codec, quality=jpeg_quality))
+    else:
+        buffer_kwargs = {}
+
+    env_kwargs = dict(town=town, fps=fps, im_width=im_width, im_height=im_height, repeat_action=repeat_action,
+                      start_transform_type=start_transform_type, sensors=sensors, action_type=action_type,
+                      enable_preview=enable_preview, enable_spectator=enable_spectator,
+                      steps_per_episode=steps_per_episode, playing=False, render_schedule=render_schedule,
+                      reward_type=reward_type)
+    if actor_learner: #collector processes own the training envs
+        env = None
+    elif num_envs > 1: #one CARLA server per worker, listening on base_port, base_port+3, ...
+        env = make_carla_vec_env(num_envs, env_kwargs, host=host, base_port=base_port, base_tm_port=base_tm_port,
+                                 seed=seed)
+    else:
+        env = CarlaEnv(town, fps, im_width, im_height, repeat_action, start_transform_type, sensors,
+                       action_type, enable_preview, enable_spectator, steps_per_episode, playing=False,
+                       host=host, port=base_port, tm_port=base_tm_port, render_schedule=render_schedule,
+                       reward_type=reward_type)
     test_env = CarlaEnv(town, fps, im_width, im_height, repeat_action, start_transform_type, sensors,
-                   action_type, enable_preview=True, enable_spectator=True, steps_per_episode=steps_per_episode, playing=True)
+                   action_type, enable_preview=True, enable_spectator=True, steps_per_episode=steps_per_episode, playing=True,
+                   host=host, port=base_port, tm_port=base_tm_port, reward_type=reward_type)
 
-    try:
+    policy = CnnPolicy
+    if latent_replay: #SAC heads on float16 features of a frozen encoder, no CNN in the gradient steps
+        if encoder_path is not None: #save_encoder file or CnnPolicy SAC model .zip
+            encoder = load_encoder(encoder_path)
+        else: #autoencoder pretraining on random-action frames
+            encoder = make_encoder(env.observation_space)
+            pretrain_encoder(encoder, collect_frames(env, pretrain_frames))
+            save_encoder(encoder, model_name + '_encoder.pt')
+        env = make_latent_env(env, encoder)
+        test_env = make_latent_env(test_env, encoder)
+        policy = MlpPolicy
+
+    def make_model(env):
         if load_model:
             device = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
-            #buffer = PrioritizedReplayBuffer(buffer_size=500000, alpha=0.6) #prioritized exp replay buffer, uncomment buffer_size if this is commented
-            model = SAC.load(
+            return algorithm.load(
                 model_name, 
                 env,
                 #action_noise=NormalActionNoise(mean=np.array([-0.1]), sigma=np.array([0.2])), #throttle max=0.5, brake max = -0.7                               
@@ -33,13 +87,13 @@ def main(model_name, load_model, town, fps, im_width, im_height, repeat_action,
                 #action_noise=NormalActionNoise(mean=np.array([0.3, 0.0]), sigma=np.array([0.5, 0.1])),
                 device=device,
                 buffer_size=500000,
-                #replay_buffer= buffer,
-                batch_size=256
+                batch_size=256,
+                **buffer_kwargs
                 ) #defaul batch size,buffer size if not
         else:
             device = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
-            model = SAC(
-                CnnPolicy, 
+            return algorithm(
+                policy, 
                 env, 
                 verbose=2,
                 seed=seed, 
@@ -48,16 +102,32 @@ def main(model_name, load_model, town, fps, im_width, im_height, repeat_action,
                 action_noise=NormalActionNoise(mean=np.array([0]), sigma=np.array([0.2])), #only steering
                 #action_noise=NormalActionNoise(mean=np.array([0.3, 0]), sigma=np.array([0.5, 0.1])),
                 buffer_size=500000,
-                batch_size=256
+                batch_size=256,
+                **buffer_kwargs
                 )
-                
-             
 
-        print(model.__dict__)
-        model.learn(
-            total_timesteps=20000, 
-            log_interval=4, 
-            tb_log_name=model_name)
+    model = None
+    learner = None
+    try:
+        if actor_learner:
+            # num_envs collector processes step CarlaEnv while this process trains continuously
+            learner = ActorLearner(make_model, num_envs, env_kwargs, test_env.observation_space,
+                                   test_env.action_space, host=host, base_port=base_port,
+                                   base_tm_port=base_tm_port, seed=seed,
+                                   action_noise=NormalActionNoise(mean=np.array([0]), sigma=np.array([0.2])))
+            try:
+                model = learner.learn(total_timesteps=20000, batch_size=256, tensorboard_log='./logs/sem_sac',
+                                      tb_log_name=model_name) #env and gradient steps/sec under actor_learner/
+            finally:
+                learner.stop() #collector 0 ticks the server of test_env, it must be idle during evaluation
+        else:
+            model = make_model(env)
+            print(model.__dict__)
+            model.learn(
+                total_timesteps=20000, 
+                log_interval=4, 
+                tb_log_name=model_name,
+                callback=TimingCallback()) #per-phase env step timings under timing/ in tensorboard
         mean_reward, std_reward = evaluate_policy(model, test_env, n_eval_episodes=10) 
             #eval_env=test_env, 
             #eval_freq=1000, 
@@ -65,8 +135,13 @@ def main(model_name, load_model, town, fps, im_width, im_height, repeat_action,
             #)
         model.save('/home/aku8wk/Desktop/RL-SAC-Carla-main-edit/Carla-RL/'+ model_name) #change this location to the location with train_sac.py
     finally:
-        env.close()
+        if learner is not None: #after evaluation and saving, see SimulatorSession.release
+            learner.close()
+        if env is not None:
+            env.close()
         test_env.close()
+        if isinstance(getattr(model, 'replay_buffer', None), MemmapReplayBuffer):
+            model.replay_buffer.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
@@ -83,6 +158,33 @@ if __name__ == "__main__":
     parser.add_argument('--spectator', action='store_true', help='whether to enable spectator camera')
     parser.add_argument('--episode-length', type=int, help='maximum number of steps per episode')
     parser.add_argument('--seed', type=int, default=7, help='random seed for initialization')
+    parser.add_argument('--num-envs', type=int, default=1, help='number of CarlaEnv workers, one CARLA server each')
+    parser.add_argument('--host', type=str, default='localhost', help='host of the CARLA servers')
+    parser.add_argument('--port', type=int, default=2000, help='RPC port of the first CARLA server')
+    parser.add_argument('--tm-port', type=int, default=8000, help='first Traffic Manager port to allocate')
+    parser.add_argument('--render-schedule', type=str, default='every_tick', choices=['every_tick', 'decision'],
+                        help='render the front camera every tick or only on the last tick of each repeated action')
+    parser.add_argument('--reward', type=str, default='distance_from_start',
+                        choices=['distance_from_start', 'route_progress'],
+                        help='reward the squared distance gained from the spawn point or the meters driven along '
+                             'the route')
+    parser.add_argument('--replay-buffer', type=str, default='ram', choices=['ram', 'memmap', 'prioritized', 'compressed'],
+                        help='keep replay observations in RAM, once in a disk-backed uint8 memmap, in a '
+                             'prioritized memmap buffer, or once in RAM, compressed with --codec')
+    parser.add_argument('--buffer-path', type=str, default=None,
+                        help='file backing the memmap replay buffer, a temporary file if not given')
+    parser.add_argument('--codec', type=str, default='zlib', choices=['zlib', 'png', 'jpeg'],
+                        help='frame codec of the compressed replay buffer, jpeg is lossy and only fits rgb')
+    parser.add_argument('--jpeg-quality', type=int, default=90, help='JPEG quality of the compressed replay buffer')
+    parser.add_argument('--latent-replay', action='store_true',
+                        help='train SAC heads on float16 features of a frozen CNN encoder instead of images')
+    parser.add_argument('--encoder', type=str, default=None,
+                        help='frozen encoder for --latent-replay: a saved encoder or a CnnPolicy SAC .zip, '
+                             'pretrained as an autoencoder if not given')
+    parser.add_argument('--pretrain-frames', type=int, default=5000,
+                        help='random-action frames collected to pretrain the --latent-replay encoder')
+    parser.add_argument('--actor-learner', action='store_true',
+                        help='collect with --num-envs CarlaEnv processes while a separate learner trains continuously')
     #parser.add_argument('--action_type', type=str, help='[continuous, discrete] action_type')
     
     args = parser.parse_args()
@@ -101,4 +203,9 @@ if __name__ == "__main__":
     seed = args.seed
     #action_type = args.action_type
 
-    main(model_name, load_model, town, fps, im_width, im_height, repeat_action, start_transform_type, sensors, enable_preview, enable_spectator, steps_per_episode, seed)
\ No newline at end of file
+    main(model_name, load_model, town, fps, im_width, im_height, repeat_action, start_transform_type, sensors, enable_preview, enable_spectator, steps_per_episode, seed,
+         num_envs=args.num_envs, host=args.host, base_port=args.port, base_tm_port=args.tm_port,
+         render_schedule=args.render_schedule, replay_buffer=args.replay_buffer, buffer_path=args.buffer_path,
+         actor_learner=args.actor_learner, codec=args.codec, jpeg_quality=args.jpeg_quality,
+         latent_replay=args.latent_replay, encoder_path=args.encoder, pretrain_frames=args.pretrain_frames,
+         reward_type=args.reward)
\ No newline at end of file
@@ -0,0 +1,278 @@
+import functools
+import multiprocessing
+import socket
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+
+import gym
+import numpy as np
+from absl import logging
+from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import SubprocVecEnv
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+from shm_arrays import SharedArrays
+
+
+class PortAllocator(object):
+    """Hands out `(rpc_port, tm_port)` pairs, one per `CARLA` server.
+
+    A `CARLA` server listening on `port` also binds `port + 1` (streaming)
+    and `port + 2` (secondary), so RPC ports are spaced by `port_stride`.
+    Traffic Manager servers run in the client process, so their ports are
+    probed on the local host and skipped when already taken or when they
+    overlap with an RPC port range.
+    """
+
+    def __init__(
+        self,
+        base_port: int = 2000,
+        port_stride: int = 3,
+        base_tm_port: int = 8000,
+        max_tm_probes: int = 100,
+    ):
+        """Constructs the allocator.
+
+        Args:
+            base_port: The RPC port of the first server.
+            port_stride: The spacing between two consecutive RPC ports.
+            base_tm_port: The first Traffic Manager port to try.
+            max_tm_probes: Number of candidate ports tried per Traffic Manager.
+        """
+        assert port_stride >= 3, "CARLA binds port, port+1 and port+2"
+        self.base_port = base_port
+        self.port_stride = port_stride
+        self.base_tm_port = base_tm_port
+        self.max_tm_probes = max_tm_probes
+        self._next_tm_port = base_tm_port
+        self._allocated: List[Tuple[int, int]] = []
+
+    @staticmethod
+    def is_port_free(port: int, host: str = "localhost") -> bool:
+        """Returns True if `port` can be bound on `host`."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind((host, port))
+            except OSError:
+                return False
+        return True
+
+    def _is_rpc_range(self, port: int, num_servers: int) -> bool:
+        offset = port - self.base_port
+        return 0 <= offset < num_servers * self.port_stride
+
+    def allocate(self, num_servers: Optional[int] = None) -> Tuple[int, int]:
+        """Returns the `(rpc_port, tm_port)` pair for the next server.
+
+        Args:
+            num_servers: The total number of servers that will be allocated,
+                so that no Traffic Manager port lands in the RPC range of a
+                later one. Defaults to the servers allocated so far plus this one.
+        """
+        if num_servers is None:
+            num_servers = len(self._allocated) + 1
+        rpc_port = self.base_port + len(self._allocated) * self.port_stride
+        for _ in range(self.max_tm_probes):
+            tm_port = self._next_tm_port
+            self._next_tm_port += 1
+            if self._is_rpc_range(tm_port, num_servers):
+                continue
+            if self.is_port_free(tm_port):
+                break
+            logging.debug("Traffic Manager port {} is busy, skipping".format(tm_port))
+        else:
+            raise RuntimeError("No free Traffic Manager port found after {} probes".format(self.max_tm_probes))
+        self._allocated.append((rpc_port, tm_port))
+        logging.debug("Allocated rpc_port={} tm_port={}".format(rpc_port, tm_port))
+        return rpc_port, tm_port
+
+    def allocate_many(self, num_servers: int) -> List[Tuple[int, int]]:
+        """Returns `num_servers` consecutive `(rpc_port, tm_port)` pairs."""
+        total = len(self._allocated) + num_servers
+        return [self.allocate(total) for _ in range(num_servers)]
+
+
+def _shm_worker(remote, parent_remote, env_fn_wrapper: CloudpickleWrapper) -> None:
+    # Like SB3's subprocess worker, but observations are written to the shared slot of this worker and only
+    # rewards, dones and infos are pickled through the pipe.
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    shared, index = None, None
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                observation, reward, done, info = env.step(data)
+                if done:
+                    shared["terminal_obs"][index] = observation
+                    observation = env.reset()
+                shared["obs"][index] = observation
+                remote.send((reward, done, info))
+            elif cmd == "reset":
+                shared["obs"][index] = env.reset()
+                remote.send(None)
+            elif cmd == "attach":
+                spec, index = data
+                shared = SharedArrays.attach(spec)
+                remote.send(None)
+            elif cmd == "render":
+                remote.send(env.render(data))
+            elif cmd == "close":
+                env.close()
+                if shared is not None:
+                    shared.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "seed":
+                remote.send(env.seed(data))
+            elif cmd == "env_method":
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(getattr(env, data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError("`{}` is not implemented in the worker".format(cmd))
+        except EOFError:
+            break
+
+
+class ShmSubprocVecEnv(SubprocVecEnv):
+    """`SubprocVecEnv` whose workers write observations to shared memory.
+
+    `SubprocVecEnv` pickles every observation through a pipe, which at
+    400x300x3 costs more than the step itself. Here each worker owns a
+    preallocated slot of a `multiprocessing.shared_memory` block (plus one
+    for the terminal observation of an auto-reset) and only the reward,
+    done flag and info cross the pipe. Observations are copied out of the
+    block once per step, since the next step overwrites the slots.
+
+    Only `gym.spaces.Box` observations are supported. The command protocol
+    of the workers is the one of `SubprocVecEnv`, so `env_method`,
+    `get_attr`, `set_attr`, `seed` and `close` are inherited.
+    """
+
+    def __init__(self, env_fns: List[Callable[[], gym.Env]], start_method: Optional[str] = None):
+        self.waiting = False
+        self.closed = False
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[context.Pipe() for _ in env_fns])
+        self.processes = []
+        for work_remote, remote, env_fn in zip(self.work_remotes, self.remotes, env_fns):
+            process = context.Process(target=_shm_worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)),
+                                      daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        assert isinstance(observation_space, gym.spaces.Box), "only Box observations can be shared"
+
+        shape = (len(env_fns), *observation_space.shape)
+        self.shared = SharedArrays({"obs": (shape, observation_space.dtype),
+                                    "terminal_obs": (shape, observation_space.dtype)})
+        for index, remote in enumerate(self.remotes):
+            remote.send(("attach", (self.shared.spec, index)))
+        for remote in self.remotes:
+            remote.recv()
+
+        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        rewards, dones, infos = zip(*results)
+        for index, done in enumerate(dones):
+            if done:
+                infos[index]["terminal_observation"] = self.shared["terminal_obs"][index].copy()
+        return self.shared["obs"].copy(), np.stack(rewards), np.stack(dones), infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.shared["obs"].copy()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        self.shared.close()
+
+
+def _make_env(env_kwargs: Mapping[str, Any], host: str, port: int, tm_port: int, seed: Optional[int]) -> gym.Env:
+    # Module level so that `SubprocVecEnv` can pickle it with any start method. `carla_env` (and the `carla`
+    # PythonAPI) is only imported in the workers, so `ShmSubprocVecEnv` works without it.
+    from carla_env import CarlaEnv
+
+    env = CarlaEnv(**env_kwargs, host=host, port=port, tm_port=tm_port)
+    if seed is not None:
+        env.seed(seed)
+    return env
+
+
+def make_carla_vec_env(
+    num_envs: int,
+    env_kwargs: Mapping[str, Any],
+    host: str = "localhost",
+    base_port: int = 2000,
+    port_stride: int = 3,
+    base_tm_port: int = 8000,
+    seed: Optional[int] = None,
+    start_method: Optional[str] = None,
+    transport: str = "shm",
+):
+    """Returns a `VecEnv` with one `CarlaEnv` worker per `CARLA` server.
+
+    Worker `i` connects to the server at `base_port + i * port_stride`, which
+    must already be running (e.g. `CarlaUE4.sh -carla-rpc-port=<port>`), and
+    drives its own Traffic Manager. Pointing `host`/`base_port` at a local
+    stand-in server allows running the workers without a GPU.
+
+    Args:
+        num_envs: The number of workers (and servers).
+        env_kwargs: Keyword arguments forwarded to every `CarlaEnv`.
+        host: The host the `CARLA` servers run on.
+        base_port: The RPC port of the first server.
+        port_stride: The spacing between two consecutive RPC ports.
+        base_tm_port: The first Traffic Manager port to try.
+        seed: The base random seed, worker `i` is seeded with `seed + i`.
+        start_method: The `multiprocessing` start method of the workers.
+        transport: 'shm' passes observations through shared memory (`ShmSubprocVecEnv`), 'pipe' pickles
+            them through the worker pipes (`SubprocVecEnv`).
+
+    Returns:
+        A `ShmSubprocVecEnv` or `SubprocVecEnv`, or a `DummyVecEnv` if `num_envs` is 1.
+    """
+    allocator = PortAllocator(base_port=base_port, port_stride=port_stride, base_tm_port=base_tm_port)
+    env_fns = []
+    for i, (port, tm_port) in enumerate(allocator.allocate_many(num_envs)):
+        logging.info("Worker {} uses CARLA server {}:{} with Traffic Manager port {}".format(i, host, port, tm_port))
+        env_fns.append(functools.partial(
+            _make_env, dict(env_kwargs), host, port, tm_port, None if seed is None else seed + i))
+
+    if num_envs == 1:
+        return DummyVecEnv(env_fns)
+    if transport == "shm":
+        return ShmSubprocVecEnv(env_fns, start_method=start_method)
+    if transport == "pipe":
+        return SubprocVecEnv(env_fns, start_method=start_method)
+    raise ValueError("unknown transport {}".format(transport))
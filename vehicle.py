@@ -5,6 +5,7 @@ import math
 import glob
 import os
 import sys
+import pure_pursuit
 
 # Connect to the Carla simulator
 client = carla.Client('localhost', 2000)
@@ -48,8 +49,8 @@ place = world.get_map()
 
 ##pure pursuit control
 
-L = 2.875 # Wheelbase of the vehicle (distance between the front and rear axles)
-Kdd = 4.0 # Look-ahead distance gain factor
+L = pure_pursuit.WHEELBASE # Wheelbase of the vehicle (distance between the front and rear axles)
+Kdd = pure_pursuit.KDD # Look-ahead distance gain factor
 alpha_prev = 0 # Previous steering angle error or heading error
 delta_prev = 0 # Previous steering angle
 
@@ -108,48 +109,6 @@ def display(disp=False):
         print("Delta= %.5f rad"%steer_angle)
         print("Error= %.3f m"%e)
 
-# Calculate steering angle Delta
-def calc_steering_angle(alpha, ld): #takes heading error and look ahead distance
-    delta_prev = 0 # Initialize the previous steering angle
-    delta = math.atan2(2*L*np.sin(alpha), ld) # Calculate the new steering angle
-    delta = np.fmax(np.fmin(delta, 1.0), -1.0) # Clip the steering angle within [-1, 1]
-    if math.isnan(delta): # Check if the calculated angle is NaN
-        delta = delta_prev # If NaN, revert to the previous steering angle
-    else:
-        delta_prev = delta # Update the previous steering angle
-    
-    return delta # Return the calculated steering angle
-
-# Get index of the target waypoint that the vehicle should aim for based on its current location and a list of waypoints
-def get_target_wp_index(veh_location, waypoint_list): #takes current location and waypoint list
-    dxl, dyl = [], [] # Initialize lists to store the differences in x and y coordinates
-    for i in range(len(waypoint_list)):
-        dx = abs(veh_location.x - waypoint_list[i][0]) #absolute difference in x coordinates
-        dxl.append(dx) # Append the difference to the list
-        dy = abs(veh_location.y - waypoint_list[i][1])
-        dyl.append(dy)
-
-    dist = np.hypot(dxl, dyl) #Euclidean distance from the vehicle location to each waypoint
-    idx = np.argmin(dist) + 4 #index of the waypoint with the minimum distance, with an offset of 4
-
-    # take closest waypoint, else last wp
-    if idx < len(waypoint_list):
-        tx = waypoint_list[idx][0] #x coordinate of the target waypoint
-        ty = waypoint_list[idx][1]
-    else:
-        tx = waypoint_list[-1][0] #If the index exceeds the list length, set the target waypoint to the last one
-        ty = waypoint_list[-1][1]
-
-    return idx, tx, ty, dist #index of closest waypoint+4, coordinates of idx waypoint, distance vector from each waypoint to vehcile location
-
-
-def get_lookahead_dist(vf, idx, waypoint_list, dist):
-    ld = Kdd*vf #lookahead distance, with forward velocity vf
-    # while ld > dist[idx] and (idx+1) < len(waypoint_list):
-    #     idx += 1
-    return ld
-
-
 # Debug Helper, to visualize the waypoints, starting location for drawing is loc1
 def draw(loc1, loc2=None, type=None):
     if type == "string": #draws X at loc1 that lasts for 2000ms
@@ -188,8 +147,10 @@ while t < noOfWp:
     vf = np.sqrt(veh_vel.x**2 + veh_vel.y**2) #forward velocity of the vehicle
     vf = np.fmax(np.fmin(vf, 2.5), 0.1) #Clips the forward velocity within the range [0.1, 2.5]
 
-    min_index, tx, ty, dist = get_target_wp_index(veh_location, waypoint_list)
-    ld = get_lookahead_dist(vf, min_index, waypoint_list, dist)
+    position = np.array([[veh_location.x, veh_location.y]])
+    idx, target, dist = pure_pursuit.target_waypoint_index(position, waypoint_list) #closest waypoint index+4 and its coordinates
+    min_index, (tx, ty) = int(idx[0]), target[0]
+    ld = pure_pursuit.lookahead_distance(vf, Kdd) #lookahead distance, with forward velocity vf
 
 
     yaw = np.radians(veh_transform.rotation.yaw)
@@ -203,7 +164,7 @@ while t < noOfWp:
 
     e = np.sin(alpha)*ld
     
-    steer_angle = calc_steering_angle(alpha, ld)
+    steer_angle = float(pure_pursuit.steering_angle(position, yaw, target, ld, L)[0]) # Clipped within [-1, 1]
     control.steer = steer_angle
     vehicle.apply_control(control)
 